@@ -10,6 +10,8 @@ Usage:
 Main Functions:
 - start: Handles the /start command, sending a welcome message to users.
 - bot_response: Responds to user messages by generating replies from the chatbot.
+- stream_reply: Sends a streamed answer as one Telegram message, edited as more of the answer arrives.
+- main: Builds the warm ChatbotRuntime once, registers the handlers and starts the webhook.
 
 Webhook Configuration:
     The module includes instructions for setting up a webhook to receive updates from Telegram.
@@ -18,10 +20,18 @@ Webhook Configuration:
 
 
 import os
+import time
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from dotenv import load_dotenv
-from answer_query import get_chatbot_response
+from auxiliaries import AsyncIterator
+from answer_query import get_chatbot_response_async, stream_chatbot_response
+from chatbot_runtime import ChatbotRuntime, VectorBackend
+from query_processor import AnsweringStrategy, RetrievalMode, AnswerFormat, ScoreThresholds
+from embedding_cache import EmbeddingCache
+from answer_cache import SemanticAnswerCache, DEFAULT_SIMILARITY_THRESHOLD
+from completion_cache import CompletionCache
+from tracing import tracer, start_metrics_server
 
 
 # Paste in browser to set up WEBHOOK:
@@ -37,6 +47,69 @@ load_dotenv()
 # Get the bot token from the environment
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
+# Key under which the warm ChatbotRuntime is stored in application.bot_data
+RUNTIME_KEY = "chatbot_runtime"
+
+# Number of updates processed at the same time, so one slow query does not hold up other users
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Send the Pinecone texts of each alpha value to GPT at once instead of one after the other
+CONCURRENT_CANDIDATES = os.getenv("CONCURRENT_CANDIDATES", "false").lower() == "true"
+
+# "per_passage" (one GPT call per retrieved text) or "single_call" (one GPT call for all retrieved texts)
+ANSWERING_STRATEGY = AnsweringStrategy(os.getenv("ANSWERING_STRATEGY", AnsweringStrategy.PER_PASSAGE.value))
+
+# "per_alpha" (one Pinecone query per alpha value) or "single_round_trip" (one query re-ranked locally)
+RETRIEVAL_MODE = RetrievalMode(os.getenv("RETRIEVAL_MODE", RetrievalMode.PER_ALPHA.value))
+
+# Cache query embeddings in memory and on disk (opt-in), so repeated questions skip the embeddings API
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "false").lower() == "true"
+
+# "pinecone" (query the Pinecone service) or "local" (query an in-memory index built from the batch output)
+VECTOR_BACKEND = VectorBackend(os.getenv("VECTOR_BACKEND", VectorBackend.PINECONE.value))
+
+# Reuse answers of near-duplicate questions (opt-in: questions differing only in a detail, e.g. the options, get the same answer).
+# Cached answers are dropped when the vector counts of the index change
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", str(DEFAULT_SIMILARITY_THRESHOLD)))
+
+# Stream each completion and stop it as soon as GPT answers with the '' sentinel, instead of waiting for the full response
+ABORT_UNANSWERABLE = os.getenv("ABORT_UNANSWERABLE", "false").lower() == "true"
+
+# "sentinel" (GPT answers '' when a passage does not answer) or "json_verdict" (GPT answers with an answered/inconclusive/not_found verdict)
+ANSWER_FORMAT = AnswerFormat(os.getenv("ANSWER_FORMAT", AnswerFormat.SENTINEL.value))
+
+# Show the answer while GPT writes it, by editing the reply at most once every STREAM_EDIT_INTERVAL seconds
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Reuse GPT's response to a question/passage pair across users and restarts (opt-in), for COMPLETION_CACHE_TTL_DAYS days,
+# or COMPLETION_CACHE_NOT_FOUND_TTL_HOURS hours when the passage did not answer
+COMPLETION_CACHE = os.getenv("COMPLETION_CACHE", "false").lower() == "true"
+COMPLETION_CACHE_TTL_DAYS = float(os.getenv("COMPLETION_CACHE_TTL_DAYS", "30"))
+COMPLETION_CACHE_NOT_FOUND_TTL_HOURS = float(os.getenv("COMPLETION_CACHE_NOT_FOUND_TTL_HOURS", "1"))
+
+# Order the alpha values per query from its TF-IDF statistics, so jargon-heavy questions try sparse retrieval first
+ADAPTIVE_ALPHA = os.getenv("ADAPTIVE_ALPHA", "false").lower() == "true"
+
+# Pinecone score thresholds (unset = not applied): skip matches below SCORE_CANDIDATE_FLOOR, stop the alpha sweep after an
+# unanswered match above SCORE_STRONG_HIT, and answer "not found" without GPT when no match reaches SCORE_NOT_FOUND_BELOW
+SCORE_THRESHOLDS = {option: float(os.environ[variable])
+                    for option, variable in [("candidate_floor", "SCORE_CANDIDATE_FLOOR"),
+                                             ("strong_hit", "SCORE_STRONG_HIT"),
+                                             ("not_found_below", "SCORE_NOT_FOUND_BELOW")
+                                             ]
+                    if os.getenv(variable)
+                    }
+
+# Gather the embeddings of queries arriving within EMBEDDING_BATCH_WINDOW_MS milliseconds (0 = no batching) into one API call
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Time the query pipeline stages and serve them in the Prometheus text format on http://<host>:METRICS_PORT/metrics
+TRACING = os.getenv("TRACING", "false").lower() == "true"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
 
 # Define a start command handler to greet the user when they use /start
 async def start(update: Update, context):
@@ -59,12 +132,87 @@ async def bot_response(update: Update, context):
     Args:
         update (Update): Incoming update containing the user's message.
         context (Context): The context for the message, including data related to the update.
+            The warm ChatbotRuntime is read from context.bot_data[RUNTIME_KEY].
     """
     
     user_message = update.message.text
-    bot_response = get_chatbot_response(user_message)
-    await update.message.reply_text(bot_response)
+    runtime: ChatbotRuntime = context.bot_data[RUNTIME_KEY]
+
+    if STREAM_REPLIES:
+        await stream_reply(update, context, stream_chatbot_response(user_message, runtime))
+        return
+
+    bot_response = await get_chatbot_response_async(user_message, runtime)
+    with tracer.span("telegram_delivery"):
+        await update.message.reply_text(bot_response)
+
+
+
+async def stream_reply(update: Update, context, answer_pieces: AsyncIterator[str]):
+    """
+    Sends a streamed answer as a single reply: the message is sent with the first piece of text, then edited
+    with the text received so far at most once every STREAM_EDIT_INTERVAL seconds (Telegram rate-limits edits),
+    and a last time with the complete answer.
+
+    Args:
+        update (Update): Incoming update containing the user's message.
+        context (Context): The context for the message, including data related to the update.
+        answer_pieces (AsyncIterator[str]): The pieces of the answer, in order.
+    """
+
+    reply = None
+    answer_text = shown_text = ""
+    last_edit = 0.0
+
+    async for answer_piece in answer_pieces:
+        answer_text += answer_piece
+        if not answer_text.strip():
+            continue
+
+        if reply is None:
+            with tracer.span("telegram_delivery"):
+                reply = await update.message.reply_text(answer_text)
+            shown_text, last_edit = answer_text, time.monotonic()
+
+        elif time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+            with tracer.span("telegram_edit"):
+                await context.bot.edit_message_text(answer_text, chat_id = reply.chat_id, message_id = reply.message_id)
+            shown_text, last_edit = answer_text, time.monotonic()
+
+    if reply is not None and answer_text != shown_text:
+        with tracer.span("telegram_edit"):
+            await context.bot.edit_message_text(answer_text, chat_id = reply.chat_id, message_id = reply.message_id)
+
+
+
+
+def build_runtime()-> ChatbotRuntime:
+
+    """
+    Builds the ChatbotRuntime with the query settings read from the environment.
+
+    Returns:
+        ChatbotRuntime: The warm runtime shared by every message.
+    """
 
+    return ChatbotRuntime.from_environment(vector_backend = VECTOR_BACKEND,
+                                           concurrent_candidates = CONCURRENT_CANDIDATES,
+                                           answering_strategy = ANSWERING_STRATEGY,
+                                           retrieval_mode = RETRIEVAL_MODE,
+                                           embedding_cache = EmbeddingCache.from_folder() if EMBEDDING_CACHE else None,
+                                           answer_cache = SemanticAnswerCache(ANSWER_CACHE_THRESHOLD) if ANSWER_CACHE else None,
+                                           abort_unanswerable = ABORT_UNANSWERABLE,
+                                           answer_format = ANSWER_FORMAT,
+                                           completion_cache = (CompletionCache.from_folder(ttl_seconds = COMPLETION_CACHE_TTL_DAYS * 24 * 3600,
+                                                                                           not_found_ttl_seconds = COMPLETION_CACHE_NOT_FOUND_TTL_HOURS * 3600
+                                                                                           )
+                                                               if COMPLETION_CACHE else None
+                                                               ),
+                                           adaptive_alpha = ADAPTIVE_ALPHA,
+                                           score_thresholds = ScoreThresholds(**SCORE_THRESHOLDS) if SCORE_THRESHOLDS else None,
+                                           embedding_batch_window = EMBEDDING_BATCH_WINDOW_MS / 1000,
+                                           embedding_batch_size = EMBEDDING_BATCH_SIZE
+                                           )
 
 
 
@@ -74,12 +222,25 @@ def main():
     """
     Sets up the Telegram bot and starts listening for updates.
 
-    Initializes the application, adds command and message handlers, and runs the webhook
-    to handle incoming messages.
+    Initializes the application, builds the chatbot runtime, adds command and message handlers,
+    and runs the webhook to handle incoming messages.
     """
     
     # Initialize the Application (formerly Updater), which connects to the Telegram API
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (Application.builder()
+                   .token(TELEGRAM_TOKEN)
+                   .concurrent_updates(CONCURRENT_UPDATES)
+                   .build()
+                   )
+
+    # Load the vectorizer and the Pinecone/OpenAI clients once, shared by every message
+    application.bot_data[RUNTIME_KEY] = build_runtime()
+
+    # Serve the stage latencies, token counts and cache counters to Prometheus
+    if TRACING:
+        tracer.enabled = True
+        runtime: ChatbotRuntime = application.bot_data[RUNTIME_KEY]
+        start_metrics_server(METRICS_PORT, lambda: tracer.render_prometheus(component_counters = runtime.component_counters()))
 
     # Add a handler for the /start command
     application.add_handler(CommandHandler('start', start))
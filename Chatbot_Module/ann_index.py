@@ -0,0 +1,277 @@
+
+"""
+ann_index.py
+
+This module provides an approximate nearest-neighbour index for the dense side of retrieval, written with NumPy only. It uses an inverted file (IVF) design: the vectors are clustered with spherical k-means, and a query only scores the vectors of the n_probe clusters whose centroids are closest to it. This keeps query latency roughly flat as more textbooks are loaded into the same index.
+
+Usage:
+    ann = IVFIndex(n_lists = 64, n_probe = 8)
+    ann.train(dense_matrix)
+    ann.add(dense_matrix)
+    scores, indices = ann.search(query_vectors, k = 3)
+
+    Attach it to a LocalHybridIndex (local_index.attach_dense_ann(ann)) to use it on the chatbot's query path.
+
+Main Classes:
+- IVFIndex: Inverted-file index with tunable n_lists/n_probe, incremental add, and save/load to an .npz file.
+
+Main Functions:
+- load_or_build_ivf_index: Loads a saved IVFIndex matching a set of vectors, or trains, fills and saves a new one.
+"""
+
+
+from auxiliaries import List, Tuple, Union, os, np
+
+
+
+ANN_INDEX_FOLDER = "cache"
+ANN_INDEX_FILE = "dense_ivf_index.npz"
+
+
+
+class IVFIndex:
+
+    """
+    An inverted-file approximate nearest-neighbour index scored by dot product.
+
+    Recall and latency are traded off with n_lists (number of clusters) and n_probe (number of clusters
+    scored per query): n_probe == n_lists is an exact search.
+    """
+
+    def __init__(self, n_lists: int = 64, n_probe: int = 8, seed: int = 0):
+
+        """
+        Initializes the IVFIndex instance.
+
+        Args:
+            n_lists (int): Number of clusters (inverted lists). Defaults to 64.
+            n_probe (int): Default number of clusters scored per query. Defaults to 8.
+            seed (int): Seed for the k-means initialization. Defaults to 0.
+        """
+
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids: Union[np.ndarray, None] = None
+        self.vectors: Union[np.ndarray, None] = None
+        self.assignments = np.empty(0, dtype = np.int32)
+        self._lists: List[np.ndarray] = []
+
+
+    @property
+    def is_trained(self)-> bool:
+
+        return self.centroids is not None
+
+
+    def __len__(self)-> int:
+
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray)-> np.ndarray:
+
+        norms = np.linalg.norm(matrix, axis = 1, keepdims = True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+
+    def train(self, training_vectors: np.ndarray, iterations: int = 20)-> None:
+
+        """
+        Learns the cluster centroids with spherical k-means.
+
+        Args:
+            training_vectors (np.ndarray): The n x d vectors to cluster (usually the vectors about to be added).
+            iterations (int): Number of k-means iterations. Defaults to 20.
+        """
+
+        training_vectors = self._normalize_rows(np.asarray(training_vectors, dtype = np.float32))
+        n_lists = min(self.n_lists, training_vectors.shape[0])
+
+        rng = np.random.default_rng(self.seed)
+        centroids = training_vectors[rng.choice(training_vectors.shape[0], n_lists, replace = False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(training_vectors @ centroids.T, axis = 1)
+            for list_index in range(n_lists):
+                members = training_vectors[assignments == list_index]
+                if len(members):
+                    centroids[list_index] = members.sum(axis = 0)
+                else:
+                    # Re-seed empty clusters so every list stays usable
+                    centroids[list_index] = training_vectors[rng.integers(training_vectors.shape[0])]
+            centroids = self._normalize_rows(centroids)
+
+        self.centroids = centroids
+        self.n_lists = n_lists
+        self._lists = [np.empty(0, dtype = np.int64) for _ in range(n_lists)]
+
+
+    def add(self, vectors: np.ndarray)-> np.ndarray:
+
+        """
+        Adds vectors to the index, assigning each to its closest centroid. The index must be trained.
+
+        Args:
+            vectors (np.ndarray): The m x d vectors to add.
+
+        Returns:
+            np.ndarray: The positions given to the added vectors (their row numbers in self.vectors).
+
+        Raises:
+            ValueError: If the index has not been trained.
+        """
+
+        if not self.is_trained:
+            raise ValueError("IVFIndex must be trained before vectors are added")
+
+        vectors = np.atleast_2d(np.asarray(vectors, dtype = np.float32))
+        start = len(self)
+        positions = np.arange(start, start + vectors.shape[0])
+
+        assignments = np.argmax(self._normalize_rows(vectors) @ self.centroids.T, axis = 1).astype(np.int32)
+        self.vectors = vectors.copy() if self.vectors is None else np.vstack([self.vectors, vectors])
+        self.assignments = np.concatenate([self.assignments, assignments])
+
+        for list_index in np.unique(assignments):
+            self._lists[list_index] = np.concatenate([self._lists[list_index], positions[assignments == list_index]])
+
+        return positions
+
+
+    def candidates(self, query: np.ndarray, n_probe: Union[int, None] = None)-> np.ndarray:
+
+        """
+        Returns the positions of the vectors in the n_probe clusters closest to a query.
+
+        Args:
+            query (np.ndarray): The d-dimensional query vector.
+            n_probe (Union[int, None]): Number of clusters to probe. Defaults to self.n_probe.
+
+        Returns:
+            np.ndarray: The candidate positions.
+        """
+
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_scores = self.centroids @ np.asarray(query, dtype = np.float32)
+        probed_lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        return np.concatenate([self._lists[list_index] for list_index in probed_lists])
+
+
+    def search(self, queries: np.ndarray, k: int = 3, n_probe: Union[int, None] = None)-> Tuple[np.ndarray, np.ndarray]:
+
+        """
+        Finds the approximate top-k vectors by dot product for each query.
+
+        Args:
+            queries (np.ndarray): The m x d query vectors (or a single d-dimensional vector).
+            k (int): Number of neighbours per query. Defaults to 3.
+            n_probe (Union[int, None]): Number of clusters to probe. Defaults to self.n_probe.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The m x k scores and positions, best first. Rows with fewer than k
+            candidates are padded with -inf scores and -1 positions.
+        """
+
+        queries = np.atleast_2d(np.asarray(queries, dtype = np.float32))
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype = np.float32)
+        all_positions = np.full((queries.shape[0], k), -1, dtype = np.int64)
+
+        for row, query in enumerate(queries):
+            candidate_positions = self.candidates(query, n_probe)
+            if not candidate_positions.size:
+                continue
+
+            scores = self.vectors[candidate_positions] @ query
+            top = min(k, scores.size)
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best], kind = "stable")]
+
+            all_scores[row, :top] = scores[best]
+            all_positions[row, :top] = candidate_positions[best]
+
+        return all_scores, all_positions
+
+
+    def save(self, path: str)-> None:
+
+        """
+        Saves the trained index and its vectors to an .npz file.
+
+        Args:
+            path (str): The destination file.
+        """
+
+        np.savez(path,
+                 centroids = self.centroids,
+                 vectors = self.vectors if self.vectors is not None else np.empty((0, self.centroids.shape[1]), dtype = np.float32),
+                 assignments = self.assignments,
+                 params = np.array([self.n_lists, self.n_probe, self.seed])
+                 )
+
+
+    @classmethod
+    def load(cls, path: str)-> "IVFIndex":
+
+        """
+        Loads an index saved with save().
+
+        Args:
+            path (str): The .npz file.
+
+        Returns:
+            IVFIndex: The index, ready for search and further adds.
+        """
+
+        with np.load(path) as saved:
+            n_lists, n_probe, seed = (int(value) for value in saved["params"])
+            index = cls(n_lists, n_probe, seed)
+            index.centroids = saved["centroids"]
+            index.vectors = saved["vectors"] if saved["vectors"].shape[0] else None
+            index.assignments = saved["assignments"].astype(np.int32)
+
+        positions = np.arange(len(index))
+        index._lists = [positions[index.assignments == list_index] for list_index in range(index.n_lists)]
+        return index
+
+
+
+def load_or_build_ivf_index(vectors: np.ndarray,
+                            index_folder: str = ANN_INDEX_FOLDER,
+                            index_file: str = ANN_INDEX_FILE,
+                            **ivf_options
+                            )-> IVFIndex:
+
+    """
+    Loads the saved IVFIndex if it holds exactly the given vectors, otherwise trains a new one on the vectors,
+    adds them and saves it for the next start (e.g. after the embeddings were regenerated).
+
+    Args:
+        vectors (np.ndarray): The n x d vectors the index must hold, in order.
+        index_folder (str): The folder of the saved index, relative to the project root.
+        index_file (str): The name of the saved index file.
+        **ivf_options: Parameters forwarded to IVFIndex (n_lists, n_probe, seed).
+
+    Returns:
+        IVFIndex: The index.
+    """
+
+    index_folderpath = os.path.join("..", index_folder)
+    index_filepath = os.path.join(index_folderpath, index_file)
+
+    if os.path.isfile(index_filepath):
+        index = IVFIndex.load(index_filepath)
+        if index.vectors is not None and np.array_equal(index.vectors, vectors):
+            return index
+        print(f"Saved ANN index {index_filepath} does not hold the current {vectors.shape[0]} vectors. Rebuilding...")
+
+    index = IVFIndex(**ivf_options)
+    index.train(vectors)
+    index.add(vectors)
+
+    os.makedirs(index_folderpath, exist_ok = True)
+    index.save(index_filepath)
+    print(f"ANN index saved to {index_filepath}")
+    return index
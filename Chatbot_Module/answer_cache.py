@@ -0,0 +1,181 @@
+
+"""
+answer_cache.py
+
+This module caches the chatbot's answers by meaning rather than by exact text. Students often paraphrase the same exam question, so the embedding of an incoming query is compared with the embeddings of previously answered queries; a close enough match returns the stored answer (with its page reference) without querying Pinecone or GPT.
+
+Usage:
+    Create one SemanticAnswerCache per process and give it to the ChatbotRuntime. Every lookup and store carries the current version of the index (the runtime derives it from the index statistics). A lookup with a new version discards the answers built from the old index; a store with another version than the cache's is dropped, since its answer was built while the index changed.
+
+    The runtime's version only reflects the vector counts of the index. Re-upserting the same ids with new content keeps the counts, so it does not invalidate the cache: restart the bot (the cache is in memory) after such an upload.
+
+    The cache trades accuracy for speed: two questions above the similarity threshold get the same answer, even if they differ in a detail that changes it (e.g. an exam question with the same stem but other options). It is therefore off unless enabled.
+
+Main Classes:
+- SemanticAnswerCache: In-memory answer cache searched by cosine similarity, with LRU/age eviction and index-version invalidation.
+"""
+
+
+import threading
+import time
+
+from auxiliaries import List, Dict, Union, np
+
+
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+class SemanticAnswerCache:
+
+    """
+    An answer cache searched by cosine similarity of query embeddings.
+
+    The normalized embeddings of cached queries are kept in one contiguous float32 matrix, so a lookup is a
+    single matrix-vector product. Entries older than max_age_seconds are ignored and dropped, and when the
+    cache is full the least recently used entry is replaced.
+    """
+
+    def __init__(self,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 max_entries: int = 2048,
+                 max_age_seconds: float = 7 * 24 * 3600,
+                 embedding_dimension: int = 1536
+                 ):
+
+        """
+        Initializes the SemanticAnswerCache instance.
+
+        Args:
+            similarity_threshold (float): Minimum cosine similarity for a cached answer to be reused. Defaults to 0.95.
+            max_entries (int): Maximum number of cached answers. Defaults to 2048.
+            max_age_seconds (float): Age after which a cached answer expires. Defaults to one week.
+            embedding_dimension (int): Dimension of the query embeddings. Defaults to 1536.
+        """
+
+        self.index_version: Union[str, None] = None
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+
+        self._embeddings = np.zeros((max_entries, embedding_dimension), dtype = np.float32)
+        self._answers: List[Union[str, None]] = [None] * max_entries
+        self._created_at = np.zeros(max_entries, dtype = np.float64)
+        self._last_used = np.zeros(max_entries, dtype = np.float64)
+        self._occupied = np.zeros(max_entries, dtype = bool)
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "stale_stores": 0}
+
+
+    @staticmethod
+    def _normalize(embedding: Union[List[float], np.ndarray])-> np.ndarray:
+
+        vector = np.asarray(embedding, dtype = np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+    def _expire(self, now: float)-> None:
+
+        expired = self._occupied & (now - self._created_at > self.max_age_seconds)
+        if expired.any():
+            self._occupied[expired] = False
+            self.counters["evictions"] += int(expired.sum())
+
+
+    def _check_index_version(self, index_version: str)-> None:
+
+        """Moves the cache to the current version of the index, dropping every cached answer if it changed. Called by lookup with the lock held."""
+
+        if index_version != self.index_version:
+            if self._occupied.any():
+                self._occupied[:] = False
+                self.counters["invalidations"] += 1
+            self.index_version = index_version
+
+
+    def lookup(self, embedding: Union[List[float], np.ndarray], index_version: str)-> Union[str, None]:
+
+        """
+        Returns the cached answer of the most similar previous query, if it is similar enough.
+
+        Args:
+            embedding (Union[List[float], np.ndarray]): The dense embedding of the incoming query.
+            index_version (str): The current version of the index. If it changed, every cached answer is dropped first.
+
+        Returns:
+            Union[str, None]: The cached answer (including its page reference), or None on a miss.
+        """
+
+        query_vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._check_index_version(index_version)
+            self._expire(now)
+            if not self._occupied.any():
+                self.counters["misses"] += 1
+                return None
+
+            similarities = self._embeddings @ query_vector
+            similarities[~self._occupied] = -np.inf
+            best_slot = int(np.argmax(similarities))
+
+            if similarities[best_slot] < self.similarity_threshold:
+                self.counters["misses"] += 1
+                return None
+
+            self._last_used[best_slot] = now
+            self.counters["hits"] += 1
+            return self._answers[best_slot]
+
+
+    def store(self, embedding: Union[List[float], np.ndarray], answer: str, index_version: str)-> None:
+
+        """
+        Caches the answer to a query, replacing the least recently used entry if the cache is full.
+
+        Args:
+            embedding (Union[List[float], np.ndarray]): The dense embedding of the answered query.
+            answer (str): The answer sent to the user, including its page reference.
+            index_version (str): The version of the index the answer was built from (the one passed to lookup). If the
+                cache has moved to another version since, the answer is not stored.
+        """
+
+        query_vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if index_version != self.index_version:
+                self.counters["stale_stores"] += 1
+                return
+
+            self._expire(now)
+            free_slots = np.flatnonzero(~self._occupied)
+            if free_slots.size:
+                slot = int(free_slots[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.counters["evictions"] += 1
+
+            self._embeddings[slot] = query_vector
+            self._answers[slot] = answer
+            self._created_at[slot] = now
+            self._last_used[slot] = now
+            self._occupied[slot] = True
+
+
+    def stats(self)-> Dict[str, Union[int, float, str]]:
+
+        """
+        Returns the hit/miss/eviction counters and the number of cached answers.
+
+        Returns:
+            Dict[str, Union[int, float, str]]: Counters, hit rate, entry count and index version.
+        """
+
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {**self.counters,
+                    "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                    "entries": int(self._occupied.sum()),
+                    "index_version": self.index_version,
+                    }
@@ -17,14 +17,10 @@ send text, one after the other to get response from OpenAI
 
 """
 
-from pinecone_kit import pinecone_connection as pc
-from pinecone_kit import index_name, Pinecone
-from pinecone_kit import get_pinecone_index_client
-from embedding_matrix_loader import load_vectorizer, TfidfVectorizer
-from embedding_matrix_loader import VECTORIZER_PKL, VECTORIZER_FOLDER
-from openai_kit import openai_client
-from query_processor import process_query
+from auxiliaries import Union, AsyncIterator
+from chatbot_runtime import ChatbotRuntime
 from test_queries import SampleQueries
+from tracing import tracer
 
 
 
@@ -32,13 +28,68 @@ from test_queries import SampleQueries
 "=================================RUN============================================="
 
 
-def get_chatbot_response(query: str)-> str:
-    vectorizer: TfidfVectorizer = load_vectorizer(VECTORIZER_FOLDER, VECTORIZER_PKL)
-    pinecone_index_client: Pinecone.Index = get_pinecone_index_client(pc, index_name)
-    answer: str = process_query(query, pinecone_index_client,openai_client, vectorizer)
+def get_chatbot_response(query: str, runtime: Union[ChatbotRuntime, None] = None)-> str:
+    
+    """
+    Answers a user query with the chatbot.
+
+    Args:
+        query (str): The user's query.
+        runtime (Union[ChatbotRuntime, None]): A warm runtime holding the vectorizer, Pinecone index client and
+            OpenAI client. If None, a new runtime is built for this query only (cold path).
+
+    Returns:
+        str: The chatbot's answer.
+    """
+    
+    if runtime is None:
+        runtime = ChatbotRuntime.from_environment()
+
+    with tracer.span("answer"):
+        answer: str = runtime.answer(query)
     print(answer)
     return answer
 
+
+async def get_chatbot_response_async(query: str, runtime: ChatbotRuntime)-> str:
+    
+    """
+    Answers a user query with the chatbot without blocking the event loop.
+
+    Args:
+        query (str): The user's query.
+        runtime (ChatbotRuntime): A warm runtime built with an asynchronous OpenAI client.
+
+    Returns:
+        str: The chatbot's answer.
+    """
+    
+    with tracer.span("answer"):
+        answer: str = await runtime.answer_async(query)
+    print(answer)
+    return answer
+
+
+async def stream_chatbot_response(query: str, runtime: ChatbotRuntime)-> AsyncIterator[str]:
+    
+    """
+    Answers a user query with the chatbot, yielding the answer in pieces as it is generated.
+
+    Args:
+        query (str): The user's query.
+        runtime (ChatbotRuntime): A warm runtime built with an asynchronous OpenAI client.
+
+    Yields:
+        str: Successive pieces of the chatbot's answer.
+    """
+    
+    answer_pieces = []
+    with tracer.span("answer"):
+        async for answer_piece in runtime.answer_stream(query):
+            answer_pieces.append(answer_piece)
+            yield answer_piece
+    print("".join(answer_pieces))
+
 if __name__ == "__main__":
     query = SampleQueries.query1.value
     answer: str = get_chatbot_response("Hello")
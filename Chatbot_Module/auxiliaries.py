@@ -14,9 +14,12 @@ Type Aliases:
 - Any: Represents any type.
 - Tuple: A type for tuples.
 - Union: Represents a type that can be one of several types.
+- Callable: Represents a callable object such as a function.
+- Iterator: An iterator, such as a generator.
+- AsyncIterator: An asynchronous iterator, such as an async generator.
 """
 
-from typing import List, Dict, Any, Tuple, Union
+from typing import List, Dict, Any, Tuple, Union, Callable, Iterator, AsyncIterator
 import os
 from dotenv import load_dotenv
 import numpy as np
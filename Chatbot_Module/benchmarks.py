@@ -0,0 +1,944 @@
+
+"""
+benchmarks.py
+
+This module contains latency benchmarks for the chatbot's query path. Each benchmark prints a short report of its timings so that changes to the pipeline can be compared before and after.
+
+Usage:
+    Run from the Chatbot_Module folder with the name of the benchmark to execute, e.g.
+        python benchmarks.py runtime
+        python benchmarks.py runtime --end-to-end
+        python benchmarks.py strategies --output strategies.json
+        python benchmarks.py verdicts --output verdicts.json
+        python benchmarks.py alpha --queries logged_queries.txt --output alpha.json
+        python benchmarks.py ann --output ann.json
+        python benchmarks.py sparse --output sparse.json
+        python benchmarks.py hybrid --iterations 1000
+        python benchmarks.py batching --concurrency 64 --output batching.json
+        python benchmarks.py pinecone --iterations 100 --output pinecone.json
+        python benchmarks.py replay --cassette cassettes/sample_queries.jsonl.gz --iterations 10
+
+Main Functions:
+- summarize_timings: Reduces a list of timings to mean/median/p95 figures in milliseconds.
+- benchmark_runtime: Compares the cold path (resources loaded per message) with a warm ChatbotRuntime.
+- count_chat_completions: Counts the chat completions made through an OpenAI client while the context is active.
+- benchmark_answering_strategies: Compares the per-passage and single-call answering strategies on SampleQueries.
+- benchmark_answer_formats: Compares the wasted completions of the '' sentinel and of JSON verdicts on SampleQueries and OutOfScopeQueries.
+- load_logged_queries: Reads a query log (one query per line), falling back to SampleQueries.
+- measure_single_round_trip_recall: Measures how many of the PER_ALPHA matches the re-ranked SINGLE_ROUND_TRIP candidates recover, per alpha value.
+- benchmark_adaptive_alpha: Compares the completions per answered query of the fixed alpha sweep and of the QueryAnalyzer ordering, and measures the single-round-trip recall.
+- benchmark_ann: Measures recall@k and latency of the IVF index against exact search on the existing embeddings.
+- benchmark_sparse_index: Measures latency and postings scored by the inverted sparse index against a full sparse product.
+- benchmark_hybrid_scaling: Micro-benchmarks the NumPy hybrid scaling (single and batched) against the previous list-based implementation.
+- benchmark_embedding_batching: Measures the throughput and per-query latency of concurrent query embeddings for several batch windows.
+- batch_records_under_limit: Groups upsert records into batches under the 4 MB request limit.
+- stand_in_babok_records: Builds Pinecone upsert records for the BABOK chunks, with stand-in embeddings.
+- benchmark_pinecone_stand_in: Measures upload throughput and hybrid query latency against the local Pinecone stand-in.
+- benchmark_replay: Replays recorded OpenAI/Pinecone calls to measure the pipeline's own overhead and call pattern offline.
+"""
+
+
+import argparse
+import asyncio
+import contextlib
+import json
+import statistics
+import time
+
+from auxiliaries import List, Dict, Any, Tuple, Callable, Union, os, np
+from chatbot_runtime import ChatbotRuntime
+from ann_index import IVFIndex
+from local_index import LocalHybridIndex
+from sparse_index import SparseInvertedIndex
+from embedding_matrix_loader import load_vectorizer, VECTORIZER_FOLDER, VECTORIZER_PKL
+from embedding_matrix_loader import hybrid_scale, hybrid_scale_batch, hybrid_batch_to_pinecone, convert_string_query_to_vectors
+from scipy.sparse import csr_matrix
+from query_processor import AnsweringStrategy, AlphaValues, AnswerFormat, answer_was_found, CANDIDATE_POOL_SIZE
+from test_queries import SampleQueries, OutOfScopeQueries
+from query_analyzer import QueryAnalyzer
+from embedding_batcher import EmbeddingBatcher
+from openai_kit import async_openai_client
+from embedding_matrix_loader import TfidfVectorizer, sparse_matrix_to_dict
+from local_index import REFERENCE_JSON_OBJECTS_FOLDER, CHAPTER_SECTIONS_JSON
+from local_openai_server import stand_in_embedding, start_stand_in_server
+from local_pinecone_server import PineconeStandIn, PineconeStandInSettings, MAX_REQUEST_BYTES
+from pinecone_kit import Pinecone, ServerlessSpec, get_pinecone_query_result, rescore_pinecone_candidates
+from cassette import Cassette, CassetteMode
+
+
+
+def summarize_timings(timings: List[float])-> Dict[str, float]:
+
+    """
+    Summarizes a list of timings.
+
+    Args:
+        timings (List[float]): Durations in seconds.
+
+    Returns:
+        Dict[str, float]: The mean, median, 95th and 99th percentiles in milliseconds, plus the number of runs.
+    """
+
+    ordered = sorted(timings)
+    percentile = lambda fraction: ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+    return {
+        "runs": len(ordered),
+        "mean_ms": 1000 * statistics.mean(ordered),
+        "median_ms": 1000 * statistics.median(ordered),
+        "p95_ms": 1000 * percentile(0.95),
+        "p99_ms": 1000 * percentile(0.99),
+    }
+
+
+def _print_report(title: str, rows: Dict[str, Dict[str, float]])-> None:
+
+    print(f"\n{title}")
+    for name, summary in rows.items():
+        print(f"  {name:<24} runs={summary['runs']:<4} mean={summary['mean_ms']:9.2f} ms  "
+              f"median={summary['median_ms']:9.2f} ms  p95={summary['p95_ms']:9.2f} ms")
+
+
+
+def benchmark_runtime(iterations: int = 10, end_to_end: bool = False)-> Dict[str, Dict[str, float]]:
+
+    """
+    Compares answering with resources loaded per message (cold) against a warm ChatbotRuntime.
+
+    By default only the per-message resource acquisition is timed: the cold path unpickles the vectorizer
+    and resolves the Pinecone index client on each iteration, while the warm path reuses a runtime built once.
+    With end_to_end=True, the full answer for each SampleQueries entry is timed as well (this calls the
+    OpenAI and Pinecone APIs).
+
+    Args:
+        iterations (int): Number of messages to simulate per path. Defaults to 10.
+        end_to_end (bool): Whether to include the full query processing in the timings. Defaults to False.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Timing summaries for the cold and warm paths.
+    """
+
+    queries: List[str] = [sample.value for sample in SampleQueries]
+    warm_runtime = ChatbotRuntime.from_environment()
+
+    cold_timings, warm_timings = [], []
+    for idx in range(iterations):
+        query = queries[idx % len(queries)]
+
+        start = time.perf_counter()
+        runtime = ChatbotRuntime.from_environment()
+        if end_to_end:
+            runtime.answer(query)
+        cold_timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        runtime = warm_runtime
+        if end_to_end:
+            runtime.answer(query)
+        warm_timings.append(time.perf_counter() - start)
+
+    report = {
+        "cold (per message)": summarize_timings(cold_timings),
+        "warm (ChatbotRuntime)": summarize_timings(warm_timings),
+    }
+    _print_report("Cold vs. warm runtime" + (" (end to end)" if end_to_end else " (resource loading)"), report)
+    return report
+
+
+
+@contextlib.contextmanager
+def count_chat_completions(openai_client):
+
+    """
+    Counts the chat completions made through an OpenAI client while the context is active.
+
+    Args:
+        openai_client (OpenAI): The client whose chat.completions.create calls are counted.
+
+    Yields:
+        Dict[str, int]: A counter whose "calls" entry is updated as completions are made.
+    """
+
+    completions = openai_client.chat.completions
+    original_create = completions.create
+    counter = {"calls": 0}
+
+    def counting_create(*args, **kwargs):
+        counter["calls"] += 1
+        return original_create(*args, **kwargs)
+
+    completions.create = counting_create
+    try:
+        yield counter
+    finally:
+        completions.create = original_create
+
+
+
+def benchmark_answering_strategies(output_path: Union[str, None] = None)-> Dict[str, Dict[str, float]]:
+
+    """
+    Answers every SampleQueries entry with each AnsweringStrategy and compares latency and completion counts.
+
+    The answers are printed (and written to output_path as JSON when given) so that their quality can be
+    compared side by side. This calls the OpenAI and Pinecone APIs.
+
+    Args:
+        output_path (Union[str, None]): Optional path of a JSON file receiving the answers and timings.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Timing summaries per strategy, with the mean number of completions per query.
+    """
+
+    runtime = ChatbotRuntime.from_environment()
+    report, answers = {}, []
+
+    for strategy in AnsweringStrategy:
+        runtime.answering_strategy = strategy
+        timings, completion_counts = [], []
+
+        for sample in SampleQueries:
+            with count_chat_completions(runtime.openai_client) as counter:
+                start = time.perf_counter()
+                answer = runtime.answer(sample.value)
+                timings.append(time.perf_counter() - start)
+
+            completion_counts.append(counter["calls"])
+            answers.append({"strategy": strategy.value,
+                            "query": sample.name,
+                            "latency_ms": 1000 * timings[-1],
+                            "completions": counter["calls"],
+                            "answer": answer
+                            })
+
+        report[strategy.value] = summarize_timings(timings)
+        report[strategy.value]["mean_completions"] = statistics.mean(completion_counts)
+
+    _print_report("Answering strategies (SampleQueries)", report)
+    for strategy, summary in report.items():
+        print(f"  {strategy:<24} mean completions per query={summary['mean_completions']:.2f}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump({"summary": report, "answers": answers}, f, indent = 4)
+        print(f"Answers written to {output_path}")
+
+    return report
+
+
+
+def benchmark_answer_formats(output_path: Union[str, None] = None)-> Dict[str, Dict[str, float]]:
+
+    """
+    Answers the SampleQueries and OutOfScopeQueries corpora with each AnswerFormat and counts wasted completions.
+
+    A completion is wasted when it does not produce the final answer: every completion of a query that ends
+    with the default 'no relevant answer' message, and all but the last one otherwise. This calls the OpenAI
+    and Pinecone APIs.
+
+    Args:
+        output_path (Union[str, None]): Optional path of a JSON file receiving the answers and counts.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Per answer format and corpus, the timing summary with the mean completions,
+        the mean wasted completions and the share of answered queries.
+    """
+
+    runtime = ChatbotRuntime.from_environment()
+    corpora = {"in scope": list(SampleQueries), "out of scope": list(OutOfScopeQueries)}
+    report, answers = {}, []
+
+    for answer_format in AnswerFormat:
+        runtime.answer_format = answer_format
+
+        for corpus_name, corpus in corpora.items():
+            timings, completion_counts, wasted_counts, found_counts = [], [], [], []
+
+            for sample in corpus:
+                with count_chat_completions(runtime.openai_client) as counter:
+                    start = time.perf_counter()
+                    answer = runtime.answer(sample.value)
+                    timings.append(time.perf_counter() - start)
+
+                found = answer_was_found(answer, sample.value)
+                completion_counts.append(counter["calls"])
+                wasted_counts.append(counter["calls"] - 1 if found and counter["calls"] else counter["calls"])
+                found_counts.append(int(found))
+                answers.append({"answer_format": answer_format.value,
+                                "corpus": corpus_name,
+                                "query": sample.name,
+                                "completions": counter["calls"],
+                                "answered": found,
+                                "answer": answer
+                                })
+
+            name = f"{answer_format.value} / {corpus_name}"
+            report[name] = summarize_timings(timings)
+            report[name].update({"mean_completions": statistics.mean(completion_counts),
+                                 "mean_wasted_completions": statistics.mean(wasted_counts),
+                                 "answered_share": statistics.mean(found_counts)
+                                 })
+
+    _print_report("Answer formats (SampleQueries / OutOfScopeQueries)", report)
+    for name, summary in report.items():
+        print(f"  {name:<24} completions={summary['mean_completions']:.2f}  wasted={summary['mean_wasted_completions']:.2f}  "
+              f"answered={summary['answered_share']:.0%}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump({"summary": report, "answers": answers}, f, indent = 4)
+        print(f"Answers written to {output_path}")
+
+    return report
+
+
+
+def load_logged_queries(queries_path: Union[str, None] = None)-> List[str]:
+
+    """
+    Reads the queries to replay in a benchmark.
+
+    Args:
+        queries_path (Union[str, None]): A text file with one logged query per line. Defaults to None, in which
+            case the SampleQueries are used.
+
+    Returns:
+        List[str]: The queries, without blank lines.
+    """
+
+    if not queries_path:
+        return [sample.value for sample in SampleQueries]
+
+    with open(queries_path, "r", encoding = "utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+
+def measure_single_round_trip_recall(runtime: ChatbotRuntime, queries: List[str], num_results: int = 3)-> Dict[str, float]:
+
+    """
+    Measures the recall of RetrievalMode.SINGLE_ROUND_TRIP against RetrievalMode.PER_ALPHA.
+
+    For each query, the matches of one Pinecone query per alpha value are compared with the CANDIDATE_POOL_SIZE
+    candidates fetched at alpha 0.5 and re-ranked locally. This calls the OpenAI and Pinecone APIs.
+
+    Args:
+        runtime (ChatbotRuntime): The runtime whose clients and vectorizer are used.
+        queries (List[str]): The queries to retrieve for.
+        num_results (int): The number of matches compared per alpha value. Defaults to 3.
+
+    Returns:
+        Dict[str, float]: Per alpha value, the mean share of the PER_ALPHA match ids also returned by the re-ranking.
+    """
+
+    alpha_values: List[float] = [alpha.value for alpha in AlphaValues]
+    recalls: Dict[float, List[float]] = {alpha_value: [] for alpha_value in alpha_values}
+
+    for query in queries:
+        search_query_dense_sparse: Dict = convert_string_query_to_vectors(query, runtime.openai_client, runtime.vectorizer)
+        dense, sparse = search_query_dense_sparse["dense"], search_query_dense_sparse["sparse"]
+        candidates: Dict = get_pinecone_query_result(runtime.pinecone_index_client,
+                                                     *hybrid_scale(dense, sparse, alpha = AlphaValues.MEDIUM.value),
+                                                     num_results = CANDIDATE_POOL_SIZE,
+                                                     include_values = True
+                                                     )
+        rescored_results = rescore_pinecone_candidates(candidates, dense, sparse, alpha_values, num_results)
+
+        for alpha_value in alpha_values:
+            exact_result: Dict = get_pinecone_query_result(runtime.pinecone_index_client, *hybrid_scale(dense, sparse, alpha = alpha_value),
+                                                           num_results = num_results
+                                                           )
+            exact_ids = {match["id"] for match in exact_result["matches"]}
+            if exact_ids:
+                rescored_ids = {match["id"] for match in rescored_results[alpha_value]["matches"]}
+                recalls[alpha_value].append(len(exact_ids & rescored_ids) / len(exact_ids))
+
+    return {f"alpha_{alpha_value}": statistics.mean(alpha_recalls) if alpha_recalls else 0.0 for alpha_value, alpha_recalls in recalls.items()}
+
+
+
+def benchmark_adaptive_alpha(queries_path: Union[str, None] = None, output_path: Union[str, None] = None)-> Dict[str, Dict[str, float]]:
+
+    """
+    Replays logged queries with the fixed dense-first alpha sweep and with the alpha order chosen by a QueryAnalyzer,
+    and compares the chat completions spent per answered query. It also reports the recall of the single-round-trip
+    retrieval against one Pinecone query per alpha value (measure_single_round_trip_recall).
+
+    The analysis of each query (coverage, jargon share and alpha order) is recorded with the answers, so the
+    thresholds of QueryAnalyzer can be tuned on the log. This calls the OpenAI and Pinecone APIs.
+
+    Args:
+        queries_path (Union[str, None]): A text file with one logged query per line. Defaults to the SampleQueries.
+        output_path (Union[str, None]): Optional path of a JSON file receiving the per-query results.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Per ordering, the timing summary with the mean completions per query,
+        the mean completions per answered query and the share of answered queries; under "single_round_trip_recall",
+        the recall per alpha value.
+    """
+
+    queries: List[str] = load_logged_queries(queries_path)
+    runtime = ChatbotRuntime.from_environment()
+    query_analyzer = QueryAnalyzer(runtime.vectorizer)
+    alpha_values: List[float] = [alpha.value for alpha in AlphaValues]
+    orderings: Dict[str, Union[QueryAnalyzer, None]] = {"fixed": None, "adaptive": query_analyzer}
+    report, answers = {}, []
+
+    for ordering, ordering_analyzer in orderings.items():
+        runtime.query_analyzer = ordering_analyzer
+        timings, completion_counts, answered_counts = [], [], []
+
+        for query in queries:
+            with count_chat_completions(runtime.openai_client) as counter:
+                start = time.perf_counter()
+                answer = runtime.answer(query)
+                timings.append(time.perf_counter() - start)
+
+            found = answer_was_found(answer, query)
+            completion_counts.append(counter["calls"])
+            if found:
+                answered_counts.append(counter["calls"])
+
+            analysis = query_analyzer.analyze(query)
+            answers.append({"ordering": ordering,
+                            "query": query,
+                            "jargon_share": analysis["jargon_share"],
+                            "coverage": analysis["coverage"],
+                            "alpha_values": query_analyzer.order_alpha_values(query, alpha_values, analysis) if ordering_analyzer else alpha_values,
+                            "completions": counter["calls"],
+                            "answered": found,
+                            "answer": answer
+                            })
+
+        report[ordering] = summarize_timings(timings)
+        report[ordering].update({"mean_completions": statistics.mean(completion_counts),
+                                 "completions_per_answered_query": statistics.mean(answered_counts) if answered_counts else 0.0,
+                                 "answered_share": len(answered_counts) / len(queries)
+                                 })
+
+    _print_report(f"Alpha ordering ({len(queries)} logged queries)", report)
+    for ordering, summary in report.items():
+        print(f"  {ordering:<24} completions={summary['mean_completions']:.2f}  "
+              f"per answered query={summary['completions_per_answered_query']:.2f}  answered={summary['answered_share']:.0%}")
+
+    report["single_round_trip_recall"] = measure_single_round_trip_recall(runtime, queries)
+    print("Single-round-trip recall@3 against one query per alpha: "
+          + "  ".join(f"{name}={recall:.0%}" for name, recall in report["single_round_trip_recall"].items()))
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump({"summary": report, "answers": answers}, f, indent = 4)
+        print(f"Answers written to {output_path}")
+
+    return report
+
+
+
+def _load_dense_matrix()-> np.ndarray:
+
+    """Loads the dense embeddings of the batch output, as held by the local index."""
+
+    vectorizer = load_vectorizer(VECTORIZER_FOLDER, VECTORIZER_PKL)
+    return LocalHybridIndex.from_batch_output(vectorizer).dense_matrix
+
+
+def benchmark_ann(k: int = 3,
+                  num_queries: int = 200,
+                  n_lists: int = 64,
+                  n_probes: Tuple[int, ...] = (1, 2, 4, 8, 16, 32),
+                  noise: float = 0.02,
+                  output_path: Union[str, None] = None
+                  )-> Dict[str, Dict[str, float]]:
+
+    """
+    Measures recall@k and per-query latency of the IVF index against exact (brute-force) search.
+
+    The queries are corpus embeddings perturbed with Gaussian noise and re-normalized, which mimics
+    questions close to, but not identical with, a chunk of the book.
+
+    Args:
+        k (int): Number of neighbours compared. Defaults to 3.
+        num_queries (int): Number of queries. Defaults to 200.
+        n_lists (int): Number of IVF clusters. Defaults to 64.
+        n_probes (Tuple[int, ...]): The n_probe values to measure. Defaults to (1, 2, 4, 8, 16, 32).
+        noise (float): Standard deviation of the noise added to each query component. Defaults to 0.02.
+        output_path (Union[str, None]): Optional path of a JSON file receiving the results.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Latency summary and recall@k for exact search and each n_probe.
+    """
+
+    dense_matrix = _load_dense_matrix()
+    rng = np.random.default_rng(0)
+    queries = dense_matrix[rng.choice(dense_matrix.shape[0], num_queries)]
+    queries = queries + rng.normal(scale = noise, size = queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis = 1, keepdims = True)
+
+    exact_timings, exact_neighbours = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores = dense_matrix @ query
+        neighbours = np.argpartition(-scores, k - 1)[:k]
+        exact_timings.append(time.perf_counter() - start)
+        exact_neighbours.append(set(neighbours.tolist()))
+
+    start = time.perf_counter()
+    ann = IVFIndex(n_lists = n_lists)
+    ann.train(dense_matrix)
+    ann.add(dense_matrix)
+    print(f"IVF index with {ann.n_lists} lists built in {time.perf_counter() - start:.2f} s")
+
+    report = {"exact": {**summarize_timings(exact_timings), "recall_at_k": 1.0}}
+    for n_probe in n_probes:
+        timings, recalls = [], []
+        for query, expected in zip(queries, exact_neighbours):
+            start = time.perf_counter()
+            _, positions = ann.search(query, k = k, n_probe = n_probe)
+            timings.append(time.perf_counter() - start)
+            recalls.append(len(expected & set(positions[0].tolist())) / k)
+
+        report[f"ivf n_probe={n_probe}"] = {**summarize_timings(timings), "recall_at_k": statistics.mean(recalls)}
+
+    _print_report(f"IVF vs. exact search ({dense_matrix.shape[0]} vectors, k={k})", report)
+    for name, summary in report.items():
+        print(f"  {name:<24} recall@{k}={summary['recall_at_k']:.3f}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 4)
+
+    return report
+
+
+def benchmark_sparse_index(k: int = 3,
+                           num_queries: int = 200,
+                           query_words: int = 12,
+                           output_path: Union[str, None] = None
+                           )-> Dict[str, Dict[str, float]]:
+
+    """
+    Measures the inverted sparse index against a full sparse matrix product on the TF-IDF side.
+
+    The queries are the SampleQueries plus the first query_words words of randomly chosen chunks of the book.
+    For the inverted index, with and without MaxScore pruning, the benchmark reports latency, recall@k against
+    the full product and the share of postings actually scored.
+
+    Args:
+        k (int): Number of results compared. Defaults to 3.
+        num_queries (int): Number of queries taken from the book, on top of SampleQueries. Defaults to 200.
+        query_words (int): Number of words of each query taken from the book. Defaults to 12.
+        output_path (Union[str, None]): Optional path of a JSON file receiving the results.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Latency summary, recall@k and postings share for each method.
+    """
+
+    vectorizer = load_vectorizer(VECTORIZER_FOLDER, VECTORIZER_PKL)
+    local_index = LocalHybridIndex.from_batch_output(vectorizer)
+    sparse_index = SparseInvertedIndex(local_index.sparse_matrix)
+    document_terms = local_index.sparse_matrix.T.tocsr()
+
+    rng = np.random.default_rng(0)
+    texts = [query.value for query in SampleQueries]
+    texts += [' '.join(local_index.metadata[idx]["chapter_texts"].split()[:query_words])
+              for idx in rng.choice(len(local_index), num_queries)]
+    sparse_queries = [sparse_query for sparse_query in vectorizer.transform(texts) if sparse_query.nnz]
+
+    exact_timings, exact_results = [], []
+    for sparse_query in sparse_queries:
+        start = time.perf_counter()
+        scores = (sparse_query @ document_terms).toarray()[0]
+        top = local_index.top_k(scores[np.newaxis, :], k)[0]
+        exact_timings.append(time.perf_counter() - start)
+        exact_results.append((top, scores))
+
+    report = {"full product": {**summarize_timings(exact_timings), "recall_at_k": 1.0, "postings_scored": 1.0}}
+    for name, prune in [("inverted", False), ("inverted + maxscore", True)]:
+        sparse_index.counters = {counter: 0 for counter in sparse_index.counters}
+        timings, recalls = [], []
+        for sparse_query, (expected, scores) in zip(sparse_queries, exact_results):
+            start = time.perf_counter()
+            found, found_scores = sparse_index.search_csr(sparse_query, k, prune)
+            timings.append(time.perf_counter() - start)
+            # Ties at the k-th score may be broken differently, so compare scores rather than ids
+            recalls.append(np.isin(found_scores, scores[expected]).sum() / len(expected))
+
+        report[name] = {**summarize_timings(timings),
+                        "recall_at_k": statistics.mean(recalls),
+                        "postings_scored": sparse_index.counters["postings_scored"] / max(1, sparse_index.counters["postings_total"]),
+                        }
+
+    _print_report(f"Inverted sparse index vs. full product ({len(sparse_queries)} queries, k={k})", report)
+    for name, summary in report.items():
+        print(f"  {name:<24} recall@{k}={summary['recall_at_k']:.3f}  postings scored={summary['postings_scored']:.1%}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 4)
+
+    return report
+
+
+def _list_based_hybrid_scale(dense: List[float], sparse_matrix: csr_matrix, alpha: float):
+
+    """The hybrid_scale implementation preceding the NumPy version (COO conversion and list comprehensions), kept as the baseline."""
+
+    coo = sparse_matrix.tocoo()
+    indices = np.vstack((coo.row, coo.col)).T
+    sparse = {"indices": indices[:, 1].astype(int).tolist(), "values": coo.data.tolist()}
+
+    hsparse = {"indices": sparse["indices"], "values": [v * (1 - alpha) for v in sparse["values"]]}
+    hdense = [v * alpha for v in dense]
+    return hdense, hsparse
+
+
+def benchmark_hybrid_scaling(iterations: int = 1000,
+                             batch_size: int = 32,
+                             dimension: int = 1536,
+                             vocabulary_size: int = 20_000,
+                             terms_per_query: int = 12
+                             )-> Dict[str, Dict[str, float]]:
+
+    """
+    Micro-benchmarks the scaling of query vectors for every alpha value of a sweep.
+
+    Synthetic queries of the production shape are used, so the benchmark needs no vectorizer, embeddings
+    or API access. Three paths are timed, each producing the Pinecone query arguments for all AlphaValues:
+    the previous list-based hybrid_scale, the NumPy hybrid_scale called once per alpha, and one
+    hybrid_scale_batch call over the whole batch followed by hybrid_batch_to_pinecone.
+
+    Args:
+        iterations (int): Number of timed repetitions. Defaults to 1000.
+        batch_size (int): Number of queries per batch. Defaults to 32.
+        dimension (int): Dimension of the dense vectors. Defaults to 1536.
+        vocabulary_size (int): Number of columns of the sparse vectors. Defaults to 20,000.
+        terms_per_query (int): Number of non-zero terms per sparse vector. Defaults to 12.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Latency summary per batch for each path.
+    """
+
+    rng = np.random.default_rng(0)
+    dense_batch = rng.normal(size = (batch_size, dimension))
+    dense_lists = dense_batch.tolist()
+    indices = np.sort(np.stack([rng.choice(vocabulary_size, terms_per_query, replace = False) for _ in range(batch_size)]), axis = 1)
+    sparse_batch = csr_matrix((rng.random(batch_size * terms_per_query), indices.reshape(-1),
+                               np.arange(0, batch_size * terms_per_query + 1, terms_per_query)),
+                              shape = (batch_size, vocabulary_size)
+                              )
+    sparse_rows = [sparse_batch[row] for row in range(batch_size)]
+    alphas = [alpha.value for alpha in AlphaValues]
+
+    baseline = [[_list_based_hybrid_scale(dense_lists[row], sparse_rows[row], alpha) for row in range(batch_size)] for alpha in alphas]
+    batched = hybrid_batch_to_pinecone(*hybrid_scale_batch(dense_batch, sparse_batch, alphas), sparse_batch)
+    if batched != baseline:
+        raise AssertionError("hybrid_scale_batch does not reproduce the list-based scaling")
+
+    paths: Dict[str, Callable] = {
+        "list-based per alpha": lambda: [[_list_based_hybrid_scale(dense_lists[row], sparse_rows[row], alpha)
+                                          for row in range(batch_size)] for alpha in alphas],
+        "numpy per alpha": lambda: [[hybrid_scale(dense_batch[row], sparse_rows[row], alpha)
+                                     for row in range(batch_size)] for alpha in alphas],
+        "numpy batch": lambda: hybrid_batch_to_pinecone(*hybrid_scale_batch(dense_batch, sparse_batch, alphas), sparse_batch),
+        "numpy batch (no lists)": lambda: hybrid_scale_batch(dense_batch, sparse_batch, alphas),
+    }
+
+    report = {}
+    for name, path in paths.items():
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            path()
+            timings.append(time.perf_counter() - start)
+        report[name] = summarize_timings(timings)
+
+    _print_report(f"Hybrid scaling of {batch_size} queries x {len(alphas)} alphas", report)
+    return report
+
+
+
+async def _embed_concurrently(queries: List[str], window_seconds: float, max_batch_size: int, arrival_interval: float)-> Dict[str, Union[float, List[float]]]:
+
+    """Embeds the queries as concurrent requests arriving arrival_interval apart, batched unless window_seconds is 0."""
+
+    embedding_batcher = EmbeddingBatcher(async_openai_client, window_seconds = window_seconds, max_batch_size = max_batch_size)
+    latencies: List[float] = []
+
+    async def embed(query: str, delay: float)-> None:
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        if window_seconds > 0:
+            await embedding_batcher.embed(query)
+        else:
+            await async_openai_client.embeddings.create(input = [query], model = embedding_batcher.openai_model)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[embed(query, idx * arrival_interval) for idx, query in enumerate(queries)])
+    wall_time = time.perf_counter() - start
+
+    return {"wall_time": wall_time,
+            "latencies": latencies,
+            "api_calls": embedding_batcher.counters["batches"] if window_seconds > 0 else len(queries)
+            }
+
+
+
+def benchmark_embedding_batching(concurrency: int = 64,
+                                 windows_ms: Tuple[float, ...] = (0, 5, 10, 25),
+                                 max_batch_size: int = 64,
+                                 arrival_interval_ms: float = 1.0,
+                                 output_path: Union[str, None] = None
+                                 )-> Dict[str, Dict[str, float]]:
+
+    """
+    Embeds a burst of distinct queries with one embeddings call each (window 0) and through an EmbeddingBatcher
+    with each batch window, and reports throughput, per-query latency and the number of API calls.
+
+    The queries are the SampleQueries, numbered so that they are all distinct, arriving arrival_interval_ms apart.
+    The added latency of a window is visible in the per-query timings, the gain in throughput and API calls.
+    This calls the OpenAI API.
+
+    Args:
+        concurrency (int): Number of queries in the burst. Defaults to 64.
+        windows_ms (Tuple[float, ...]): The batch windows to compare, in milliseconds. Defaults to (0, 5, 10, 25).
+        max_batch_size (int): The batch size limit of the EmbeddingBatcher. Defaults to 64.
+        arrival_interval_ms (float): Time between two query arrivals, in milliseconds. Defaults to 1.0.
+        output_path (Union[str, None]): Optional path of a JSON file receiving the report.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Per window, the latency summary with the throughput and the API calls.
+    """
+
+    samples: List[str] = [sample.value for sample in SampleQueries]
+    queries: List[str] = [f"{samples[idx % len(samples)]} ({idx})" for idx in range(concurrency)]
+    report = {}
+
+    for window_ms in windows_ms:
+        result = asyncio.run(_embed_concurrently(queries, window_ms / 1000, max_batch_size, arrival_interval_ms / 1000))
+        name = f"window {window_ms:g} ms" if window_ms > 0 else "unbatched"
+        report[name] = summarize_timings(result["latencies"])
+        report[name].update({"queries_per_second": concurrency / result["wall_time"],
+                             "api_calls": result["api_calls"]
+                             })
+
+    _print_report(f"Embedding batching ({concurrency} queries, {arrival_interval_ms:g} ms apart)", report)
+    for name, summary in report.items():
+        print(f"  {name:<24} throughput={summary['queries_per_second']:8.1f} queries/s  api calls={summary['api_calls']}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 4)
+        print(f"Report written to {output_path}")
+
+    return report
+
+
+
+def batch_records_under_limit(records: List[Dict], data_limit: float = 4 * 1e6):
+
+    """Groups upsert records by serialized size, with the same rule as batch_pinecone_input_generator."""
+
+    batch, batch_size = [], 0
+    for record in records:
+        record_size = len(json.dumps(record).encode("utf-8"))
+        if batch and batch_size + record_size > data_limit:
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(record)
+        batch_size += record_size
+    if batch:
+        yield batch
+
+
+
+def stand_in_babok_records(vectorizer: TfidfVectorizer)-> List[Dict]:
+
+    """
+    Builds the upsert records of the BABOK chunks in the shape written by PineconeOperations: a deterministic
+    stand-in embedding, the TF-IDF sparse values of the chunk and the metadata read by parse_texts_from_pinecone.
+
+    Args:
+        vectorizer (TfidfVectorizer): The vectorizer producing the sparse values.
+
+    Returns:
+        List[Dict]: One record per chunk of chapter_sections_to_text.json.
+    """
+
+    with open(os.path.join("..", REFERENCE_JSON_OBJECTS_FOLDER, CHAPTER_SECTIONS_JSON), "r") as f:
+        chunks_to_text: Dict[str, str] = json.load(f)
+    chunk_names, texts = list(chunks_to_text), list(chunks_to_text.values())
+    sparse_matrix: csr_matrix = vectorizer.transform(texts)
+
+    return [{"id": f"chunk-{idx}",
+             "values": stand_in_embedding(text).tolist(),
+             "sparse_values": sparse_matrix_to_dict(sparse_matrix[idx]),
+             "metadata": {"chapter_names": chunk_names[idx], "chapter_texts": text, "page_number": idx}
+             }
+            for idx, text in enumerate(texts)
+            ]
+
+
+
+def benchmark_pinecone_stand_in(iterations: int = 100,
+                                port: int = 8200,
+                                settings: Union[PineconeStandInSettings, None] = None,
+                                output_path: Union[str, None] = None
+                                )-> Dict[str, Dict[str, float]]:
+
+    """
+    Uploads the BABOK chunks to the local Pinecone stand-in in 4 MB batches and times hybrid queries against it.
+
+    The records come from stand_in_babok_records, with a vectorizer fitted on the chunks so that the pickled one
+    is not needed. Nothing leaves the machine.
+
+    Args:
+        iterations (int): Number of queries timed, cycling through SampleQueries. Defaults to 100.
+        port (int): Port of the stand-in. Defaults to 8200.
+        settings (Union[PineconeStandInSettings, None]): Latency settings of the stand-in. Defaults to PineconeStandInSettings().
+        output_path (Union[str, None]): Optional path of a JSON file receiving the report.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The upsert and query latency summaries, with the upload throughput.
+    """
+
+    with open(os.path.join("..", REFERENCE_JSON_OBJECTS_FOLDER, CHAPTER_SECTIONS_JSON), "r") as f:
+        vectorizer = TfidfVectorizer().fit(json.load(f).values())
+    records: List[Dict] = stand_in_babok_records(vectorizer)
+
+    upload_megabytes = sum(len(json.dumps(record).encode("utf-8")) for record in records) / 1e6
+    batches: List[List[Dict]] = list(batch_records_under_limit(records))
+
+    server = start_stand_in_server(PineconeStandIn(settings).create_app(), port)
+    try:
+        pinecone_client = Pinecone(api_key = "stand-in", host = f"http://127.0.0.1:{port}")
+        pinecone_client.create_index(name = "babok", dimension = len(records[0]["values"]), metric = "dotproduct",
+                                     spec = ServerlessSpec(cloud = "aws", region = "us-east-1")
+                                     )
+        index_client = pinecone_client.Index("babok")
+
+        upsert_timings: List[float] = []
+        upload_start = time.perf_counter()
+        for batch in batches:
+            start = time.perf_counter()
+            index_client.upsert(vectors = batch, namespace = "sisikepo")
+            upsert_timings.append(time.perf_counter() - start)
+        upload_time = time.perf_counter() - upload_start
+
+        samples: List[str] = [sample.value for sample in SampleQueries]
+        query_timings: List[float] = []
+        for idx in range(iterations):
+            query = samples[idx % len(samples)]
+            dense = stand_in_embedding(query).tolist()
+            sparse = sparse_matrix_to_dict(vectorizer.transform([query]))
+            start = time.perf_counter()
+            get_pinecone_query_result(index_client, dense, sparse)
+            query_timings.append(time.perf_counter() - start)
+    finally:
+        server.should_exit = True
+
+    report = {"upsert": {**summarize_timings(upsert_timings),
+                         "vectors_per_second": len(records) / upload_time,
+                         "megabytes_per_second": upload_megabytes / upload_time
+                         },
+              "query": summarize_timings(query_timings)
+              }
+
+    _print_report(f"Pinecone stand-in ({len(records)} records, {len(upsert_timings)} upserts under {MAX_REQUEST_BYTES} bytes)", report)
+    print(f"  upload throughput={report['upsert']['vectors_per_second']:8.1f} vectors/s  {report['upsert']['megabytes_per_second']:6.2f} MB/s")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 4)
+        print(f"Report written to {output_path}")
+
+    return report
+
+
+
+DEFAULT_CASSETTE = os.path.join("cassettes", "sample_queries.jsonl.gz")
+
+
+def benchmark_replay(cassette_path: str = DEFAULT_CASSETTE,
+                     iterations: int = 10,
+                     output_path: Union[str, None] = None
+                     )-> Dict[str, Any]:
+
+    """
+    Answers the SampleQueries from a cassette of recorded OpenAI and Pinecone calls.
+
+    If the cassette does not exist, it is recorded first by answering each query once with a runtime built from
+    the environment (this calls OpenAI and Pinecone, or the stand-ins they are pointed at). The replay without
+    latency times the pipeline's own overhead (vector conversion, scoring, prompt building, parsing); the replay
+    with the recorded latency reproduces the recorded end-to-end time. The calls made per query are reported,
+    so a change in the call pattern shows up next to the timings.
+
+    Args:
+        cassette_path (str): The cassette file. Defaults to DEFAULT_CASSETTE.
+        iterations (int): Number of passes over the queries in the overhead replay. Defaults to 10.
+        output_path (Union[str, None]): Optional path of a JSON file receiving the report.
+
+    Returns:
+        Dict[str, Any]: The overhead and recorded-latency timing summaries, and the calls per query.
+    """
+
+    queries: List[str] = [sample.value for sample in SampleQueries]
+
+    if not os.path.exists(cassette_path):
+        with Cassette(cassette_path, CassetteMode.RECORD) as cassette:
+            runtime = cassette.wrap_runtime(ChatbotRuntime.from_environment())
+            for query in queries:
+                runtime.answer(query)
+        print(f"Recorded {len(cassette.interactions)} calls to {cassette_path}")
+
+    vectorizer = load_vectorizer(VECTORIZER_FOLDER, VECTORIZER_PKL)
+    report = {}
+    for name, replay_latency, passes in (("pipeline overhead", False, iterations), ("recorded latency", True, 1)):
+        cassette = Cassette(cassette_path, CassetteMode.REPLAY, replay_latency = replay_latency)
+        runtime = ChatbotRuntime(vectorizer, cassette.index(), cassette.openai(), cassette.async_openai())
+        timings: List[float] = []
+        for idx in range(passes * len(queries)):
+            start = time.perf_counter()
+            runtime.answer(queries[idx % len(queries)])
+            timings.append(time.perf_counter() - start)
+        report[name] = summarize_timings(timings)
+        report[name]["calls_per_query"] = {call: count / len(timings) for call, count in cassette.stats()["calls"].items()}
+
+    _print_report(f"Replay of {cassette_path}", report)
+    for call, per_query in report["pipeline overhead"]["calls_per_query"].items():
+        print(f"  {call:<34} {per_query:6.2f} calls/query")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 4)
+        print(f"Report written to {output_path}")
+
+    return report
+
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    "runtime": lambda args: benchmark_runtime(args.iterations, args.end_to_end),
+    "strategies": lambda args: benchmark_answering_strategies(args.output),
+    "verdicts": lambda args: benchmark_answer_formats(args.output),
+    "alpha": lambda args: benchmark_adaptive_alpha(args.queries, args.output),
+    "ann": lambda args: benchmark_ann(output_path = args.output),
+    "sparse": lambda args: benchmark_sparse_index(output_path = args.output),
+    "hybrid": lambda args: benchmark_hybrid_scaling(args.iterations),
+    "batching": lambda args: benchmark_embedding_batching(args.concurrency, output_path = args.output),
+    "pinecone": lambda args: benchmark_pinecone_stand_in(args.iterations, output_path = args.output),
+    "replay": lambda args: benchmark_replay(args.cassette, args.iterations, args.output),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chatbot latency benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--end-to-end", action="store_true", help="Include calls to OpenAI and Pinecone")
+    parser.add_argument("--output", default=None, help="JSON file for the benchmark's detailed results")
+    parser.add_argument("--queries", default=None, help="Text file of logged queries, one per line (alpha benchmark)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Number of simultaneous queries (batching benchmark)")
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE, help="Cassette of recorded calls, recorded if missing (replay benchmark)")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
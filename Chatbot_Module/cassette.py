@@ -0,0 +1,502 @@
+
+"""
+cassette.py
+
+This module records the calls made to OpenAI and Pinecone by the query pipeline and plays them back, so that the pipeline's own CPU overhead and its call pattern can be profiled and regression-tested offline with real-shaped data.
+
+In record mode, the wrapped clients forward every call and store the request, the response and the time it took (for streamed completions, the time of every chunk) in a cassette: a gzipped JSON-lines file in which long float arrays (embeddings, vectors) are packed as base64 float32. In replay mode, the wrappers need no underlying client: each call is looked up by a hash of its request and served from the cassette, immediately or after the recorded latency.
+
+Wrapped calls:
+- OpenAI and AsyncOpenAI: embeddings.create and chat.completions.create (streamed or not).
+- Pinecone Index: query.
+
+Usage:
+    with Cassette("cassettes/sample_queries.jsonl.gz", CassetteMode.RECORD) as cassette:
+        runtime = cassette.wrap_runtime(ChatbotRuntime.from_environment())
+        runtime.answer(query)
+
+    cassette = Cassette("cassettes/sample_queries.jsonl.gz", CassetteMode.REPLAY, replay_latency = False)
+    runtime = ChatbotRuntime(vectorizer, cassette.index(), cassette.openai(), cassette.async_openai())
+    runtime.answer(query)
+    cassette.calls   # the calls made, in order
+
+Main Classes:
+- CassetteMode: Whether a cassette records calls or replays them.
+- CassetteMissError: Raised in replay mode for a call that was not recorded.
+- Cassette: Storage of the recorded calls, and factory of the wrapped clients.
+"""
+
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from enum import Enum
+
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from auxiliaries import List, Dict, Any, Union, os, np
+
+
+
+# Lists of floats at least this long are packed as base64 float32 in the cassette and hashed as float32 in the keys
+PACKED_ARRAY_LENGTH = 16
+
+# Request parameters that do not change the response (stream_options only asks for usage when tracing is on)
+UNKEYED_PARAMETERS = ("stream_options", "timeout", "extra_headers")
+
+
+
+class CassetteMode(Enum):
+
+    """
+    Enum for the modes of a Cassette.
+
+    Attributes:
+        RECORD (str): Calls are forwarded to the real clients and stored.
+        REPLAY (str): Calls are served from the stored responses.
+    """
+
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+
+class CassetteMissError(LookupError):
+
+    """Raised in replay mode when a call was not recorded in the cassette."""
+
+
+
+def _is_float_array(value: Any)-> bool:
+
+    return (isinstance(value, list) and len(value) >= PACKED_ARRAY_LENGTH
+            and all(isinstance(item, float) for item in value)
+            )
+
+
+def _pack(value: Any)-> Any:
+
+    """Packs the long float lists of a JSON-like value as base64 float32."""
+
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if _is_float_array(value):
+        return {"__f32__": base64.b64encode(np.asarray(value, dtype = "<f4").tobytes()).decode()}
+    if isinstance(value, dict):
+        return {key: _pack(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_pack(item) for item in value]
+    return value
+
+
+def _unpack(value: Any)-> Any:
+
+    if isinstance(value, dict):
+        if "__f32__" in value:
+            return np.frombuffer(base64.b64decode(value["__f32__"]), dtype = "<f4").tolist()
+        return {key: _unpack(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unpack(item) for item in value]
+    return value
+
+
+def _request_key(call: str, request: Dict[str, Any])-> str:
+
+    """Hashes a call and its request parameters. Float arrays are hashed as float32, as they are stored."""
+
+    keyed_request = {name: value for name, value in request.items() if name not in UNKEYED_PARAMETERS}
+    serialized = json.dumps([call, _pack(keyed_request)], sort_keys = True, default = str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+
+class Cassette:
+
+    """
+    Recorded request/response pairs of the OpenAI and Pinecone calls, with their timings.
+
+    The wrappers returned by openai, async_openai and index share the cassette; calls from worker threads
+    (the Pinecone queries run in the default thread pool) are serialized by a lock. When a request was
+    recorded several times, replay serves the responses in the recorded order, then repeats the last one.
+    """
+
+    def __init__(self, path: str, mode: CassetteMode = CassetteMode.REPLAY, replay_latency: bool = False):
+
+        """
+        Initializes the Cassette instance.
+
+        Args:
+            path (str): The cassette file (gzipped JSON lines).
+            mode (CassetteMode): Whether to record or replay. Defaults to CassetteMode.REPLAY.
+            replay_latency (bool): In replay mode, whether each call waits for its recorded duration. Defaults to False.
+
+        Raises:
+            FileNotFoundError: In replay mode, if the cassette file does not exist.
+        """
+
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self.interactions: List[Dict[str, Any]] = []
+        self._replays: Dict[str, deque] = {}
+        self.calls: List[str] = []
+        self.counters: Dict[str, int] = {"recorded": 0, "replayed": 0, "misses": 0}
+
+        if mode == CassetteMode.REPLAY:
+            with gzip.open(path, "rt", encoding = "utf-8") as f:
+                self.interactions = [json.loads(line) for line in f if line.strip()]
+            for interaction in self.interactions:
+                self._replays.setdefault(interaction["key"], deque()).append(interaction)
+
+
+    def __enter__(self)-> "Cassette":
+
+        return self
+
+
+    def __exit__(self, *exc_info)-> bool:
+
+        if self.mode == CassetteMode.RECORD:
+            self.save()
+        return False
+
+
+    def save(self)-> None:
+
+        """Writes the recorded interactions to the cassette file."""
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        with gzip.open(self.path, "wt", encoding = "utf-8") as f:
+            for interaction in self.interactions:
+                f.write(json.dumps(interaction, separators = (",", ":")) + "\n")
+
+
+    def _record(self, call: str, request: Dict[str, Any], elapsed: float, response: Union[Dict, None] = None, chunks: Union[List, None] = None)-> None:
+
+        interaction = {"call": call, "key": _request_key(call, request), "request": _pack(request), "elapsed": elapsed}
+        if chunks is None:
+            interaction["response"] = _pack(response)
+        else:
+            interaction["chunks"] = [[offset, _pack(chunk)] for offset, chunk in chunks]
+
+        with self._lock:
+            self.interactions.append(interaction)
+            self.calls.append(call)
+            self.counters["recorded"] += 1
+
+
+    def _replay(self, call: str, request: Dict[str, Any])-> Dict[str, Any]:
+
+        key = _request_key(call, request)
+        with self._lock:
+            self.calls.append(call)
+            recorded = self._replays.get(key)
+            if not recorded:
+                self.counters["misses"] += 1
+                raise CassetteMissError(f"No recorded response for {call} in {self.path} (request key {key})")
+            interaction = recorded.popleft() if len(recorded) > 1 else recorded[0]
+            self.counters["replayed"] += 1
+        return interaction
+
+
+    def openai(self, client: Any = None)-> "_CassetteOpenAI":
+
+        """
+        Wraps an OpenAI client.
+
+        Args:
+            client (Any): The OpenAI client. Required in record mode, unused in replay mode.
+
+        Returns:
+            _CassetteOpenAI: A client exposing embeddings.create and chat.completions.create; other attributes are forwarded.
+        """
+
+        return _CassetteOpenAI(self, client)
+
+
+    def async_openai(self, client: Any = None)-> "_CassetteOpenAI":
+
+        """Wraps an AsyncOpenAI client. Same as openai, with coroutine methods."""
+
+        return _CassetteOpenAI(self, client, is_async = True)
+
+
+    def index(self, client: Any = None)-> "_CassetteIndex":
+
+        """
+        Wraps a Pinecone index client.
+
+        Args:
+            client (Any): The Pinecone index client. Required in record mode, unused in replay mode.
+
+        Returns:
+            _CassetteIndex: An index client exposing query; other attributes are forwarded.
+        """
+
+        return _CassetteIndex(self, client)
+
+
+    def wrap_runtime(self, runtime: Any)-> Any:
+
+        """
+        Replaces the OpenAI and Pinecone clients of a ChatbotRuntime (and of its EmbeddingBatcher) with wrappers.
+
+        Args:
+            runtime (ChatbotRuntime): The runtime whose clients to wrap.
+
+        Returns:
+            ChatbotRuntime: The same runtime.
+        """
+
+        runtime.openai_client = self.openai(runtime.openai_client)
+        runtime.pinecone_index_client = self.index(runtime.pinecone_index_client)
+        if runtime.async_openai_client is not None:
+            runtime.async_openai_client = self.async_openai(runtime.async_openai_client)
+        if runtime.embedding_batcher is not None:
+            runtime.embedding_batcher.openai_client = runtime.async_openai_client
+        return runtime
+
+
+    def stats(self)-> Dict[str, Any]:
+
+        """
+        Returns the record/replay counters and the number of calls per call name.
+
+        Returns:
+            Dict[str, Any]: The counters, with a "calls" dictionary of call counts.
+        """
+
+        call_counts: Dict[str, int] = {}
+        for call in self.calls:
+            call_counts[call] = call_counts.get(call, 0) + 1
+        return {**self.counters, "calls": call_counts}
+
+
+
+class _Endpoint:
+
+    """One wrapped client method (e.g. embeddings.create), recording or replaying its calls."""
+
+    def __init__(self, cassette: Cassette, call: str, method: Any, response_type: Any, is_async: bool):
+
+        self.cassette = cassette
+        self.call = call
+        self.method = method
+        self.response_type = response_type
+        self.is_async = is_async
+
+
+    def create(self, **request):
+
+        if self.is_async:
+            return self._create_async(request)
+
+        if self.cassette.mode == CassetteMode.REPLAY:
+            interaction = self.cassette._replay(self.call, request)
+            if "chunks" in interaction:
+                return _ReplayedStream(interaction, self.cassette.replay_latency, is_async = False)
+            if self.cassette.replay_latency:
+                time.sleep(interaction["elapsed"])
+            return self.response_type.model_validate(_unpack(interaction["response"]))
+
+        start = time.perf_counter()
+        response = self.method(**request)
+        if request.get("stream"):
+            return _RecordingStream(self, request, response, start)
+        self.cassette._record(self.call, request, time.perf_counter() - start, response = response.model_dump())
+        return response
+
+
+    async def _create_async(self, request: Dict[str, Any]):
+
+        if self.cassette.mode == CassetteMode.REPLAY:
+            interaction = self.cassette._replay(self.call, request)
+            if "chunks" in interaction:
+                return _ReplayedStream(interaction, self.cassette.replay_latency, is_async = True)
+            if self.cassette.replay_latency:
+                await asyncio.sleep(interaction["elapsed"])
+            return self.response_type.model_validate(_unpack(interaction["response"]))
+
+        start = time.perf_counter()
+        response = await self.method(**request)
+        if request.get("stream"):
+            return _RecordingStream(self, request, response, start)
+        self.cassette._record(self.call, request, time.perf_counter() - start, response = response.model_dump())
+        return response
+
+
+
+class _RecordingStream:
+
+    """Forwards a completion stream (sync or async) and records its chunks when it ends or is closed."""
+
+    def __init__(self, endpoint: _Endpoint, request: Dict[str, Any], stream: Any, start: float):
+
+        self.endpoint = endpoint
+        self.request = request
+        self.stream = stream
+        self.start = start
+        self.chunks: List[List] = []
+        self._recorded = False
+
+
+    def _finish(self)-> None:
+
+        if not self._recorded:
+            self._recorded = True
+            self.endpoint.cassette._record(self.endpoint.call, self.request, time.perf_counter() - self.start, chunks = self.chunks)
+
+
+    def __iter__(self):
+
+        for chunk in self.stream:
+            self.chunks.append([time.perf_counter() - self.start, chunk.model_dump()])
+            yield chunk
+        self._finish()
+
+
+    async def __aiter__(self):
+
+        async for chunk in self.stream:
+            self.chunks.append([time.perf_counter() - self.start, chunk.model_dump()])
+            yield chunk
+        self._finish()
+
+
+    def close(self):
+
+        # A stream closed early is recorded as far as it was read, which is what the pipeline saw
+        self._finish()
+        return self.stream.close()
+
+
+
+class _ReplayedStream:
+
+    """Serves recorded chunks as a sync or async stream, optionally at their recorded offsets."""
+
+    def __init__(self, interaction: Dict[str, Any], replay_latency: bool, is_async: bool):
+
+        self.chunks = [(offset, ChatCompletionChunk.model_validate(_unpack(chunk))) for offset, chunk in interaction["chunks"]]
+        self.replay_latency = replay_latency
+        self.is_async = is_async
+
+
+    def __iter__(self):
+
+        start = time.perf_counter()
+        for offset, chunk in self.chunks:
+            if self.replay_latency:
+                time.sleep(max(0.0, offset - (time.perf_counter() - start)))
+            yield chunk
+
+
+    async def __aiter__(self):
+
+        start = time.perf_counter()
+        for offset, chunk in self.chunks:
+            if self.replay_latency:
+                await asyncio.sleep(max(0.0, offset - (time.perf_counter() - start)))
+            yield chunk
+
+
+    def close(self):
+
+        # The async pipeline awaits close(), like AsyncStream.close
+        return _closed() if self.is_async else None
+
+
+
+async def _closed()-> None:
+
+    return None
+
+
+
+class _Namespace:
+
+    def __init__(self, **endpoints):
+
+        self.__dict__.update(endpoints)
+
+
+
+class _CassetteOpenAI:
+
+    """An OpenAI or AsyncOpenAI client whose embeddings and chat completions go through a Cassette."""
+
+    def __init__(self, cassette: Cassette, client: Any = None, is_async: bool = False):
+
+        self._client = client
+        recorded = lambda path: None if client is None else _attribute(client, path)
+        self.embeddings = _Endpoint(cassette, "openai.embeddings.create", recorded("embeddings.create"), CreateEmbeddingResponse, is_async)
+        self.chat = _Namespace(completions = _Endpoint(cassette, "openai.chat.completions.create", recorded("chat.completions.create"),
+                                                       ChatCompletion, is_async
+                                                       ))
+
+
+    def __getattr__(self, name: str)-> Any:
+
+        return getattr(self._client, name)
+
+
+
+class _QueryResponse:
+
+    """A recorded or replayed Pinecone query result, exposing to_dict() like the client's QueryResponse."""
+
+    def __init__(self, query_result: Dict):
+
+        self.query_result = query_result
+
+
+    def to_dict(self)-> Dict:
+
+        return self.query_result
+
+
+
+class _CassetteIndex:
+
+    """A Pinecone index client whose queries go through a Cassette."""
+
+    def __init__(self, cassette: Cassette, client: Any = None):
+
+        self._cassette = cassette
+        self._client = client
+
+
+    def query(self, **request)-> _QueryResponse:
+
+        if self._cassette.mode == CassetteMode.REPLAY:
+            interaction = self._cassette._replay("pinecone.query", request)
+            if self._cassette.replay_latency:
+                time.sleep(interaction["elapsed"])
+            return _QueryResponse(_unpack(interaction["response"]))
+
+        start = time.perf_counter()
+        query_result: Dict = self._client.query(**request).to_dict()
+        self._cassette._record("pinecone.query", request, time.perf_counter() - start, response = query_result)
+        return _QueryResponse(query_result)
+
+
+    def __getattr__(self, name: str)-> Any:
+
+        return getattr(self._client, name)
+
+
+
+def _attribute(client: Any, path: str)-> Any:
+
+    for name in path.split("."):
+        client = getattr(client, name)
+    return client
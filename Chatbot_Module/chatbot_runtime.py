@@ -0,0 +1,408 @@
+
+"""
+chatbot_runtime.py
+
+This module holds the long-lived resources needed to answer chatbot queries. Loading the TF-IDF vectorizer from disk and resolving the Pinecone index client are expensive, so they are done once when the bot starts and reused for every incoming message.
+
+Usage:
+    Build a runtime once at startup with ChatbotRuntime.from_environment() and pass it to get_chatbot_response (or call its answer method directly) for each message.
+    When the runtime has a SemanticAnswerCache, paraphrases of previously answered questions are answered from it without querying Pinecone or GPT. The cache is keyed on the index version, which the runtime reads from describe_index_stats at most once every index_version_interval seconds.
+    With embedding_batch_window > 0, the query embeddings of concurrent answer_async/answer_stream calls are sent in shared embeddings requests.
+
+Enums:
+- VectorBackend: Selects the index queried for passages: the Pinecone service or the in-process LocalHybridIndex.
+
+Main Classes:
+- ChatbotRuntime: Holds the vectorizer, the Pinecone index client and the OpenAI clients, and answers queries with them (answer / answer_async / answer_stream).
+"""
+
+
+import asyncio
+import json
+import time
+from enum import Enum
+from auxiliaries import Union, Dict, AsyncIterator
+from pinecone_kit import pinecone_connection, index_name, Pinecone
+from pinecone_kit import get_pinecone_index_client
+from embedding_matrix_loader import load_vectorizer, TfidfVectorizer
+from embedding_matrix_loader import VECTORIZER_PKL, VECTORIZER_FOLDER
+from embedding_matrix_loader import convert_string_query_to_vectors, convert_string_query_to_vectors_async
+from openai_kit import OpenAI, AsyncOpenAI, openai_client, async_openai_client
+from query_processor import process_query, process_query_async, stream_query_async, AnsweringStrategy, RetrievalMode
+from query_processor import AnswerFormat, ScoreThresholds, QueryOptions
+from query_processor import answer_was_found
+from embedding_cache import EmbeddingCache
+from answer_cache import SemanticAnswerCache
+from completion_cache import CompletionCache
+from embedding_batcher import EmbeddingBatcher
+from query_analyzer import QueryAnalyzer
+from local_index import LocalHybridIndex
+from ann_index import load_or_build_ivf_index
+
+
+
+class VectorBackend(Enum):
+
+    """
+    Enum for selecting the index that passages are retrieved from.
+
+    Attributes:
+        PINECONE (str): The Pinecone index named by INDEX_NAME.
+        LOCAL (str): A LocalHybridIndex built in memory from the batch output JSONL files, scored exactly.
+        LOCAL_ANN (str): The same LocalHybridIndex, restricted to the candidates of an IVF index on the dense side.
+    """
+
+    PINECONE = "pinecone"
+    LOCAL = "local"
+    LOCAL_ANN = "local_ann"
+
+
+
+class ChatbotRuntime:
+
+    """
+    A container for the resources shared by every chatbot query.
+
+    The runtime is meant to be created once per process and reused, so that the vectorizer
+    is unpickled and the Pinecone index client is resolved only at startup.
+    """
+
+    def __init__(self,
+                 vectorizer: TfidfVectorizer,
+                 pinecone_index_client: Pinecone.Index,
+                 openai_client: OpenAI,
+                 async_openai_client: Union[AsyncOpenAI, None] = None,
+                 concurrent_candidates: bool = False,
+                 answering_strategy: AnsweringStrategy = AnsweringStrategy.PER_PASSAGE,
+                 retrieval_mode: RetrievalMode = RetrievalMode.PER_ALPHA,
+                 embedding_cache: Union[EmbeddingCache, None] = None,
+                 answer_cache: Union[SemanticAnswerCache, None] = None,
+                 abort_unanswerable: bool = False,
+                 answer_format: AnswerFormat = AnswerFormat.SENTINEL,
+                 completion_cache: Union[CompletionCache, None] = None,
+                 adaptive_alpha: bool = False,
+                 score_thresholds: Union[ScoreThresholds, None] = None,
+                 embedding_batch_window: float = 0.0,
+                 embedding_batch_size: int = 64,
+                 index_version_interval: float = 60.0
+                 ):
+
+        """
+        Initializes the ChatbotRuntime instance.
+
+        Args:
+            vectorizer (TfidfVectorizer): The fitted TF-IDF vectorizer used for the sparse query vectors.
+            pinecone_index_client (Pinecone.Index): The Pinecone index client to query (or a LocalHybridIndex).
+            openai_client (OpenAI): The OpenAI client used for embeddings and chat completions.
+            async_openai_client (Union[AsyncOpenAI, None]): The asynchronous OpenAI client used by answer_async.
+                Defaults to None, in which case answer_async is unavailable.
+            concurrent_candidates (bool): Whether answer_async sends the Pinecone texts of an alpha value to GPT
+                concurrently. Defaults to False.
+            answering_strategy (AnsweringStrategy): How retrieved texts are turned into an answer.
+                Defaults to AnsweringStrategy.PER_PASSAGE.
+            retrieval_mode (RetrievalMode): How Pinecone is queried for the alpha values. Defaults to RetrievalMode.PER_ALPHA.
+            embedding_cache (Union[EmbeddingCache, None]): Cache of query embeddings. Defaults to None (no caching).
+            answer_cache (Union[SemanticAnswerCache, None]): Cache of answers searched by query similarity, consulted
+                before Pinecone and GPT. Defaults to None (no caching).
+            abort_unanswerable (bool): Whether completions are streamed and stopped as soon as they are the '' sentinel.
+                Defaults to False.
+            answer_format (AnswerFormat): Whether GPT signals unanswerable texts with the '' sentinel or a JSON verdict.
+                Defaults to AnswerFormat.SENTINEL.
+            completion_cache (Union[CompletionCache, None]): Cache of GPT's responses to query/passage pairs, shared
+                across users and restarts. Defaults to None (no caching).
+            adaptive_alpha (bool): Whether the alpha values are ordered per query by a QueryAnalyzer built on the
+                vectorizer, instead of always trying dense retrieval first. Defaults to False.
+            score_thresholds (Union[ScoreThresholds, None]): Pinecone score thresholds for skipping weak candidates and
+                giving up early. Defaults to None (every retrieved passage is sent to GPT).
+            embedding_batch_window (float): Seconds during which answer_async and answer_stream gather concurrent queries
+                into one embeddings call. Defaults to 0.0 (one call per query).
+            embedding_batch_size (int): Number of waiting queries that sends an embeddings batch at once. Defaults to 64.
+            index_version_interval (float): Seconds during which the index version used by the answer cache is reused
+                before describe_index_stats is called again. Defaults to 60.0.
+        """
+
+        self.vectorizer = vectorizer
+        self.pinecone_index_client = pinecone_index_client
+        self.openai_client = openai_client
+        self.async_openai_client = async_openai_client
+        self.concurrent_candidates = concurrent_candidates
+        self.answering_strategy = answering_strategy
+        self.retrieval_mode = retrieval_mode
+        self.embedding_cache = embedding_cache
+        self.answer_cache = answer_cache
+        self.abort_unanswerable = abort_unanswerable
+        self.answer_format = answer_format
+        self.completion_cache = completion_cache
+        self.query_analyzer: Union[QueryAnalyzer, None] = QueryAnalyzer(vectorizer) if adaptive_alpha else None
+        self.score_thresholds = score_thresholds
+        self.embedding_batcher: Union[EmbeddingBatcher, None] = (EmbeddingBatcher(async_openai_client,
+                                                                                  window_seconds = embedding_batch_window,
+                                                                                  max_batch_size = embedding_batch_size
+                                                                                  )
+                                                                 if async_openai_client is not None and embedding_batch_window > 0 else None
+                                                                 )
+        self.index_version_interval = index_version_interval
+        self._index_version = ""
+        self._index_version_checked_at: Union[float, None] = None
+        # Totals of the passages sent to GPT and of the completions saved by skipping repeated passages
+        self.passage_counters: Dict[str, int] = {"queries": 0, "passages_evaluated": 0, "completions_saved": 0, "candidates_below_floor": 0}
+
+
+    @classmethod
+    def from_environment(cls,
+                         pinecone_client: Pinecone = pinecone_connection,
+                         pinecone_index_name: Union[str, None] = index_name,
+                         openai_client: OpenAI = openai_client,
+                         async_openai_client: AsyncOpenAI = async_openai_client,
+                         vectorizer_folder: str = VECTORIZER_FOLDER,
+                         vectorizer_pkl: str = VECTORIZER_PKL,
+                         vector_backend: VectorBackend = VectorBackend.PINECONE,
+                         **runtime_options
+                         )-> "ChatbotRuntime":
+
+        """
+        Builds a runtime from the connections configured in the environment (.env file).
+
+        Args:
+            pinecone_client (Pinecone): The Pinecone connection. Defaults to the module-level connection.
+            pinecone_index_name (Union[str, None]): The name of the Pinecone index. Defaults to INDEX_NAME.
+            openai_client (OpenAI): The OpenAI client. Defaults to the module-level client.
+            async_openai_client (AsyncOpenAI): The asynchronous OpenAI client. Defaults to the module-level client.
+            vectorizer_folder (str): The folder containing the vectorizer pickle file.
+            vectorizer_pkl (str): The name of the vectorizer pickle file.
+            vector_backend (VectorBackend): The index to retrieve passages from. Defaults to VectorBackend.PINECONE.
+            **runtime_options: Query settings forwarded to ChatbotRuntime (concurrent_candidates, answering_strategy, ...).
+
+        Returns:
+            ChatbotRuntime: A runtime holding the loaded resources.
+
+        Raises:
+            ValueError: If the Pinecone index client could not be retrieved.
+            FileNotFoundError: If a local backend is selected but the OpenAI batch output folder is missing.
+        """
+
+        vectorizer: TfidfVectorizer = load_vectorizer(vectorizer_folder, vectorizer_pkl)
+
+        if vector_backend in (VectorBackend.LOCAL, VectorBackend.LOCAL_ANN):
+            local_index = LocalHybridIndex.from_batch_output(vectorizer)
+            if vector_backend == VectorBackend.LOCAL_ANN:
+                local_index.attach_dense_ann(load_or_build_ivf_index(local_index.dense_matrix))
+            return cls(vectorizer, local_index, openai_client, async_openai_client, **runtime_options)
+
+        pinecone_index_client: Pinecone.Index = get_pinecone_index_client(pinecone_client, pinecone_index_name)
+
+        if pinecone_index_client is None:
+            raise ValueError(f"Could not build a chatbot runtime: index {pinecone_index_name} is not available")
+
+        return cls(vectorizer, pinecone_index_client, openai_client, async_openai_client, **runtime_options)
+
+
+    def _query_options(self)-> QueryOptions:
+
+        """Returns the current settings of the runtime as the QueryOptions of process_query, process_query_async and stream_query_async."""
+
+        return QueryOptions(answering_strategy = self.answering_strategy,
+                            retrieval_mode = self.retrieval_mode,
+                            concurrent_candidates = self.concurrent_candidates,
+                            embedding_cache = self.embedding_cache,
+                            abort_unanswerable = self.abort_unanswerable,
+                            answer_format = self.answer_format,
+                            completion_cache = self.completion_cache,
+                            query_analyzer = self.query_analyzer,
+                            score_thresholds = self.score_thresholds,
+                            passage_counters = self.passage_counters
+                            )
+
+
+    def component_counters(self)-> Dict[str, Dict[str, float]]:
+
+        """
+        Returns the counters kept by the runtime's caches and batcher, for the metrics endpoint.
+
+        Returns:
+            Dict[str, Dict[str, float]]: The counters of each component the runtime holds, keyed by component name.
+        """
+
+        components = {"embedding_cache": self.embedding_cache,
+                      "answer_cache": self.answer_cache,
+                      "completion_cache": self.completion_cache,
+                      "embedding_batcher": self.embedding_batcher
+                      }
+        component_counters = {name: dict(component.counters) for name, component in components.items() if component is not None}
+        component_counters["passages"] = dict(self.passage_counters)
+        return component_counters
+
+
+    def _index_version_is_stale(self)-> bool:
+
+        return (self._index_version_checked_at is None
+                or time.monotonic() - self._index_version_checked_at >= self.index_version_interval
+                )
+
+
+    def _refresh_index_version(self)-> str:
+
+        """
+        Reads the version of the index from its vector counts (describe_index_stats).
+
+        Re-uploading or deleting records changes the counts, and so the version. Re-upserting the same ids
+        with new content does not: the answer cache then keeps serving answers built from the old texts until
+        the bot restarts. An index without describe_index_stats (the in-process LocalHybridIndex, built once per
+        process) keeps the version "". If the call fails, the previous version is kept until the next check.
+        """
+
+        self._index_version_checked_at = time.monotonic()
+        describe_index_stats = getattr(self.pinecone_index_client, "describe_index_stats", None)
+        if describe_index_stats is None:
+            return self._index_version
+
+        try:
+            index_stats: Dict = describe_index_stats().to_dict()
+            namespace_counts = {name: namespace.get("vector_count") for name, namespace in (index_stats.get("namespaces") or {}).items()}
+            self._index_version = json.dumps({"total_vector_count": index_stats.get("total_vector_count"), "namespaces": namespace_counts},
+                                             sort_keys = True
+                                             )
+        except Exception as e:
+            print(f"Could not read the index version, keeping the previous one: {e}")
+        return self._index_version
+
+
+    def index_version(self)-> str:
+
+        """Returns the version of the index the answer cache is keyed on, refreshed every index_version_interval seconds."""
+
+        return self._refresh_index_version() if self._index_version_is_stale() else self._index_version
+
+
+    async def index_version_async(self)-> str:
+
+        """
+        Returns the index version like index_version, reading describe_index_stats in a worker thread when due.
+
+        The latest version is returned after the thread, rather than the one it read, so that concurrent refreshes
+        finishing out of order never hand the answer cache an older version.
+        """
+
+        if self._index_version_is_stale():
+            await asyncio.to_thread(self._refresh_index_version)
+        return self._index_version
+
+
+    def answer(self, query: str)-> str:
+
+        """
+        Answers a query using the resources held by the runtime.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            str: The generated response based on the user's query and relevant texts from Pinecone.
+        """
+
+        if self.answer_cache is None:
+            return process_query(query, self.pinecone_index_client, self.openai_client, self.vectorizer, self._query_options())
+
+        search_query_dense_sparse: Dict = convert_string_query_to_vectors(query, self.openai_client, self.vectorizer,
+                                                                          embedding_cache = self.embedding_cache
+                                                                          )
+        index_version: str = self.index_version()
+        cached_answer: Union[str, None] = self.answer_cache.lookup(search_query_dense_sparse["dense"], index_version)
+        if cached_answer is not None:
+            return cached_answer
+
+        answer: str = process_query(query, self.pinecone_index_client, self.openai_client, self.vectorizer, self._query_options(),
+                                    search_query_dense_sparse = search_query_dense_sparse
+                                    )
+        self._remember_answer(query, search_query_dense_sparse, answer, index_version)
+        return answer
+
+
+    async def answer_async(self, query: str)-> str:
+
+        """
+        Answers a query without blocking the event loop.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            str: The generated response based on the user's query and relevant texts from Pinecone.
+
+        Raises:
+            ValueError: If the runtime was built without an asynchronous OpenAI client.
+        """
+
+        if self.async_openai_client is None:
+            raise ValueError("answer_async requires a runtime built with an AsyncOpenAI client")
+
+        search_query_dense_sparse: Dict = await self._convert_query_async(query)
+        if self.answer_cache is not None:
+            index_version: str = await self.index_version_async()
+            cached_answer: Union[str, None] = self.answer_cache.lookup(search_query_dense_sparse["dense"], index_version)
+            if cached_answer is not None:
+                return cached_answer
+
+        answer: str = await process_query_async(query, self.pinecone_index_client, self.async_openai_client, self.vectorizer,
+                                                self._query_options(),
+                                                search_query_dense_sparse = search_query_dense_sparse
+                                                )
+        if self.answer_cache is not None:
+            self._remember_answer(query, search_query_dense_sparse, answer, index_version)
+        return answer
+
+
+    async def answer_stream(self, query: str)-> AsyncIterator[str]:
+
+        """
+        Answers a query, yielding the answer in pieces as GPT generates it (see stream_query_async).
+
+        Args:
+            query (str): The user's query.
+
+        Yields:
+            str: Successive pieces of the answer. A cached answer is yielded in one piece.
+
+        Raises:
+            ValueError: If the runtime was built without an asynchronous OpenAI client.
+        """
+
+        if self.async_openai_client is None:
+            raise ValueError("answer_stream requires a runtime built with an AsyncOpenAI client")
+
+        search_query_dense_sparse: Dict = await self._convert_query_async(query)
+        if self.answer_cache is not None:
+            index_version: str = await self.index_version_async()
+            cached_answer: Union[str, None] = self.answer_cache.lookup(search_query_dense_sparse["dense"], index_version)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+
+        answer_pieces = []
+        async for answer_piece in stream_query_async(query, self.pinecone_index_client, self.async_openai_client, self.vectorizer,
+                                                     self._query_options(),
+                                                     search_query_dense_sparse = search_query_dense_sparse
+                                                     ):
+            answer_pieces.append(answer_piece)
+            yield answer_piece
+
+        if self.answer_cache is not None:
+            self._remember_answer(query, search_query_dense_sparse, "".join(answer_pieces), index_version)
+
+
+    async def _convert_query_async(self, query: str)-> Dict:
+
+        """Computes the query vectors, through the embedding cache and the embedding batcher when the runtime has them."""
+
+        return await convert_string_query_to_vectors_async(query, self.async_openai_client, self.vectorizer,
+                                                           embedding_cache = self.embedding_cache,
+                                                           embedding_batcher = self.embedding_batcher
+                                                           )
+
+
+    def _remember_answer(self, query: str, search_query_dense_sparse: Dict, answer: str, index_version: str)-> None:
+
+        """Stores found answers in the answer cache. The default message echoes the query, so it is never reused."""
+
+        if answer_was_found(answer, query):
+            self.answer_cache.store(search_query_dense_sparse["dense"], answer, index_version)
@@ -0,0 +1,228 @@
+
+"""
+completion_cache.py
+
+This module caches GPT's responses to passage/question pairs across users and restarts. The same exam questions come back day after day and retrieve the same Pinecone passages, so the response for a pair can be reused instead of calling gpt-4o-mini again. Both answers and "not found" responses are cached, so a repeated question is answered with no model call at all. A "not found" response (stored as the '' sentinel) expires much sooner than an answer, so that a wrong one is not served for the whole TTL.
+
+Usage:
+    Create one CompletionCache per process (CompletionCache.from_folder()) and give it to the ChatbotRuntime. Answers expire after ttl_seconds and '' sentinels after not_found_ttl_seconds, and the least recently used entries are evicted beyond max_entries.
+
+    get() only reads the SQLite file: the recency of a hit is kept in memory and written with the next put(). The calls still touch the disk, so the async pipeline runs them with asyncio.to_thread().
+
+    The match id is the id of the passage in the index queried: a uuid4 in Pinecone (new on every upload), the batch custom_id in the LocalHybridIndex. Completions cached with one VECTOR_BACKEND, or before a re-upload, are therefore not found with another.
+
+Main Classes:
+- CompletionCache: SQLite (WAL mode) cache of completions keyed by normalized query, Pinecone match id, model, temperature and prompt template.
+
+Main Functions:
+- prompt_template_hash: Hashes the text of a prompt template, so that editing a template invalidates its cached completions.
+"""
+
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from auxiliaries import Dict, Union, os
+from embedding_cache import normalize_query, EMBEDDING_CACHE_FOLDER
+
+
+
+COMPLETION_CACHE_DB = "completions.sqlite"
+
+
+def prompt_template_hash(template_text: str)-> str:
+
+    """
+    Hashes the text of a prompt template.
+
+    Args:
+        template_text (str): The template, before formatting.
+
+    Returns:
+        str: A short hexadecimal digest of the template.
+    """
+
+    return hashlib.sha256(template_text.encode("utf-8")).hexdigest()[:16]
+
+
+
+class CompletionCache:
+
+    """
+    A persistent cache of GPT completions for (query, passage) pairs.
+
+    The key combines the normalized query, the Pinecone id of the passage, the model, the temperature and a
+    hash of the prompt template, so a change to any of them misses the cache. The SQLite file is opened in
+    WAL mode, so lookups are not blocked while another request writes. Lookups never write: expired entries are
+    purged and the last_used times of hits are flushed by put() and close().
+    """
+
+    def __init__(self,
+                 db_path: str = ":memory:",
+                 ttl_seconds: float = 30 * 24 * 3600,
+                 max_entries: int = 50_000,
+                 not_found_ttl_seconds: float = 3600
+                 ):
+
+        """
+        Initializes the CompletionCache instance.
+
+        Args:
+            db_path (str): Path of the SQLite file. Defaults to ":memory:" (not persisted).
+            ttl_seconds (float): Age after which a cached completion expires. Defaults to 30 days.
+            max_entries (int): Maximum number of cached completions. Defaults to 50,000.
+            not_found_ttl_seconds (float): Age after which a cached '' sentinel ("not found") expires. Defaults to one hour.
+        """
+
+        self.ttl_seconds = ttl_seconds
+        self.not_found_ttl_seconds = not_found_ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._pending_touches: Dict[str, float] = {}
+
+        self._connection = sqlite3.connect(db_path, check_same_thread = False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS completions (
+                                        key TEXT PRIMARY KEY,
+                                        model TEXT NOT NULL,
+                                        response TEXT NOT NULL,
+                                        created_at REAL NOT NULL,
+                                        last_used REAL NOT NULL
+                                        )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions (last_used)")
+        self._connection.commit()
+
+
+    @classmethod
+    def from_folder(cls, cache_folder: str = EMBEDDING_CACHE_FOLDER, cache_db: str = COMPLETION_CACHE_DB, **kwargs)-> "CompletionCache":
+
+        """
+        Creates a cache stored in the same folder as the embedding cache.
+
+        Args:
+            cache_folder (str): The folder holding the SQLite file, relative to the project root.
+            cache_db (str): The name of the SQLite file.
+            **kwargs: TTL and size limit forwarded to CompletionCache.
+
+        Returns:
+            CompletionCache: The cache.
+        """
+
+        cache_folderpath = os.path.join("..", cache_folder)
+        os.makedirs(cache_folderpath, exist_ok = True)
+        return cls(os.path.join(cache_folderpath, cache_db), **kwargs)
+
+
+    @staticmethod
+    def _make_key(query: str, match_id: str, model: str, temperature: float, template_hash: str)-> str:
+
+        return hashlib.sha256(f"{model}\n{temperature}\n{template_hash}\n{match_id}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+    def get(self, query: str, match_id: str, model: str, temperature: float, template_hash: str)-> Union[str, None]:
+
+        """
+        Looks up the completion for a query and a passage.
+
+        Args:
+            query (str): The user query.
+            match_id (str): The Pinecone id of the passage.
+            model (str): The chat model.
+            temperature (float): The sampling temperature.
+            template_hash (str): The prompt_template_hash of the prompt template.
+
+        Returns:
+            Union[str, None]: The cached response (possibly the '' sentinel), or None on a miss.
+        """
+
+        key = self._make_key(query, match_id, model, temperature, template_hash)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+
+            response, created_at = row
+            if now - created_at > (self.not_found_ttl_seconds if response == "" else self.ttl_seconds):
+                self.counters["misses"] += 1
+                return None
+
+            self._pending_touches[key] = now
+            self.counters["hits"] += 1
+            return response
+
+
+    def _flush_touches(self)-> None:
+
+        """Writes the last_used times of the hits since the previous flush. The caller holds the lock and commits."""
+
+        if self._pending_touches:
+            self._connection.executemany("UPDATE completions SET last_used = ? WHERE key = ?",
+                                         [(last_used, key) for key, last_used in self._pending_touches.items()]
+                                         )
+            self._pending_touches.clear()
+
+
+    def put(self, query: str, match_id: str, model: str, temperature: float, template_hash: str, response: str)-> None:
+
+        """
+        Stores the completion for a query and a passage, evicting expired and least recently used entries.
+
+        Args:
+            query (str): The user query.
+            match_id (str): The Pinecone id of the passage.
+            model (str): The chat model.
+            temperature (float): The sampling temperature.
+            template_hash (str): The prompt_template_hash of the prompt template.
+            response (str): The response to cache. An unanswered passage must be stored as the '' sentinel, so that it
+                expires after not_found_ttl_seconds.
+        """
+
+        key = self._make_key(query, match_id, model, temperature, template_hash)
+        now = time.time()
+        with self._lock:
+            self._flush_touches()
+            self._connection.execute("INSERT OR REPLACE INTO completions (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                                     (key, model, response, now, now)
+                                     )
+            expired = self._connection.execute("DELETE FROM completions WHERE created_at < ? OR (response = '' AND created_at < ?)",
+                                               (now - self.ttl_seconds, now - self.not_found_ttl_seconds)
+                                               ).rowcount
+            evicted = self._connection.execute("""DELETE FROM completions WHERE key IN (
+                                                      SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                                                      )""", (self.max_entries,)).rowcount
+            self._connection.commit()
+            self.counters["expired"] += expired
+            self.counters["evictions"] += evicted
+
+
+    def stats(self)-> Dict[str, Union[int, float]]:
+
+        """
+        Returns the hit/miss/eviction counters and the number of cached completions.
+
+        Returns:
+            Dict[str, Union[int, float]]: Counters, hit rate and entry count.
+        """
+
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            entries = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            return {**self.counters,
+                    "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                    "entries": entries,
+                    }
+
+
+    def close(self)-> None:
+
+        """Writes the pending last_used times and closes the connection to the SQLite file."""
+
+        with self._lock:
+            self._flush_touches()
+            self._connection.commit()
+            self._connection.close()
@@ -0,0 +1,178 @@
+
+"""
+embedding_batcher.py
+
+This module groups the query embeddings requested at about the same time into one call to the embeddings API. When many students message at once, each query used to make its own embeddings request although the API accepts a list of inputs. The batcher holds the queries arriving within a short window (or until max_batch_size are waiting), sends them in a single embeddings.create call, and hands each waiting request its own vector.
+
+Usage:
+    embedding_batcher = EmbeddingBatcher(async_openai_client, window_seconds = 0.01, max_batch_size = 64)
+    dense_vector = await embedding_batcher.embed(query)
+
+    Pass it to convert_string_query_to_vectors_async (embedding_batcher = ...) or to the ChatbotRuntime.
+    A batcher must be used from a single event loop.
+
+Main Classes:
+- EmbeddingBatcher: Async micro-batcher of embeddings requests with a configurable window and batch size.
+"""
+
+
+import asyncio
+
+from auxiliaries import List, Dict, Tuple, Union
+from openai_kit import AsyncOpenAI
+from tracing import tracer
+
+
+
+class EmbeddingBatcher:
+
+    """
+    Collects embedding requests and sends them to the API in batches.
+
+    The first request of a batch starts the window; the batch is sent when the window ends or as soon as
+    max_batch_size requests are waiting. Identical texts in a batch are only sent once. If the API call
+    fails, each text of the batch is retried in a call of its own, so that one bad input (e.g. an over-long
+    query) only fails its own requests. Requests still waiting when a batch is cancelled are cancelled too.
+    """
+
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 openai_model: str = "text-embedding-3-small",
+                 window_seconds: float = 0.01,
+                 max_batch_size: int = 64
+                 ):
+
+        """
+        Initializes the EmbeddingBatcher instance.
+
+        Args:
+            openai_client (AsyncOpenAI): The asynchronous OpenAI client used for the embeddings calls.
+            openai_model (str): The embedding model. Defaults to "text-embedding-3-small".
+            window_seconds (float): How long the first request of a batch waits for others. Defaults to 0.01.
+            max_batch_size (int): Number of waiting requests that sends the batch at once. Defaults to 64.
+        """
+
+        self.openai_client = openai_client
+        self.openai_model = openai_model
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._window_task: Union[asyncio.Task, None] = None
+        # The event loop only keeps weak references to tasks, so the batches in flight are held here until they finish
+        self._batch_tasks: set = set()
+        self.counters: Dict[str, int] = {"requests": 0, "batches": 0, "inputs_sent": 0, "largest_batch": 0, "failed_batches": 0}
+
+
+    async def embed(self, text: str)-> List[float]:
+
+        """
+        Returns the embedding of a text, sent to the API together with the other requests of its batch.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            List[float]: The embedding, as the API returns it.
+        """
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        self.counters["requests"] += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._send_pending()
+        elif self._window_task is None:
+            self._window_task = asyncio.create_task(self._close_window())
+
+        return await future
+
+
+    async def _close_window(self)-> None:
+
+        await asyncio.sleep(self.window_seconds)
+        self._window_task = None
+        self._send_pending()
+
+
+    def _send_pending(self)-> None:
+
+        """Takes the waiting requests and sends them as one batch in the background."""
+
+        if self._window_task is not None:
+            self._window_task.cancel()
+            self._window_task = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            batch_task = asyncio.create_task(self._send_batch(batch))
+            self._batch_tasks.add(batch_task)
+            batch_task.add_done_callback(lambda finished_task: self._release_batch(finished_task, batch))
+
+
+    def _release_batch(self, batch_task: asyncio.Task, batch: List[Tuple[str, asyncio.Future]])-> None:
+
+        """
+        Forgets a finished batch task and cancels the requests it left unresolved. A task cancelled before it
+        started never runs its body, so this is done in the done callback rather than in _send_batch.
+        """
+
+        self._batch_tasks.discard(batch_task)
+        for _, future in batch:
+            if not future.done():
+                future.cancel()
+
+
+    async def _create_embeddings(self, texts: List[str])-> Dict[str, List[float]]:
+
+        """Sends one embeddings call and returns the vector of each text."""
+
+        with tracer.span("embedding_batch"):
+            embedding_response = await self.openai_client.embeddings.create(input = texts, model = self.openai_model)
+
+        usage = getattr(embedding_response, "usage", None)
+        if usage is not None:
+            tracer.count("embedding_tokens", usage.total_tokens)
+
+        return {texts[item.index]: item.embedding for item in embedding_response.data}
+
+
+    async def _send_batch(self, batch: List[Tuple[str, asyncio.Future]])-> None:
+
+        texts: List[str] = list(dict.fromkeys(text for text, _ in batch))
+        self.counters["batches"] += 1
+        self.counters["inputs_sent"] += len(texts)
+        self.counters["largest_batch"] = max(self.counters["largest_batch"], len(batch))
+
+        try:
+            results: Dict[str, Union[List[float], BaseException]] = await self._create_embeddings(texts)
+        except Exception as error:
+            if len(texts) == 1:
+                results = {texts[0]: error}
+            else:
+                self.counters["failed_batches"] += 1
+                self.counters["inputs_sent"] += len(texts)
+                single_results = await asyncio.gather(*(self._create_embeddings([text]) for text in texts), return_exceptions = True)
+                results = {text: single_result if isinstance(single_result, BaseException) else single_result[text]
+                           for text, single_result in zip(texts, single_results)
+                           }
+
+        for text, future in batch:
+            if not future.done():
+                if isinstance(results[text], BaseException):
+                    future.set_exception(results[text])
+                else:
+                    future.set_result(results[text])
+
+
+    def stats(self)-> Dict[str, Union[int, float]]:
+
+        """
+        Returns the request and batch counters.
+
+        Returns:
+            Dict[str, Union[int, float]]: Counters and the mean number of requests per API call.
+        """
+
+        return {**self.counters,
+                "requests_per_call": self.counters["requests"] / self.counters["batches"] if self.counters["batches"] else 0.0,
+                }
@@ -0,0 +1,232 @@
+
+"""
+embedding_cache.py
+
+This module caches the dense embeddings of user queries, so that repeated questions do not call the OpenAI embeddings API again. The cache has two tiers: an in-memory LRU in front of an on-disk SQLite store that survives restarts of the bot.
+
+Usage:
+    Create one EmbeddingCache per process and pass it to convert_string_query_to_vectors (or to the ChatbotRuntime). A disk lookup does not write: the recency of a hit is kept in memory and written with the next put(). The async pipeline still calls the cache with asyncio.to_thread(), since a lookup may read the disk.
+
+Main Classes:
+- EmbeddingCache: Two-tier (memory LRU + SQLite in WAL mode) cache of query embeddings keyed by normalized text and model name.
+
+Main Functions:
+- normalize_query: Normalizes a query before it is used as a cache key.
+"""
+
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from auxiliaries import Dict, Union, List, os, np
+
+
+
+EMBEDDING_CACHE_FOLDER = "cache"
+EMBEDDING_CACHE_DB = "query_embeddings.sqlite"
+
+
+def normalize_query(query: str)-> str:
+
+    """
+    Normalizes a query so that trivially different spellings of the same question share a cache entry.
+
+    Args:
+        query (str): The raw user query.
+
+    Returns:
+        str: The query, case-folded, with surrounding whitespace removed and inner whitespace collapsed.
+    """
+
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+
+class EmbeddingCache:
+
+    """
+    A two-tier cache of query embeddings.
+
+    Vectors are stored as float32, both in memory and on disk (as raw bytes). Each tier is bounded in size and
+    evicts its least recently used entries. Hits and misses are counted per tier. The last_used times of disk hits
+    are flushed by put() and close(), so lookups never commit.
+    """
+
+    def __init__(self,
+                 db_path: Union[str, None] = None,
+                 max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100_000
+                 ):
+
+        """
+        Initializes the EmbeddingCache instance.
+
+        Args:
+            db_path (Union[str, None]): Path of the SQLite file for the on-disk tier. If None, only the memory tier is used.
+            max_memory_entries (int): Maximum number of vectors held in memory. Defaults to 1024.
+            max_disk_entries (int): Maximum number of vectors held on disk. Defaults to 100,000.
+        """
+
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._pending_touches: Dict[str, float] = {}
+
+        self._connection: Union[sqlite3.Connection, None] = None
+        if db_path:
+            self._connection = sqlite3.connect(db_path, check_same_thread = False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS query_embeddings (
+                                            key TEXT PRIMARY KEY,
+                                            model TEXT NOT NULL,
+                                            vector BLOB NOT NULL,
+                                            last_used REAL NOT NULL
+                                            )""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (last_used)")
+            self._connection.commit()
+
+
+    @classmethod
+    def from_folder(cls, cache_folder: str = EMBEDDING_CACHE_FOLDER, cache_db: str = EMBEDDING_CACHE_DB, **kwargs)-> "EmbeddingCache":
+
+        """
+        Creates a cache whose on-disk tier lives in a folder next to the vectorizer folder.
+
+        Args:
+            cache_folder (str): The folder holding the SQLite file, relative to the project root.
+            cache_db (str): The name of the SQLite file.
+            **kwargs: Size limits forwarded to EmbeddingCache.
+
+        Returns:
+            EmbeddingCache: The cache.
+        """
+
+        cache_folderpath = os.path.join("..", cache_folder)
+        os.makedirs(cache_folderpath, exist_ok = True)
+        return cls(os.path.join(cache_folderpath, cache_db), **kwargs)
+
+
+    @staticmethod
+    def _make_key(query: str, model: str)-> str:
+
+        return hashlib.sha256(f"{model}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+    def _remember(self, key: str, vector: np.ndarray)-> None:
+
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last = False)
+
+
+    def get(self, query: str, model: str)-> Union[np.ndarray, None]:
+
+        """
+        Looks up the embedding of a query.
+
+        Args:
+            query (str): The user query.
+            model (str): The embedding model the vector must come from.
+
+        Returns:
+            Union[np.ndarray, None]: The float32 embedding, or None on a miss.
+        """
+
+        key = self._make_key(query, model)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return vector
+
+            if self._connection is not None:
+                row = self._connection.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._pending_touches[key] = time.time()
+                    vector = np.frombuffer(row[0], dtype = np.float32)
+                    self._remember(key, vector)
+                    self.counters["disk_hits"] += 1
+                    return vector
+
+            self.counters["misses"] += 1
+            return None
+
+
+    def _flush_touches(self)-> None:
+
+        """Writes the last_used times of the disk hits since the previous flush. The caller holds the lock and commits."""
+
+        if self._pending_touches:
+            self._connection.executemany("UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                                         [(last_used, key) for key, last_used in self._pending_touches.items()]
+                                         )
+            self._pending_touches.clear()
+
+
+    def put(self, query: str, model: str, vector: Union[List[float], np.ndarray])-> None:
+
+        """
+        Stores the embedding of a query in both tiers, evicting the least recently used entries if needed.
+
+        Args:
+            query (str): The user query.
+            model (str): The embedding model the vector comes from.
+            vector (Union[List[float], np.ndarray]): The embedding.
+        """
+
+        key = self._make_key(query, model)
+        vector = np.asarray(vector, dtype = np.float32)
+        with self._lock:
+            self._remember(key, vector)
+
+            if self._connection is not None:
+                self._flush_touches()
+                self._connection.execute("INSERT OR REPLACE INTO query_embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                                         (key, model, vector.tobytes(), time.time())
+                                         )
+                self._connection.execute("""DELETE FROM query_embeddings WHERE key IN (
+                                                SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                                                )""", (self.max_disk_entries,))
+                self._connection.commit()
+
+
+    def stats(self)-> Dict[str, Union[int, float]]:
+
+        """
+        Returns the hit/miss counters and the current size of each tier.
+
+        Returns:
+            Dict[str, Union[int, float]]: Counters, hit rate and entry counts.
+        """
+
+        with self._lock:
+            lookups = sum(self.counters.values())
+            disk_entries = 0
+            if self._connection is not None:
+                disk_entries = self._connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+            return {**self.counters,
+                    "hit_rate": (self.counters["memory_hits"] + self.counters["disk_hits"]) / lookups if lookups else 0.0,
+                    "memory_entries": len(self._memory),
+                    "disk_entries": disk_entries,
+                    }
+
+
+    def close(self)-> None:
+
+        """Writes the pending last_used times and closes the connection to the on-disk tier."""
+
+        with self._lock:
+            if self._connection is not None:
+                self._flush_touches()
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
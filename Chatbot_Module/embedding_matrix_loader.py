@@ -17,12 +17,16 @@ Enums:
 
 
 
+import asyncio
 from auxiliaries import Dict, Any, Union, List, Tuple, os
 import numpy as np
-from openai_kit import OpenAI
+from openai_kit import OpenAI, AsyncOpenAI
 import pickle
 from sklearn.feature_extraction.text import TfidfVectorizer
 from scipy.sparse import csr_matrix
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from tracing import tracer
 
 
 
@@ -52,11 +56,34 @@ def load_vectorizer(vectorizer_folder: str, vectorizer_pkl:str)-> TfidfVectorize
 
 
 
+def _get_cached_dense_vector(query: str,
+                             openai_model: str,
+                             embedding_cache: Union[EmbeddingCache, None]
+                             )-> Union[List[float], None]:
+
+    """Returns the cached dense vector of a query as a plain list (as the API returns it), or None on a miss."""
+
+    if embedding_cache is None:
+        return None
+
+    cached_vector = embedding_cache.get(query, openai_model)
+    return None if cached_vector is None else cached_vector.tolist()
+
+
+
+def _count_embedding_usage(embedding_response)-> None:
+
+    usage = getattr(embedding_response, "usage", None)
+    if usage is not None:
+        tracer.count("embedding_tokens", usage.total_tokens)
+
+
+
 def convert_string_query_to_vectors(query: str,
                                     openai_client: OpenAI,
                                     vectorizer: TfidfVectorizer,
                                     openai_model: str = "text-embedding-3-small",
-            
+                                    embedding_cache: Union[EmbeddingCache, None] = None,
                                     ) -> Dict[str, Union[np.ndarray, csr_matrix ]]:
     
     """
@@ -67,16 +94,75 @@ def convert_string_query_to_vectors(query: str,
         openai_client (OpenAI): An instance of the OpenAI client.
         vectorizer (TfidfVectorizer): The TF-IDF vectorizer to transform the query.
         openai_model (str): The model to use for generating the dense vector. Defaults to "text-embedding-3-small".
+        embedding_cache (Union[EmbeddingCache, None]): Optional cache consulted before calling the embeddings API.
 
     Returns:
         Dict[str, Union[np.ndarray, csr_matrix]]: A dictionary containing the dense and sparse vector representations.
     """
     
-    dense_vector: np.ndarray = openai_client.embeddings.create(input = [query],
-                                                               model = openai_model,
-                                                               ).data[0].embedding
+    dense_vector = _get_cached_dense_vector(query, openai_model, embedding_cache)
+    if dense_vector is None:
+        with tracer.span("embedding"):
+            embedding_response = openai_client.embeddings.create(input = [query],
+                                                                 model = openai_model,
+                                                                 )
+        _count_embedding_usage(embedding_response)
+        dense_vector: np.ndarray = embedding_response.data[0].embedding
+        if embedding_cache is not None:
+            embedding_cache.put(query, openai_model, dense_vector)
+
+    with tracer.span("tfidf"):
+        sparse_vector: csr_matrix = vectorizer.transform([query])
+
+    return {
+        "dense": dense_vector,
+        "sparse": sparse_vector
+        }
+
+
+async def convert_string_query_to_vectors_async(query: str,
+                                                openai_client: AsyncOpenAI,
+                                                vectorizer: TfidfVectorizer,
+                                                openai_model: str = "text-embedding-3-small",
+                                                embedding_cache: Union[EmbeddingCache, None] = None,
+                                                embedding_batcher: Union[EmbeddingBatcher, None] = None,
+                                                ) -> Dict[str, Union[np.ndarray, csr_matrix ]]:
+    
+    """
+    Converts a string query into dense and sparse vector representations without blocking the event loop.
 
-    sparse_vector: csr_matrix = vectorizer.transform([query])
+    Args:
+        query (str): The input query string to convert.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        vectorizer (TfidfVectorizer): The TF-IDF vectorizer to transform the query.
+        openai_model (str): The model to use for generating the dense vector. Defaults to "text-embedding-3-small".
+        embedding_cache (Union[EmbeddingCache, None]): Optional cache consulted before calling the embeddings API.
+        embedding_batcher (Union[EmbeddingBatcher, None]): Optional batcher sending the embeddings requests of
+            concurrent queries in one API call. It must use the same openai_model. Defaults to None (one call per query).
+
+    Returns:
+        Dict[str, Union[np.ndarray, csr_matrix]]: A dictionary containing the dense and sparse vector representations.
+    """
+    
+    dense_vector = await asyncio.to_thread(_get_cached_dense_vector, query, openai_model, embedding_cache) if embedding_cache is not None else None
+    if dense_vector is None and embedding_batcher is not None:
+        with tracer.span("embedding"):
+            dense_vector = await embedding_batcher.embed(query)
+        if embedding_cache is not None:
+            await asyncio.to_thread(embedding_cache.put, query, openai_model, dense_vector)
+
+    elif dense_vector is None:
+        with tracer.span("embedding"):
+            embedding_response = await openai_client.embeddings.create(input = [query],
+                                                                       model = openai_model,
+                                                                       )
+        _count_embedding_usage(embedding_response)
+        dense_vector: np.ndarray = embedding_response.data[0].embedding
+        if embedding_cache is not None:
+            await asyncio.to_thread(embedding_cache.put, query, openai_model, dense_vector)
+
+    with tracer.span("tfidf"):
+        sparse_vector: csr_matrix = vectorizer.transform([query])
 
     return {
         "dense": dense_vector,
@@ -89,6 +175,8 @@ def sparse_matrix_to_dict(sparse_matrix: csr_matrix)-> Dict[str, List]:
     """
     Converts a sparse matrix into a dictionary containing indices and values.
 
+    The column indices and values are read straight from the CSR arrays, which are already in row-major order.
+
     Args:
         sparse_matrix (csr_matrix): The sparse matrix to convert.
 
@@ -96,17 +184,18 @@ def sparse_matrix_to_dict(sparse_matrix: csr_matrix)-> Dict[str, List]:
         Dict[str, List]: A dictionary with 'indices' and 'values' extracted from the sparse matrix.
     """
     
-    coo = sparse_matrix.tocoo()  # Convert sparse matrix to COO format (Coordinate list)
-    indices = np.vstack((coo.row, coo.col)).T  # Stack row and column indices
-    values = coo.data.tolist()  # Extract the non-zero values
-
-    flat_indices = indices[:, 1].astype(int).tolist()
     return {
-        "indices": flat_indices,  # Convert to list for compatibility
-        "values": values
+        "indices": sparse_matrix.indices.tolist(),
+        "values": sparse_matrix.data.tolist()
     }
 
 
+def _validate_alphas(alphas: np.ndarray)-> None:
+
+    if np.any((alphas < 0) | (alphas > 1)):
+        raise ValueError("Alpha must be between 0 and 1")
+
+
 def hybrid_scale(dense: np.ndarray,
                  sparse_matrix: csr_matrix,
                  alpha: float
@@ -127,17 +216,80 @@ def hybrid_scale(dense: np.ndarray,
         ValueError: If alpha is not between 0 and 1.
     """
 
-   if alpha < 0 or alpha > 1:
-      raise ValueError("Alpha must be between 0 and 1")
+   _validate_alphas(np.asarray(alpha))
 
-   sparse = sparse_matrix_to_dict(sparse_matrix)
-   
    hsparse = {
-      "indices" : sparse["indices"],
-      "values": [v * (1 - alpha) for v in sparse["values"]]
+      "indices" : sparse_matrix.indices.tolist(),
+      "values": (sparse_matrix.data * (1 - alpha)).tolist()
       }
 
-   hdense = [v * alpha for v in dense]
+   hdense = (np.asarray(dense, dtype = np.float64) * alpha).tolist()
 
    return hdense, hsparse
 
+
+def hybrid_scale_batch(dense: np.ndarray,
+                       sparse_matrix: csr_matrix,
+                       alphas: Union[List[float], np.ndarray]
+                       )-> Tuple[np.ndarray, np.ndarray]:
+
+    """
+    Scales a batch of queries for several alpha values at once.
+
+    The sparse side is scaled on the CSR data array only: every alpha shares the indices and indptr of
+    sparse_matrix, so no index array is copied.
+
+    Args:
+        dense (np.ndarray): The m x d dense query vectors (or a single d-dimensional vector).
+        sparse_matrix (csr_matrix): The m x V sparse query vectors, one row per dense vector.
+        alphas (Union[List[float], np.ndarray]): The a alpha values, each between 0 and 1.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The a x m x d scaled dense vectors and the a x nnz scaled sparse values
+        (aligned with sparse_matrix.indices).
+
+    Raises:
+        ValueError: If an alpha is not between 0 and 1, or if dense and sparse_matrix have different numbers of rows.
+    """
+
+    alphas = np.asarray(alphas, dtype = np.float64).reshape(-1)
+    _validate_alphas(alphas)
+
+    dense = np.atleast_2d(np.asarray(dense, dtype = np.float64))
+    if dense.shape[0] != sparse_matrix.shape[0]:
+        raise ValueError(f"Got {dense.shape[0]} dense vectors but {sparse_matrix.shape[0]} sparse vectors")
+
+    scaled_dense = alphas[:, np.newaxis, np.newaxis] * dense[np.newaxis, :, :]
+    scaled_sparse_values = (1 - alphas)[:, np.newaxis] * sparse_matrix.data[np.newaxis, :]
+
+    return scaled_dense, scaled_sparse_values
+
+
+def hybrid_batch_to_pinecone(scaled_dense: np.ndarray,
+                             scaled_sparse_values: np.ndarray,
+                             sparse_matrix: csr_matrix
+                             )-> List[List[Tuple[List[float], Dict[str, List]]]]:
+
+    """
+    Serializes the output of hybrid_scale_batch into the (vector, sparse_vector) arguments of a Pinecone query.
+
+    The index list of each query row is built once and shared by every alpha value.
+
+    Args:
+        scaled_dense (np.ndarray): The a x m x d scaled dense vectors.
+        scaled_sparse_values (np.ndarray): The a x nnz scaled sparse values.
+        sparse_matrix (csr_matrix): The m x V sparse query vectors passed to hybrid_scale_batch.
+
+    Returns:
+        List[List[Tuple[List[float], Dict[str, List]]]]: For each alpha, for each query, the pair (hdense, hsparse)
+        as returned by hybrid_scale.
+    """
+
+    row_bounds = list(zip(sparse_matrix.indptr[:-1].tolist(), sparse_matrix.indptr[1:].tolist()))
+    row_indices = [sparse_matrix.indices[start:end].tolist() for start, end in row_bounds]
+
+    return [
+        [(alpha_dense[row].tolist(), {"indices": row_indices[row], "values": alpha_sparse_values[start:end].tolist()})
+         for row, (start, end) in enumerate(row_bounds)]
+        for alpha_dense, alpha_sparse_values in zip(scaled_dense, scaled_sparse_values)
+        ]
@@ -0,0 +1,354 @@
+
+"""
+load_benchmark.py
+
+This module replays synthetic Telegram updates against the webhook bot (telegram_bot.py) to measure it end to end under load. OpenAI, Pinecone and the Telegram Bot API are replaced by local stand-ins, so a run costs nothing and repeats on a laptop:
+1. The OpenAI (local_openai_server) and Pinecone (local_pinecone_server) stand-ins are started, and the Pinecone one is loaded with the BABOK chunks.
+2. A Telegram stand-in receives the sendMessage calls of the bot and timestamps each reply.
+3. The webhook app is served with its worker pool, built from the same settings as in production.
+4. Updates built from SampleQueries and their paraphrases are posted at the configured rate, with at most `concurrency` messages waiting for their reply.
+
+The report holds the p50/p95/p99 reply latency (webhook post to sendMessage), the throughput, the error rate (timeouts, shed updates, webhook errors) and the model calls per message, and is written to a JSON file so that regressions show up between releases.
+
+Usage:
+    Run from the Chatbot_Module folder:
+        python load_benchmark.py --messages 500 --rate 20 --concurrency 32 --output load_benchmark.json
+
+    The bot settings (ANSWERING_STRATEGY, WEBHOOK_WORKERS, ...) are read from the environment as usual. The
+    embedding, completion and semantic answer caches are off unless EMBEDDING_CACHE / COMPLETION_CACHE /
+    ANSWER_CACHE are set, so that consecutive runs stay comparable and the paraphrased queries are really answered.
+
+Main Classes:
+- TelegramStandIn: Receives the bot's sendMessage calls and hands each reply to the message waiting for it.
+
+Main Functions:
+- load_query_corpus: SampleQueries, their paraphrases and the lines of an optional paraphrase file.
+- build_update: A Telegram Update payload carrying a text message.
+- run_load_benchmark: Starts the stand-ins and the webhook, replays the updates and writes the report.
+"""
+
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+
+from auxiliaries import List, Dict, Any, Union, os
+from local_openai_server import OpenAIStandIn, StandInSettings, start_stand_in_server
+from local_pinecone_server import PineconeStandIn, PineconeStandInSettings
+from test_queries import SampleQueries
+
+
+
+OPENAI_PORT = 8100
+PINECONE_PORT = 8200
+TELEGRAM_PORT = 8300
+WEBHOOK_PORT = 8443
+
+STAND_IN_TOKEN = "stand-in"
+
+# Rewordings applied to every sample query, as students ask the same question in different ways
+PARAPHRASE_TEMPLATES = (
+    "{query}",
+    "Can you help me with this question? {query}",
+    "{query} Please explain your answer.",
+    "I am studying for the exam. {query}",
+    "{lowered}",
+    "Quick question: {query}",
+)
+
+
+
+def load_query_corpus(paraphrases_path: Union[str, None] = None)-> List[str]:
+
+    """
+    Builds the queries replayed by the benchmark.
+
+    Args:
+        paraphrases_path (Union[str, None]): Optional text file of further paraphrases, one per line.
+
+    Returns:
+        List[str]: Each distinct SampleQueries query under every PARAPHRASE_TEMPLATES rewording, then the file's lines.
+    """
+
+    queries = [template.format(query = sample.value, lowered = sample.value.lower())
+               for sample in SampleQueries
+               for template in PARAPHRASE_TEMPLATES
+               ]
+
+    if paraphrases_path:
+        with open(paraphrases_path, "r", encoding = "utf-8") as f:
+            queries += [line.strip() for line in f if line.strip()]
+
+    return queries
+
+
+def build_update(update_id: int, chat_id: int, text: str)-> Dict[str, Any]:
+
+    """
+    Builds a Telegram Update carrying a private text message.
+
+    Args:
+        update_id (int): The update id.
+        chat_id (int): The chat (and user) id; each replayed message uses its own chat so replies can be matched.
+        text (str): The message text.
+
+    Returns:
+        Dict[str, Any]: The Update payload, as Telegram posts it to the webhook.
+    """
+
+    return {"update_id": update_id,
+            "message": {"message_id": update_id,
+                        "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+                        "text": text
+                        }
+            }
+
+
+
+class TelegramStandIn:
+
+    """
+    A Telegram Bot API stand-in recording the bot's replies.
+
+    The server runs in its own thread, so each reply is handed to the load generator's event loop with
+    call_soon_threadsafe, together with the time it arrived.
+    """
+
+    def __init__(self, token: str = STAND_IN_TOKEN):
+
+        self.token = token
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self.counters: Dict[str, int] = {"replies": 0, "unexpected_replies": 0}
+
+
+    def expect_reply(self, chat_id: int)-> asyncio.Future:
+
+        """
+        Returns a future resolved with (arrival time, text) when the bot replies to a chat.
+
+        Must be called from the load generator's event loop, before the update is posted.
+        """
+
+        self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        self._waiting[chat_id] = future
+        return future
+
+
+    def _resolve(self, chat_id: int, arrival: float, text: str)-> None:
+
+        future = self._waiting.pop(chat_id, None)
+        if future is None or future.done():
+            self.counters["unexpected_replies"] += 1
+            return
+        future.set_result((arrival, text))
+
+
+    def create_app(self)-> FastAPI:
+
+        app = FastAPI(title = "Telegram stand-in")
+
+        @app.post(f"/bot{self.token}/sendMessage")
+        async def send_message(request: Request):
+            arrival = time.perf_counter()
+            body = await request.json()
+            self.counters["replies"] += 1
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._resolve, body["chat_id"], arrival, body.get("text", ""))
+            return {"ok": True, "result": {"message_id": 1, "chat": {"id": body["chat_id"], "type": "private"}, "text": body.get("text", "")}}
+
+        return app
+
+
+
+async def _replay(updates: List[Dict[str, Any]],
+                  webhook_url: str,
+                  telegram: TelegramStandIn,
+                  rate: float,
+                  concurrency: int,
+                  timeout: float,
+                  busy_message: str
+                  )-> Dict[str, Any]:
+
+    """Posts the updates at `rate` per second (0 for no pacing), with at most `concurrency` awaiting their reply."""
+
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {"answered": 0, "shed": 0, "timeout": 0, "webhook_error": 0}
+
+    async def send(http_client: httpx.AsyncClient, update: Dict[str, Any], delay: float)-> None:
+        await asyncio.sleep(delay)
+        async with slots:
+            reply = telegram.expect_reply(update["message"]["chat"]["id"])
+            start = time.perf_counter()
+            try:
+                response = await http_client.post(webhook_url, json = update)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                outcomes["webhook_error"] += 1
+                reply.cancel()
+                return
+
+            try:
+                arrival, text = await asyncio.wait_for(reply, timeout)
+            except asyncio.TimeoutError:
+                outcomes["timeout"] += 1
+                return
+
+            if text == busy_message:
+                outcomes["shed"] += 1
+            else:
+                outcomes["answered"] += 1
+                latencies.append(arrival - start)
+
+    async with httpx.AsyncClient(timeout = httpx.Timeout(timeout), limits = httpx.Limits(max_connections = concurrency)) as http_client:
+        start = time.perf_counter()
+        await asyncio.gather(*[send(http_client, update, idx / rate if rate > 0 else 0.0) for idx, update in enumerate(updates)])
+        wall_time = time.perf_counter() - start
+
+    return {"latencies": latencies, "outcomes": outcomes, "wall_time": wall_time}
+
+
+
+def run_load_benchmark(messages: int = 200,
+                       rate: float = 10.0,
+                       concurrency: int = 32,
+                       timeout: float = 60.0,
+                       paraphrases_path: Union[str, None] = None,
+                       openai_settings: Union[StandInSettings, None] = None,
+                       pinecone_settings: Union[PineconeStandInSettings, None] = None,
+                       output_path: Union[str, None] = "load_benchmark.json"
+                       )-> Dict[str, Any]:
+
+    """
+    Replays synthetic Telegram updates against the webhook bot, with every external service replaced by a stand-in.
+
+    Args:
+        messages (int): Number of updates posted, cycling through the query corpus. Defaults to 200.
+        rate (float): Updates posted per second; 0 posts as fast as the concurrency allows. Defaults to 10.
+        concurrency (int): Largest number of messages waiting for their reply. Defaults to 32.
+        timeout (float): Seconds after which a message without reply counts as an error. Defaults to 60.
+        paraphrases_path (Union[str, None]): Optional text file of further paraphrases, one per line.
+        openai_settings (Union[StandInSettings, None]): Latency and error settings of the OpenAI stand-in.
+        pinecone_settings (Union[PineconeStandInSettings, None]): Latency settings of the Pinecone stand-in.
+        output_path (Union[str, None]): JSON file receiving the report. Defaults to "load_benchmark.json".
+
+    Returns:
+        Dict[str, Any]: The report.
+    """
+
+    # The chatbot modules create their clients at import time, so the environment must point at the
+    # stand-ins before they are imported below
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{OPENAI_PORT}/v1"
+    os.environ["PINECONE_CONTROLLER_HOST"] = f"http://127.0.0.1:{PINECONE_PORT}"
+    os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{TELEGRAM_PORT}"
+    os.environ["TELEGRAM_TOKEN"] = STAND_IN_TOKEN
+    os.environ.setdefault("OPENAI_API_KEY", STAND_IN_TOKEN)
+    os.environ.setdefault("PINECONE_KEY", STAND_IN_TOKEN)
+    os.environ.setdefault("INDEX_NAME", "babok")
+    os.environ.setdefault("EMBEDDING_CACHE", "false")
+    os.environ.setdefault("COMPLETION_CACHE", "false")
+    os.environ.setdefault("ANSWER_CACHE", "false")
+
+    openai_stand_in = OpenAIStandIn(openai_settings)
+    pinecone_stand_in = PineconeStandIn(pinecone_settings)
+    telegram_stand_in = TelegramStandIn()
+    servers = [start_stand_in_server(openai_stand_in.create_app(), OPENAI_PORT),
+               start_stand_in_server(pinecone_stand_in.create_app(), PINECONE_PORT),
+               start_stand_in_server(telegram_stand_in.create_app(), TELEGRAM_PORT)
+               ]
+
+    try:
+        from pinecone_kit import pinecone_connection, index_name, ServerlessSpec
+        from embedding_matrix_loader import load_vectorizer, VECTORIZER_FOLDER, VECTORIZER_PKL
+        from benchmarks import stand_in_babok_records, batch_records_under_limit, summarize_timings, _print_report
+
+        records: List[Dict] = stand_in_babok_records(load_vectorizer(VECTORIZER_FOLDER, VECTORIZER_PKL))
+        pinecone_connection.create_index(name = index_name, dimension = len(records[0]["values"]), metric = "dotproduct",
+                                         spec = ServerlessSpec(cloud = "aws", region = "us-east-1")
+                                         )
+        index_client = pinecone_connection.Index(index_name)
+        for batch in batch_records_under_limit(records):
+            index_client.upsert(vectors = batch, namespace = "sisikepo")
+
+        import telegram_bot
+        servers.append(start_stand_in_server(telegram_bot.app, WEBHOOK_PORT, timeout = 120.0))
+
+        corpus: List[str] = load_query_corpus(paraphrases_path)
+        updates = [build_update(idx + 1, 100_000 + idx, corpus[idx % len(corpus)]) for idx in range(messages)]
+        model_calls_before = dict(openai_stand_in.counters), dict(pinecone_stand_in.counters)
+
+        result = asyncio.run(_replay(updates, f"http://127.0.0.1:{WEBHOOK_PORT}/webhook", telegram_stand_in,
+                                     rate, concurrency, timeout, telegram_bot.BUSY_MESSAGE
+                                     ))
+        worker_pool = telegram_bot.app.state.worker_pool
+        pool_metrics, component_counters = worker_pool.metrics(), worker_pool.runtime.component_counters()
+    finally:
+        for server in servers:
+            server.should_exit = True
+
+    openai_before, pinecone_before = model_calls_before
+    calls = lambda counters, before, key: (counters[key] - before[key]) / messages
+    outcomes = result["outcomes"]
+    errors = outcomes["shed"] + outcomes["timeout"] + outcomes["webhook_error"]
+
+    report = {"settings": {"messages": messages, "rate": rate, "concurrency": concurrency, "timeout": timeout, "corpus_size": len(corpus)},
+              "reply_latency": summarize_timings(result["latencies"]) if result["latencies"] else {},
+              "throughput_messages_per_second": outcomes["answered"] / result["wall_time"],
+              "error_rate": errors / messages,
+              "outcomes": outcomes,
+              "model_calls_per_message": {"chat_completions": calls(openai_stand_in.counters, openai_before, "chat_completions")
+                                                              + calls(openai_stand_in.counters, openai_before, "chat_streams"),
+                                          "embedding_requests": calls(openai_stand_in.counters, openai_before, "embeddings"),
+                                          "pinecone_queries": calls(pinecone_stand_in.counters, pinecone_before, "queries")
+                                          },
+              "webhook": pool_metrics,
+              "components": component_counters
+              }
+
+    if report["reply_latency"]:
+        _print_report(f"Load benchmark ({messages} messages, {rate:g}/s, concurrency {concurrency})", {"reply": report["reply_latency"]})
+        print(f"  p99={report['reply_latency']['p99_ms']:9.2f} ms")
+    print(f"  throughput={report['throughput_messages_per_second']:8.2f} messages/s  error rate={report['error_rate']:.3f}  {outcomes}")
+    print(f"  model calls per message: {report['model_calls_per_message']}")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 4)
+        print(f"Report written to {output_path}")
+
+    return report
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark of the webhook bot against local stand-ins")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=10.0, help="Updates posted per second (0: as fast as the concurrency allows)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Largest number of messages waiting for their reply")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--paraphrases", default=None, help="Text file of further paraphrases, one per line")
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=40.0)
+    parser.add_argument("--output", default="load_benchmark.json")
+    args = parser.parse_args()
+
+    run_load_benchmark(args.messages, args.rate, args.concurrency, args.timeout, args.paraphrases,
+                       StandInSettings(embedding_latency_ms = args.embedding_latency_ms,
+                                       chat_latency_ms = args.chat_latency_ms,
+                                       token_latency_ms = args.token_latency_ms,
+                                       error_rate = args.openai_error_rate
+                                       ),
+                       PineconeStandInSettings(query_latency_ms = args.pinecone_latency_ms),
+                       args.output
+                       )
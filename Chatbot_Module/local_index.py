@@ -0,0 +1,344 @@
+
+"""
+local_index.py
+
+This module provides an in-process replacement for the Pinecone index used by the chatbot. The BABOK corpus is only a few thousand 1536-d chunks, so the dense embeddings fit in memory as one contiguous float32 matrix and the TF-IDF vectors as a CSR matrix. Queries compute the same dotproduct hybrid score as Pinecone with matrix operations, without a network round-trip.
+
+Usage:
+    Build the index from the OpenAI batch output and the chapter reference objects, then pass it wherever a Pinecone index client is expected (e.g. get_pinecone_query_result or ChatbotRuntime):
+        local_index = LocalHybridIndex.from_batch_output(vectorizer)
+
+    The batch output folder (output_embeddings_step_3) is not part of the repository: it is written by Embedding_Retrieval_from_OpenAI/get_embeddings.py, the step before the upload to Pinecone.
+
+Main Classes:
+- LocalHybridIndex: Dense + sparse in-memory index whose query method mirrors Pinecone's Index.query.
+- LocalQueryResponse: Query result exposing to_dict(), in the shape parse_texts_from_pinecone expects.
+
+An IVFIndex (ann_index.py) can be attached with attach_dense_ann, so that queries only score the records in the
+clusters closest to the dense query instead of every record. Sparse-only queries (alpha = 0.0) are answered from a
+SparseInvertedIndex (sparse_index.py) over the TF-IDF vectors.
+"""
+
+
+import fnmatch
+import json
+
+from auxiliaries import List, Dict, Union, Any, os, np
+from embedding_matrix_loader import TfidfVectorizer
+from ann_index import IVFIndex
+from sparse_index import SparseInvertedIndex
+from scipy.sparse import csr_matrix
+
+
+
+EMBEDDINGS_FOLDER = "output_embeddings_step_3"
+BOOK_JSON_FOLDER = "book_in_json_step_1"
+REFERENCE_JSON_OBJECTS_FOLDER = "chapter_reference_objects_step_2"
+REQUEST_NUMBER_JSON = "request_number_to_chapter_map.json"
+CHAPTER_SECTIONS_JSON = "chapter_sections_to_text.json"
+
+
+def _read_json_file(filepath: str)-> Dict:
+
+    with open(filepath, "r") as file:
+        return json.load(file)
+
+
+def _clean_chapter_text(text: str)-> str:
+
+    """Cleans a chapter text the same way parse_complex_dataframe does before the text is uploaded to Pinecone."""
+
+    return ' '.join(part.strip().strip("'") for part in text.split("'") if part.strip())
+
+
+def sparse_dict_to_csr(sparse_vector: Union[Dict[str, List], None], vocabulary_size: int)-> csr_matrix:
+
+    """
+    Converts a Pinecone-style sparse vector into a 1 x vocabulary_size CSR matrix.
+
+    Args:
+        sparse_vector (Union[Dict[str, List], None]): A dictionary with 'indices' and 'values', or None.
+        vocabulary_size (int): The number of columns of the matrix.
+
+    Returns:
+        csr_matrix: The sparse vector as a single-row matrix (empty if sparse_vector is None).
+    """
+
+    if not sparse_vector or not sparse_vector["indices"]:
+        return csr_matrix((1, vocabulary_size), dtype = np.float32)
+
+    indices = np.asarray(sparse_vector["indices"], dtype = np.int32)
+    values = np.asarray(sparse_vector["values"], dtype = np.float32)
+    return csr_matrix((values, indices, np.array([0, len(indices)])), shape = (1, vocabulary_size))
+
+
+
+class LocalQueryResponse:
+
+    """
+    The result of a LocalHybridIndex query, mirroring the to_dict() method of Pinecone's QueryResponse.
+    """
+
+    def __init__(self, matches: List[Dict], namespace: str = ""):
+
+        self.matches = matches
+        self.namespace = namespace
+
+
+    def to_dict(self)-> Dict[str, Any]:
+
+        return {"matches": self.matches, "namespace": self.namespace}
+
+
+
+class LocalHybridIndex:
+
+    """
+    An in-memory hybrid (dense + sparse) index scored like a Pinecone dotproduct index.
+
+    The dense vectors are held in a contiguous n x d float32 matrix and the sparse TF-IDF vectors in an
+    n x V CSR matrix. The hybrid score of every record is dense_matrix @ dense_query + sparse_matrix @ sparse_query,
+    which equals Pinecone's dotproduct score for vectors scaled by hybrid_scale.
+    """
+
+    def __init__(self,
+                 ids: List[str],
+                 dense_matrix: np.ndarray,
+                 sparse_matrix: csr_matrix,
+                 metadata: List[Dict]
+                 ):
+
+        """
+        Initializes the LocalHybridIndex instance.
+
+        Args:
+            ids (List[str]): The id of each record.
+            dense_matrix (np.ndarray): The n x d dense embeddings.
+            sparse_matrix (csr_matrix): The n x V sparse TF-IDF vectors.
+            metadata (List[Dict]): The metadata of each record (chapter_names, chapter_texts, page_number).
+
+        Raises:
+            ValueError: If the number of ids, dense rows, sparse rows and metadata entries differ.
+        """
+
+        if not (len(ids) == dense_matrix.shape[0] == sparse_matrix.shape[0] == len(metadata)):
+            raise ValueError("ids, dense_matrix, sparse_matrix and metadata must describe the same number of records")
+
+        self.ids = list(ids)
+        self.dense_matrix = np.ascontiguousarray(dense_matrix, dtype = np.float32)
+        self.sparse_matrix = csr_matrix(sparse_matrix, dtype = np.float32)
+        self.metadata = metadata
+        self.dense_ann: Union[IVFIndex, None] = None
+        self.sparse_index = SparseInvertedIndex(self.sparse_matrix)
+
+
+    def attach_dense_ann(self, dense_ann: IVFIndex)-> None:
+
+        """
+        Restricts queries to the candidates found by an approximate nearest-neighbour index on the dense side.
+
+        The hybrid score is then computed exactly, but only for the records in the clusters probed for the dense
+        query. Queries with an all-zero dense vector (alpha = 0.0) still score every record, since only their
+        sparse half matters.
+
+        Args:
+            dense_ann (IVFIndex): An index holding this index's dense_matrix rows, in the same order.
+
+        Raises:
+            ValueError: If the ANN index does not hold one vector per record.
+        """
+
+        if len(dense_ann) != len(self):
+            raise ValueError(f"The ANN index holds {len(dense_ann)} vectors but the local index has {len(self)} records")
+
+        self.dense_ann = dense_ann
+
+
+    @classmethod
+    def from_batch_output(cls,
+                          vectorizer: TfidfVectorizer,
+                          embeddings_folder: str = EMBEDDINGS_FOLDER,
+                          reference_objects_folder: str = REFERENCE_JSON_OBJECTS_FOLDER,
+                          book_json_folder: str = BOOK_JSON_FOLDER
+                          )-> "LocalHybridIndex":
+
+        """
+        Builds the index from the OpenAI batch output JSONL files and the chapter reference objects.
+
+        This follows the same steps as the upload to Pinecone (Embedding_Upload_to_Pinecone/parse_jsonl.py),
+        so the local records carry the same texts, pages and sparse vectors as the Pinecone records. Their ids are
+        the batch custom_ids, whereas the upload gives each record a new uuid4.
+
+        Args:
+            vectorizer (TfidfVectorizer): The fitted TF-IDF vectorizer saved during the upload.
+            embeddings_folder (str): The folder of the batch output JSONL files, relative to the project root.
+            reference_objects_folder (str): The folder of the chapter reference JSON objects, relative to the project root.
+            book_json_folder (str): The folder containing the *_pages JSON file, relative to the project root.
+
+        Returns:
+            LocalHybridIndex: The index.
+
+        Raises:
+            FileNotFoundError: If the batch output folder is missing or holds no JSONL file.
+        """
+
+        embeddings_folderpath = os.path.join("..", embeddings_folder)
+        if not os.path.isdir(embeddings_folderpath) or not fnmatch.filter(os.listdir(embeddings_folderpath), "*.jsonl"):
+            raise FileNotFoundError(f"The local index needs the OpenAI batch output in {embeddings_folderpath}. Run "
+                                    f"Embedding_Retrieval_from_OpenAI/get_embeddings.py to produce it, or use VECTOR_BACKEND=pinecone."
+                                    )
+
+        reference_folderpath = os.path.join("..", reference_objects_folder)
+        request_number_to_chapter_map: Dict = _read_json_file(os.path.join(reference_folderpath, REQUEST_NUMBER_JSON))
+        chunks_to_text_map: Dict = _read_json_file(os.path.join(reference_folderpath, CHAPTER_SECTIONS_JSON))
+
+        book_json_folderpath = os.path.join("..", book_json_folder)
+        pages_json_files = fnmatch.filter(os.listdir(book_json_folderpath), "*_pages")
+        chunk_to_pages_map: Dict = _read_json_file(os.path.join(book_json_folderpath, pages_json_files[0])) if pages_json_files else {}
+
+        ids, embeddings, metadata = [], [], []
+        for jsonl_file in sorted(os.listdir(embeddings_folderpath)):
+            if not jsonl_file.endswith(".jsonl"):
+                print(f"File {jsonl_file} within folder {embeddings_folderpath} not a .jsonl file. Skipping file...")
+                continue
+
+            with open(os.path.join(embeddings_folderpath, jsonl_file), "r") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    request_number = record["custom_id"].split("request-")[-1]
+                    chunk_name = request_number_to_chapter_map[str(request_number)]
+
+                    ids.append(record["custom_id"])
+                    embeddings.append(record["response"]["body"]["data"][0]["embedding"])
+                    metadata.append({
+                        "chapter_names": chunk_name.rpartition("_")[0],
+                        "chapter_texts": _clean_chapter_text(chunks_to_text_map[chunk_name]),
+                        "page_number": chunk_to_pages_map.get(chunk_name.rpartition("_")[0], "No pages detected"),
+                        })
+
+        dense_matrix = np.asarray(embeddings, dtype = np.float32)
+        sparse_matrix: csr_matrix = vectorizer.transform([entry["chapter_texts"] for entry in metadata])
+
+        print(f"Local index built with {len(ids)} records")
+        return cls(ids, dense_matrix, sparse_matrix, metadata)
+
+
+    def __len__(self)-> int:
+
+        return len(self.ids)
+
+
+    @property
+    def vocabulary_size(self)-> int:
+
+        return self.sparse_matrix.shape[1]
+
+
+    def score(self, dense_queries: np.ndarray, sparse_queries: Union[csr_matrix, None] = None)-> np.ndarray:
+
+        """
+        Computes the hybrid dotproduct score of a batch of queries against every record.
+
+        Args:
+            dense_queries (np.ndarray): The m x d (already alpha-scaled) dense query vectors.
+            sparse_queries (Union[csr_matrix, None]): The m x V (already alpha-scaled) sparse query vectors, or None.
+
+        Returns:
+            np.ndarray: The m x n matrix of scores.
+        """
+
+        dense_queries = np.atleast_2d(np.asarray(dense_queries, dtype = np.float32))
+        scores: np.ndarray = dense_queries @ self.dense_matrix.T
+
+        if sparse_queries is not None and sparse_queries.nnz:
+            scores += (sparse_queries @ self.sparse_matrix.T).toarray()
+
+        return scores
+
+
+    def _build_match(self, record_index: int, score: float, include_metadata: bool, include_values: bool)-> Dict:
+
+        match = {"id": self.ids[record_index], "score": float(score)}
+        if include_metadata:
+            match["metadata"] = self.metadata[record_index]
+        if include_values:
+            row = self.sparse_matrix.getrow(record_index)
+            match["values"] = self.dense_matrix[record_index].tolist()
+            match["sparse_values"] = {"indices": row.indices.tolist(), "values": row.data.tolist()}
+        return match
+
+
+    def top_k(self, scores: np.ndarray, top_k: int)-> np.ndarray:
+
+        """
+        Returns the indices of the top_k highest scores of each row, best first.
+
+        Args:
+            scores (np.ndarray): The m x n matrix of scores.
+            top_k (int): The number of indices to return per row.
+
+        Returns:
+            np.ndarray: The m x min(top_k, n) matrix of record indices.
+        """
+
+        top_k = min(top_k, scores.shape[1])
+        if top_k == 0:
+            return np.empty((scores.shape[0], 0), dtype = np.int64)
+
+        candidates = np.argpartition(-scores, top_k - 1, axis = 1)[:, :top_k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis = 1)
+        order = np.argsort(-candidate_scores, axis = 1, kind = "stable")
+        return np.take_along_axis(candidates, order, axis = 1)
+
+
+    def query(self,
+              vector: List[float],
+              sparse_vector: Union[Dict[str, List], None] = None,
+              top_k: int = 3,
+              include_metadata: bool = False,
+              include_values: bool = False,
+              namespace: str = ""
+              )-> LocalQueryResponse:
+
+        """
+        Queries the index with the same arguments as Pinecone's Index.query.
+
+        Args:
+            vector (List[float]): The (alpha-scaled) dense query vector.
+            sparse_vector (Union[Dict[str, List], None]): The (alpha-scaled) sparse query vector. Defaults to None.
+            top_k (int): The number of matches to return. Defaults to 3.
+            include_metadata (bool): Whether to include the metadata of each match. Defaults to False.
+            include_values (bool): Whether to include the dense and sparse values of each match. Defaults to False.
+            namespace (str): Accepted for compatibility; the local index holds a single namespace.
+
+        Returns:
+            LocalQueryResponse: The matches, best first.
+        """
+
+        dense_query = np.asarray(vector, dtype = np.float32)
+        sparse_query = sparse_dict_to_csr(sparse_vector, self.vocabulary_size)
+
+        if not np.any(dense_query) and sparse_query.nnz:
+            # Sparse-only query: walk the postings of the query terms instead of scoring every record
+            best_indices, best_scores = self.sparse_index.search_csr(sparse_query, top_k)
+            if len(best_indices) == min(top_k, len(self)):
+                matches = [self._build_match(idx, score, include_metadata, include_values)
+                           for idx, score in zip(best_indices.tolist(), best_scores.tolist())]
+                return LocalQueryResponse(matches, namespace)
+
+        if self.dense_ann is not None and np.any(dense_query):
+            candidates: np.ndarray = self.dense_ann.candidates(dense_query)
+            scores: np.ndarray = dense_query @ self.dense_matrix[candidates].T
+            if sparse_query.nnz:
+                scores += (sparse_query @ self.sparse_matrix[candidates].T).toarray()[0]
+            best_indices = candidates[self.top_k(scores[np.newaxis, :], top_k)[0]]
+            record_scores = dict(zip(candidates.tolist(), scores.tolist()))
+        else:
+            scores: np.ndarray = self.score(dense_query, sparse_query)[0]
+            best_indices = self.top_k(scores[np.newaxis, :], top_k)[0]
+            record_scores = {idx: scores[idx] for idx in best_indices.tolist()}
+
+        matches = [self._build_match(idx, record_scores[idx], include_metadata, include_values) for idx in best_indices.tolist()]
+        return LocalQueryResponse(matches, namespace)
@@ -0,0 +1,479 @@
+
+"""
+local_openai_server.py
+
+This module serves a local stand-in for the subset of the OpenAI API used by the project, so that throughput and latency can be measured without spending money or hitting rate limits. It answers:
+- POST /v1/embeddings: deterministic vectors seeded by a hash of each input (1536-d by default), in float or base64 encoding.
+- POST /v1/chat/completions: a deterministic answer or the '' sentinel (or a JSON verdict with response_format json_object), streamed or not, with usage.
+- POST /v1/files, GET /v1/files/{id}, GET /v1/files/{id}/content: in-memory files for the embedding batch pipeline.
+- POST /v1/batches, GET /v1/batches/{id}: batch jobs over /v1/embeddings, completed after a configurable delay.
+- GET /stats: the number of calls per endpoint and of injected errors.
+
+Latency (fixed part, per-token part and jitter) and error injection (rate and HTTP status) are configurable.
+
+Usage:
+    python local_openai_server.py --port 8100 --chat-latency-ms 400 --token-latency-ms 15 --error-rate 0.01
+
+    Then point the OpenAI clients of Chatbot_Module, Text_Parsing and Embedding_Retrieval_from_OpenAI at it through their base URL:
+        OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python activate_telegram_bot.py
+
+    From Python (e.g. a benchmark): start_stand_in_server(OpenAIStandIn(StandInSettings()).create_app(), 8100)
+
+Main Classes:
+- StandInSettings: Latency, answer and error injection settings of the stand-in.
+- OpenAIStandIn: State (files, batches, counters) and FastAPI app of the stand-in.
+
+Main Functions:
+- stand_in_embedding: The deterministic embedding of a text.
+- start_stand_in_server: Serves an ASGI app with uvicorn from a daemon thread and waits until it accepts requests.
+"""
+
+
+import argparse
+import asyncio
+import base64
+import email.parser
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from auxiliaries import List, Dict, Any, Union, np
+
+
+
+EMBEDDING_DIMENSIONS = 1536
+
+DEFAULT_PORT = 8100
+
+
+
+def _text_seed(text: str)-> int:
+
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size = 8).digest(), "little")
+
+
+def _count_tokens(text: str)-> int:
+
+    """Approximates the token count of a text (about 4 characters per token)."""
+
+    return max(1, len(text) // 4)
+
+
+def stand_in_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS)-> np.ndarray:
+
+    """
+    Returns the deterministic embedding of a text: a unit-norm Gaussian vector seeded by a hash of the text.
+
+    The same text always gets the same vector, in every process, so cache and batching behaviour match a real run.
+
+    Args:
+        text (str): The text to embed.
+        dimensions (int): The number of dimensions. Defaults to EMBEDDING_DIMENSIONS.
+
+    Returns:
+        np.ndarray: The float32 embedding.
+    """
+
+    vector = np.random.default_rng(_text_seed(text)).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+
+class StandInSettings:
+
+    """Latency, answer and error injection settings of the OpenAI stand-in."""
+
+    def __init__(self,
+                 embedding_latency_ms: float = 50.0,
+                 chat_latency_ms: float = 300.0,
+                 token_latency_ms: float = 10.0,
+                 jitter: float = 0.2,
+                 completion_tokens: int = 60,
+                 answer_rate: float = 0.5,
+                 error_rate: float = 0.0,
+                 error_status: int = 429,
+                 batch_latency_seconds: float = 1.0,
+                 seed: int = 0
+                 ):
+
+        """
+        Initializes the StandInSettings instance.
+
+        Args:
+            embedding_latency_ms (float): Latency of an embeddings request. Defaults to 50.
+            chat_latency_ms (float): Latency of a chat completion before its first token. Defaults to 300.
+            token_latency_ms (float): Generation time of each completion token. Defaults to 10.
+            jitter (float): Relative spread of every latency, e.g. 0.2 for +/-20%. Defaults to 0.2.
+            completion_tokens (int): Number of tokens of an answer. Defaults to 60.
+            answer_rate (float): Share of prompts answered; the others get the '' sentinel (or a not_found verdict).
+                The choice is a hash of the prompt, so a prompt is always answered or never. Defaults to 0.5.
+            error_rate (float): Share of requests failed with error_status. Defaults to 0.0.
+            error_status (int): HTTP status of the injected errors (429 rate limit, 500, 503, ...). Defaults to 429.
+            batch_latency_seconds (float): Time a batch job stays in progress. Defaults to 1.0.
+            seed (int): Seed of the jitter and error injection. Defaults to 0.
+        """
+
+        self.embedding_latency_ms = embedding_latency_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.jitter = jitter
+        self.completion_tokens = completion_tokens
+        self.answer_rate = answer_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.batch_latency_seconds = batch_latency_seconds
+        self.seed = seed
+
+
+
+class OpenAIStandIn:
+
+    """
+    In-memory state and FastAPI app of the OpenAI stand-in.
+
+    The responses follow the shapes of the OpenAI REST API closely enough for the openai SDK to parse them.
+    """
+
+    def __init__(self, settings: Union[StandInSettings, None] = None):
+
+        """
+        Initializes the OpenAIStandIn instance.
+
+        Args:
+            settings (Union[StandInSettings, None]): The latency and error settings. Defaults to StandInSettings().
+        """
+
+        self.settings = settings or StandInSettings()
+        self._random = random.Random(self.settings.seed)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.file_contents: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._batch_tasks: set = set()
+        self.counters: Dict[str, int] = {"embeddings": 0, "embedding_inputs": 0, "chat_completions": 0, "chat_streams": 0,
+                                         "files": 0, "batches": 0, "injected_errors": 0
+                                         }
+
+
+    def _latency(self, milliseconds: float)-> float:
+
+        spread = self.settings.jitter
+        return max(0.0, milliseconds / 1000 * self._random.uniform(1 - spread, 1 + spread))
+
+
+    def _injected_error(self)-> Union[JSONResponse, None]:
+
+        """Returns an OpenAI-shaped error response for a share error_rate of the requests, otherwise None."""
+
+        if self.settings.error_rate <= 0 or self._random.random() >= self.settings.error_rate:
+            return None
+
+        self.counters["injected_errors"] += 1
+        status = self.settings.error_status
+        error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+        return JSONResponse({"error": {"message": f"Injected {status} error", "type": error_type, "param": None, "code": error_type}},
+                            status_code = status
+                            )
+
+
+    def embed(self, texts: List[str], model: str, dimensions: int, encoding_format: str)-> Dict[str, Any]:
+
+        """
+        Builds an embeddings response for a list of texts.
+
+        Args:
+            texts (List[str]): The inputs.
+            model (str): The requested model, echoed back.
+            dimensions (int): The number of dimensions of each vector.
+            encoding_format (str): "float" or "base64" (the openai SDK asks for base64 when NumPy is installed).
+
+        Returns:
+            Dict[str, Any]: The response body.
+        """
+
+        data = []
+        for index, text in enumerate(texts):
+            vector = stand_in_embedding(text, dimensions)
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode() if encoding_format == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+
+        prompt_tokens = sum(_count_tokens(text) for text in texts)
+        return {"object": "list", "data": data, "model": model, "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}}
+
+
+    def complete(self, prompt: str, json_output: bool)-> str:
+
+        """
+        Returns the deterministic completion of a prompt.
+
+        Args:
+            prompt (str): The concatenated message contents.
+            json_output (bool): Whether a JSON verdict was requested.
+
+        Returns:
+            str: An answer built from the words of the prompt, or the not-found response.
+        """
+
+        seed = _text_seed(prompt)
+        answered = (seed % 10_000) / 10_000 < self.settings.answer_rate
+        if answered:
+            words = prompt.split() or ["answer"]
+            generator = random.Random(seed)
+            answer = " ".join(generator.choice(words) for _ in range(self.settings.completion_tokens))
+        else:
+            answer = ""
+
+        if json_output:
+            return json.dumps({"verdict": "answered" if answered else "not_found", "answer": answer})
+        return answer if answered else "''"
+
+
+    async def _stream_completion(self, completion_id: str, model: str, content: str, prompt_tokens: int, include_usage: bool):
+
+        def chunk(delta: Dict[str, Any], finish_reason: Union[str, None] = None, usage: Union[Dict, None] = None)-> str:
+            choices = [] if usage is not None else [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]
+            body = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": choices, "usage": usage
+                    }
+            return f"data: {json.dumps(body)}\n\n"
+
+        await asyncio.sleep(self._latency(self.settings.chat_latency_ms))
+        yield chunk({"role": "assistant", "content": ""})
+
+        tokens = content.split(" ")
+        for position, token in enumerate(tokens):
+            await asyncio.sleep(self._latency(self.settings.token_latency_ms))
+            yield chunk({"content": token if position == 0 else " " + token})
+
+        yield chunk({}, finish_reason = "stop")
+        if include_usage:
+            yield chunk({}, usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)})
+        yield "data: [DONE]\n\n"
+
+
+    def _run_batch(self, batch: Dict[str, Any])-> None:
+
+        """Embeds every request line of a batch input file and stores the output file."""
+
+        output_lines = []
+        for line in self.file_contents[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request_object = json.loads(line)
+            body = request_object.get("body", {})
+            texts = body.get("input", "")
+            texts = [texts] if isinstance(texts, str) else texts
+            output_lines.append({"id": f"batch_req_{uuid.uuid4().hex}",
+                                 "custom_id": request_object.get("custom_id"),
+                                 "response": {"status_code": 200,
+                                              "request_id": uuid.uuid4().hex,
+                                              "body": self.embed(texts, body.get("model", ""), body.get("dimensions", EMBEDDING_DIMENSIONS), "float")
+                                              },
+                                 "error": None
+                                 })
+
+        output_file = self._store_file(("\n".join(json.dumps(line) for line in output_lines) + "\n").encode("utf-8"),
+                                       f"{batch['id']}_output.jsonl",
+                                       "batch_output"
+                                       )
+        now = int(time.time())
+        batch.update({"status": "completed", "output_file_id": output_file["id"], "finalizing_at": now, "completed_at": now,
+                      "request_counts": {"total": len(output_lines), "completed": len(output_lines), "failed": 0}
+                      })
+
+
+    async def _complete_batch_later(self, batch: Dict[str, Any])-> None:
+
+        await asyncio.sleep(self.settings.batch_latency_seconds)
+        self._run_batch(batch)
+
+
+    def _store_file(self, content: bytes, filename: str, purpose: str)-> Dict[str, Any]:
+
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        file_object = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                       "filename": filename, "purpose": purpose, "status": "processed"
+                       }
+        self.files[file_id] = file_object
+        self.file_contents[file_id] = content
+        return file_object
+
+
+    def create_app(self)-> FastAPI:
+
+        """
+        Builds the FastAPI app serving the stand-in endpoints.
+
+        Returns:
+            FastAPI: The app, to run with uvicorn or start_stand_in_server.
+        """
+
+        app = FastAPI(title = "OpenAI stand-in")
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            body = await request.json()
+            self.counters["embeddings"] += 1
+            await asyncio.sleep(self._latency(self.settings.embedding_latency_ms))
+            error = self._injected_error()
+            if error is not None:
+                return error
+
+            texts = body["input"]
+            texts = [texts] if isinstance(texts, str) else texts
+            self.counters["embedding_inputs"] += len(texts)
+            return self.embed(texts, body.get("model", ""), body.get("dimensions", EMBEDDING_DIMENSIONS), body.get("encoding_format", "float"))
+
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            error = self._injected_error()
+            if error is not None:
+                await asyncio.sleep(self._latency(self.settings.chat_latency_ms))
+                return error
+
+            model = body.get("model", "")
+            prompt = "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+            json_output = (body.get("response_format") or {}).get("type") == "json_object"
+            content = self.complete(prompt, json_output)
+            prompt_tokens = _count_tokens(prompt)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+            if body.get("stream"):
+                self.counters["chat_streams"] += 1
+                include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                return StreamingResponse(self._stream_completion(completion_id, model, content, prompt_tokens, include_usage),
+                                         media_type = "text/event-stream"
+                                         )
+
+            self.counters["chat_completions"] += 1
+            completion_tokens = len(content.split(" "))
+            await asyncio.sleep(self._latency(self.settings.chat_latency_ms + completion_tokens * self.settings.token_latency_ms))
+            return {"id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "logprobs": None, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+                    }
+
+
+        @app.post("/v1/files")
+        async def create_file(request: Request):
+            # Parse the multipart form with the standard library, so the stand-in needs no form-parsing dependency
+            raw_body = await request.body()
+            form = email.parser.BytesParser().parsebytes(f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode() + raw_body)
+            fields = {part.get_param("name", header = "content-disposition"): part for part in form.get_payload()}
+            self.counters["files"] += 1
+            upload = fields["file"]
+            return self._store_file(upload.get_payload(decode = True),
+                                    upload.get_filename() or "upload.jsonl",
+                                    fields["purpose"].get_payload(decode = True).decode() if "purpose" in fields else "batch"
+                                    )
+
+
+        @app.get("/v1/files/{file_id}")
+        async def retrieve_file(file_id: str):
+            if file_id not in self.files:
+                return JSONResponse({"error": {"message": f"No such file: {file_id}", "type": "invalid_request_error"}}, status_code = 404)
+            return self.files[file_id]
+
+
+        @app.get("/v1/files/{file_id}/content")
+        async def file_content(file_id: str):
+            if file_id not in self.file_contents:
+                return JSONResponse({"error": {"message": f"No such file: {file_id}", "type": "invalid_request_error"}}, status_code = 404)
+            return Response(self.file_contents[file_id], media_type = "application/octet-stream")
+
+
+        @app.post("/v1/batches")
+        async def create_batch(request: Request):
+            body = await request.json()
+            error = self._injected_error()
+            if error is not None:
+                return error
+            if body.get("input_file_id") not in self.file_contents:
+                return JSONResponse({"error": {"message": "Unknown input_file_id", "type": "invalid_request_error"}}, status_code = 400)
+
+            self.counters["batches"] += 1
+            now = int(time.time())
+            batch = {"id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch", "endpoint": body.get("endpoint", "/v1/embeddings"),
+                     "errors": None, "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+                     "status": "in_progress", "output_file_id": None, "error_file_id": None, "created_at": now,
+                     "in_progress_at": now, "expires_at": now + 86400, "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                     "metadata": body.get("metadata")
+                     }
+            self.batches[batch["id"]] = batch
+            batch_task = asyncio.create_task(self._complete_batch_later(batch))
+            self._batch_tasks.add(batch_task)
+            batch_task.add_done_callback(self._batch_tasks.discard)
+            return batch
+
+
+        @app.get("/v1/batches/{batch_id}")
+        async def retrieve_batch(batch_id: str):
+            if batch_id not in self.batches:
+                return JSONResponse({"error": {"message": f"No such batch: {batch_id}", "type": "invalid_request_error"}}, status_code = 404)
+            return self.batches[batch_id]
+
+
+        @app.get("/stats")
+        async def stats():
+            return self.counters
+
+        return app
+
+
+
+def start_stand_in_server(app: FastAPI, port: int, host: str = "127.0.0.1", timeout: float = 10.0)-> uvicorn.Server:
+
+    """
+    Serves an ASGI app with uvicorn from a daemon thread, for benchmarks that run the stand-ins in-process.
+
+    Args:
+        app (FastAPI): The app to serve.
+        port (int): The port to listen on.
+        host (str): The interface to listen on. Defaults to "127.0.0.1".
+        timeout (float): Seconds to wait for the server to start. Defaults to 10.
+
+    Returns:
+        uvicorn.Server: The running server (set should_exit = True to stop it).
+    """
+
+    server = uvicorn.Server(uvicorn.Config(app, host = host, port = port, log_level = "warning"))
+    threading.Thread(target = server.run, daemon = True).start()
+
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Stand-in server did not start on {host}:{port}")
+        time.sleep(0.01)
+    return server
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0, help="Latency before the first completion token")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="Generation time of each completion token")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative spread of the latencies")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--answer-rate", type=float, default=0.5, help="Share of prompts answered instead of ''")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--batch-latency-seconds", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = StandInSettings(args.embedding_latency_ms, args.chat_latency_ms, args.token_latency_ms, args.jitter,
+                               args.completion_tokens, args.answer_rate, args.error_rate, args.error_status,
+                               args.batch_latency_seconds, args.seed
+                               )
+    uvicorn.run(OpenAIStandIn(settings).create_app(), host = args.host, port = args.port)
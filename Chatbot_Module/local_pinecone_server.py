@@ -0,0 +1,379 @@
+
+"""
+local_pinecone_server.py
+
+This module serves a local stand-in for the Pinecone endpoints used by the project, so that upload throughput and query latency can be measured without the live service. One server answers both planes:
+- Control plane: GET/POST /indexes, GET/DELETE /indexes/{name} (describe returns this server as the index host).
+- Data plane, under the index host /index/{name}: POST /vectors/upsert (namespaced, with sparseValues), POST /query (dotproduct hybrid score, includeValues, includeMetadata, query by id), GET /vectors/fetch, POST /vectors/delete and POST /describe_index_stats.
+- GET /stats: the number of requests per endpoint and of rejected requests.
+
+Requests larger than the 4 MB limit targeted by batch_pinecone_input_generator are rejected with a 400, as the live service rejects them. Latency per request (queries and writes separately, with jitter) is configurable. Metadata filters are not supported and are rejected rather than ignored.
+
+Usage:
+    python local_pinecone_server.py --port 8200 --query-latency-ms 40 --write-latency-ms 80
+
+    Then point the Pinecone clients (Chatbot_Module and Embedding_Upload_to_Pinecone) at it through the control plane host:
+        PINECONE_CONTROLLER_HOST=http://127.0.0.1:8200 python activate_telegram_bot.py
+
+    From Python (e.g. a benchmark), with start_stand_in_server from local_openai_server:
+        start_stand_in_server(PineconeStandIn(PineconeStandInSettings()).create_app(), 8200)
+
+Main Classes:
+- PineconeStandInSettings: Latency and request size settings of the stand-in.
+- PineconeStandIn: Indexes, namespaces, counters and FastAPI app of the stand-in.
+"""
+
+
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from auxiliaries import List, Dict, Any, Union, np
+from scipy.sparse import csr_matrix
+
+
+
+# Request size limit of the live service, which batch_pinecone_input_generator keeps its batches under
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+
+DEFAULT_PORT = 8200
+
+
+
+class PineconeStandInSettings:
+
+    """Latency and request size settings of the Pinecone stand-in."""
+
+    def __init__(self,
+                 query_latency_ms: float = 40.0,
+                 write_latency_ms: float = 80.0,
+                 control_latency_ms: float = 20.0,
+                 jitter: float = 0.2,
+                 max_request_bytes: int = MAX_REQUEST_BYTES,
+                 seed: int = 0
+                 ):
+
+        """
+        Initializes the PineconeStandInSettings instance.
+
+        Args:
+            query_latency_ms (float): Latency of a query or fetch. Defaults to 40.
+            write_latency_ms (float): Latency of an upsert or delete. Defaults to 80.
+            control_latency_ms (float): Latency of a control plane request. Defaults to 20.
+            jitter (float): Relative spread of every latency, e.g. 0.2 for +/-20%. Defaults to 0.2.
+            max_request_bytes (int): Largest request body accepted. Defaults to MAX_REQUEST_BYTES.
+            seed (int): Seed of the jitter. Defaults to 0.
+        """
+
+        self.query_latency_ms = query_latency_ms
+        self.write_latency_ms = write_latency_ms
+        self.control_latency_ms = control_latency_ms
+        self.jitter = jitter
+        self.max_request_bytes = max_request_bytes
+        self.seed = seed
+
+
+
+class _Namespace:
+
+    """The records of one namespace, with dense and sparse matrices rebuilt lazily after writes."""
+
+    def __init__(self):
+
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._matrices: Union[tuple, None] = None
+
+
+    def upsert(self, vectors: List[Dict[str, Any]])-> None:
+
+        for vector in vectors:
+            self.records[vector["id"]] = vector
+        self._matrices = None
+
+
+    def delete(self, ids: List[str])-> None:
+
+        for record_id in ids:
+            self.records.pop(record_id, None)
+        self._matrices = None
+
+
+    def matrices(self)-> tuple:
+
+        """Returns the record ids, the dense matrix and the sparse matrix (rows in the order of the ids)."""
+
+        if self._matrices is None:
+            ids = list(self.records)
+            dense = np.asarray([self.records[record_id]["values"] for record_id in ids], dtype = np.float32)
+
+            rows, columns, values = [], [], []
+            for row, record_id in enumerate(ids):
+                sparse_values = self.records[record_id].get("sparseValues") or {"indices": [], "values": []}
+                rows += [row] * len(sparse_values["indices"])
+                columns += sparse_values["indices"]
+                values += sparse_values["values"]
+            width = max(columns) + 1 if columns else 1
+            sparse = csr_matrix((np.asarray(values, dtype = np.float32), (rows, columns)), shape = (len(ids), width))
+
+            self._matrices = (ids, dense, sparse)
+        return self._matrices
+
+
+    def query(self, vector: List[float], sparse_vector: Union[Dict[str, List], None], top_k: int)-> List[tuple]:
+
+        """
+        Scores every record with the dotproduct hybrid score and returns the top_k.
+
+        Returns:
+            List[tuple]: (record id, score) pairs, best first.
+        """
+
+        ids, dense, sparse = self.matrices()
+        if not ids:
+            return []
+
+        scores = dense @ np.asarray(vector, dtype = np.float32)
+        if sparse_vector and sparse_vector.get("indices"):
+            query_sparse = np.zeros(sparse.shape[1], dtype = np.float32)
+            for index, value in zip(sparse_vector["indices"], sparse_vector["values"]):
+                if index < sparse.shape[1]:
+                    query_sparse[index] = value
+            scores = scores + sparse @ query_sparse
+
+        top_indices = np.argsort(-scores, kind = "stable")[:top_k]
+        return [(ids[idx], float(scores[idx])) for idx in top_indices]
+
+
+
+def _error(status: int, message: str)-> JSONResponse:
+
+    return JSONResponse({"code": 3 if status == 400 else 5, "message": message, "details": []}, status_code = status)
+
+
+
+class PineconeStandIn:
+
+    """
+    In-memory indexes and FastAPI app of the Pinecone stand-in.
+
+    Every index is served from the same server, so the host returned by describe_index is the server's
+    URL followed by /index/<name>, and the data plane routes carry that prefix.
+    """
+
+    def __init__(self, settings: Union[PineconeStandInSettings, None] = None):
+
+        """
+        Initializes the PineconeStandIn instance.
+
+        Args:
+            settings (Union[PineconeStandInSettings, None]): The latency and size settings. Defaults to PineconeStandInSettings().
+        """
+
+        self.settings = settings or PineconeStandInSettings()
+        self._random = random.Random(self.settings.seed)
+        self.indexes: Dict[str, Dict[str, Any]] = {}
+        self.namespaces: Dict[str, Dict[str, _Namespace]] = {}
+        self.counters: Dict[str, int] = {"control": 0, "upserts": 0, "upserted_vectors": 0, "upserted_bytes": 0, "queries": 0,
+                                         "fetches": 0, "deletes": 0, "rejected_too_large": 0
+                                         }
+
+
+    async def _sleep(self, milliseconds: float)-> None:
+
+        spread = self.settings.jitter
+        await asyncio.sleep(max(0.0, milliseconds / 1000 * self._random.uniform(1 - spread, 1 + spread)))
+
+
+    def _index_model(self, name: str, base_url: str)-> Dict[str, Any]:
+
+        return {**self.indexes[name], "host": f"{base_url.rstrip('/')}/index/{name}"}
+
+
+    def _namespace(self, index_name: str, namespace: Union[str, None])-> _Namespace:
+
+        index_namespaces = self.namespaces.setdefault(index_name, {})
+        return index_namespaces.setdefault(namespace or "", _Namespace())
+
+
+    def _record_response(self, record: Dict[str, Any], include_values: bool, include_metadata: bool)-> Dict[str, Any]:
+
+        response = {"id": record["id"]}
+        if include_values:
+            response["values"] = record["values"]
+            if record.get("sparseValues"):
+                response["sparseValues"] = record["sparseValues"]
+        if include_metadata and record.get("metadata") is not None:
+            response["metadata"] = record["metadata"]
+        return response
+
+
+    def create_app(self)-> FastAPI:
+
+        """
+        Builds the FastAPI app serving the control and data plane endpoints.
+
+        Returns:
+            FastAPI: The app, to run with uvicorn or start_stand_in_server.
+        """
+
+        app = FastAPI(title = "Pinecone stand-in")
+
+        @app.get("/indexes")
+        async def list_indexes(request: Request):
+            self.counters["control"] += 1
+            await self._sleep(self.settings.control_latency_ms)
+            return {"indexes": [self._index_model(name, str(request.base_url)) for name in self.indexes]}
+
+
+        @app.post("/indexes")
+        async def create_index(request: Request):
+            body = await request.json()
+            self.counters["control"] += 1
+            await self._sleep(self.settings.control_latency_ms)
+            if body["name"] in self.indexes:
+                return JSONResponse({"error": {"code": "ALREADY_EXISTS", "message": f"Resource {body['name']} already exists"}, "status": 409},
+                                    status_code = 409
+                                    )
+            self.indexes[body["name"]] = {"name": body["name"], "dimension": body["dimension"], "metric": body.get("metric", "cosine"),
+                                          "spec": body.get("spec", {"serverless": {"cloud": "aws", "region": "us-east-1"}}),
+                                          "status": {"ready": True, "state": "Ready"},
+                                          "deletion_protection": body.get("deletion_protection", "disabled")
+                                          }
+            return JSONResponse(self._index_model(body["name"], str(request.base_url)), status_code = 201)
+
+
+        @app.get("/indexes/{index_name}")
+        async def describe_index(index_name: str, request: Request):
+            self.counters["control"] += 1
+            await self._sleep(self.settings.control_latency_ms)
+            if index_name not in self.indexes:
+                return JSONResponse({"error": {"code": "NOT_FOUND", "message": f"Resource {index_name} not found"}, "status": 404}, status_code = 404)
+            return self._index_model(index_name, str(request.base_url))
+
+
+        @app.delete("/indexes/{index_name}")
+        async def delete_index(index_name: str):
+            self.counters["control"] += 1
+            await self._sleep(self.settings.control_latency_ms)
+            self.indexes.pop(index_name, None)
+            self.namespaces.pop(index_name, None)
+            return Response(status_code = 202)
+
+
+        @app.post("/index/{index_name}/vectors/upsert")
+        async def upsert(index_name: str, request: Request):
+            raw_body = await request.body()
+            if index_name not in self.indexes:
+                return _error(404, f"Index {index_name} not found")
+            await self._sleep(self.settings.write_latency_ms)
+            if len(raw_body) > self.settings.max_request_bytes:
+                self.counters["rejected_too_large"] += 1
+                return _error(400, f"Request size {len(raw_body)} exceeds the maximum supported size of {self.settings.max_request_bytes} bytes")
+
+            body = json.loads(raw_body)
+            dimension = self.indexes[index_name]["dimension"]
+            for vector in body["vectors"]:
+                if len(vector["values"]) != dimension:
+                    return _error(400, f"Vector dimension {len(vector['values'])} does not match the dimension of the index {dimension}")
+
+            self._namespace(index_name, body.get("namespace")).upsert(body["vectors"])
+            self.counters["upserts"] += 1
+            self.counters["upserted_vectors"] += len(body["vectors"])
+            self.counters["upserted_bytes"] += len(raw_body)
+            return {"upsertedCount": len(body["vectors"])}
+
+
+        @app.post("/index/{index_name}/query")
+        async def query(index_name: str, request: Request):
+            body = await request.json()
+            if index_name not in self.indexes:
+                return _error(404, f"Index {index_name} not found")
+            await self._sleep(self.settings.query_latency_ms)
+            if body.get("filter"):
+                return _error(400, "Metadata filters are not supported by the stand-in")
+
+            namespace = self._namespace(index_name, body.get("namespace"))
+            vector = body.get("vector")
+            if vector is None and body.get("id") in namespace.records:
+                vector = namespace.records[body["id"]]["values"]
+            if vector is None:
+                return _error(400, "Query requires a vector or the id of an existing vector")
+
+            self.counters["queries"] += 1
+            matches = []
+            for record_id, score in namespace.query(vector, body.get("sparseVector"), body.get("topK", 10)):
+                matches.append({**self._record_response(namespace.records[record_id], body.get("includeValues", False), body.get("includeMetadata", False)),
+                                "score": score
+                                })
+            return {"matches": matches, "namespace": body.get("namespace", ""), "usage": {"readUnits": 5}}
+
+
+        @app.get("/index/{index_name}/vectors/fetch")
+        async def fetch(index_name: str, request: Request):
+            if index_name not in self.indexes:
+                return _error(404, f"Index {index_name} not found")
+            await self._sleep(self.settings.query_latency_ms)
+            namespace_name = request.query_params.get("namespace", "")
+            namespace = self._namespace(index_name, namespace_name)
+            self.counters["fetches"] += 1
+            vectors = {record_id: self._record_response(namespace.records[record_id], True, True)
+                       for record_id in request.query_params.getlist("ids") if record_id in namespace.records
+                       }
+            return {"vectors": vectors, "namespace": namespace_name, "usage": {"readUnits": 1}}
+
+
+        @app.post("/index/{index_name}/vectors/delete")
+        async def delete(index_name: str, request: Request):
+            body = await request.json()
+            if index_name not in self.indexes:
+                return _error(404, f"Index {index_name} not found")
+            await self._sleep(self.settings.write_latency_ms)
+            if body.get("filter"):
+                return _error(400, "Metadata filters are not supported by the stand-in")
+
+            namespace = self._namespace(index_name, body.get("namespace"))
+            self.counters["deletes"] += 1
+            namespace.delete(list(namespace.records) if body.get("deleteAll") else body.get("ids", []))
+            return {}
+
+
+        @app.post("/index/{index_name}/describe_index_stats")
+        async def describe_index_stats(index_name: str):
+            if index_name not in self.indexes:
+                return _error(404, f"Index {index_name} not found")
+            index_namespaces = self.namespaces.get(index_name, {})
+            vector_counts = {name: {"vectorCount": len(namespace.records)} for name, namespace in index_namespaces.items()}
+            return {"namespaces": vector_counts, "dimension": self.indexes[index_name]["dimension"], "indexFullness": 0.0,
+                    "totalVectorCount": sum(counts["vectorCount"] for counts in vector_counts.values())
+                    }
+
+
+        @app.get("/stats")
+        async def stats():
+            return self.counters
+
+        return app
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Pinecone API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--query-latency-ms", type=float, default=40.0)
+    parser.add_argument("--write-latency-ms", type=float, default=80.0)
+    parser.add_argument("--control-latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative spread of the latencies")
+    parser.add_argument("--max-request-bytes", type=int, default=MAX_REQUEST_BYTES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = PineconeStandInSettings(args.query_latency_ms, args.write_latency_ms, args.control_latency_ms, args.jitter,
+                                       args.max_request_bytes, args.seed
+                                       )
+    uvicorn.run(PineconeStandIn(settings).create_app(), host = args.host, port = args.port)
@@ -9,6 +9,8 @@ Usage:
 Main Functions:
 - get_embedding: Takes a text input and retrieves its embedding from OpenAI's API.
 - get_chatgpt_response: Sends a user instruction to the ChatGPT model and returns the model's response.
+- get_embedding_async / get_chatgpt_response_async: Non-blocking counterparts built on AsyncOpenAI, for use inside the bot's event loop.
+- stream_chatgpt_response / stream_chatgpt_response_async: Stream the ChatGPT response as text deltas, as they are generated.
   
 Enums:
 - PromptTemplate: Defines various prompt templates used in the interaction with the chatbot, aiding in the structuring of queries and responses.
@@ -16,14 +18,20 @@ Enums:
 
 
 from openai import OpenAI
-from openai import OpenAI, APIConnectionError, RateLimitError
-from auxiliaries import np
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, RateLimitError
+from auxiliaries import Dict, Any, Iterator, AsyncIterator, np
 from auxiliaries import load_dotenv
 from enum import Enum
+import time
+from tracing import tracer
 
 
 load_dotenv()
 openai_client = OpenAI()
+async_openai_client = AsyncOpenAI()
+
+CHATGPT_MODEL = "gpt-4o-mini"
+CHATGPT_TEMPERATURE = 0.0
 
 
 def get_embedding(text: str, openai_client: OpenAI, model: str ="text-embedding-3-small")-> np.ndarray:
@@ -44,7 +52,30 @@ def get_embedding(text: str, openai_client: OpenAI, model: str ="text-embedding-
     return openai_client.embeddings.create(input = [text], model=model).data[0].embedding
 
 
-def get_chatgpt_response(instruction: str, openai_client: OpenAI, temperature: float = 0.0)-> str:
+def _response_format(json_output: bool)-> Dict[str, Any]:
+
+    """Returns the extra completion arguments that make the model answer with a JSON object."""
+
+    return {"response_format": {"type": "json_object"}} if json_output else {}
+
+
+def _stream_options()-> Dict[str, Any]:
+
+    """Asks for the token usage at the end of a stream when tracing is enabled, so it can be counted."""
+
+    return {"stream_options": {"include_usage": True}} if tracer.enabled else {}
+
+
+def _count_usage(usage)-> None:
+
+    """Adds the token counts of a completion to the tracer."""
+
+    if usage is not None:
+        tracer.count("gpt_prompt_tokens", usage.prompt_tokens)
+        tracer.count("gpt_completion_tokens", usage.completion_tokens)
+
+
+def get_chatgpt_response(instruction: str, openai_client: OpenAI, temperature: float = CHATGPT_TEMPERATURE, json_output: bool = False)-> str:
     
     """
     Sends an instruction to the ChatGPT model and retrieves the response.
@@ -53,20 +84,158 @@ def get_chatgpt_response(instruction: str, openai_client: OpenAI, temperature: f
         instruction (str): The instruction or question to send to ChatGPT.
         openai_client (OpenAI): An instance of the OpenAI client.
         temperature (float): Controls the randomness of the output. Lower values make the output more focused and deterministic. Defaults to 0.0.
+        json_output (bool): Whether to constrain the response to a JSON object. Defaults to False.
+
+    Returns:
+        str: The response generated by the ChatGPT model.
+    """
+    
+    with tracer.span("gpt_completion"):
+        response = openai_client.chat.completions.create(
+        model=CHATGPT_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": instruction},
+            ],
+        temperature = temperature,
+        **_response_format(json_output)
+        )
+    _count_usage(getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+
+async def get_embedding_async(text: str, openai_client: AsyncOpenAI, model: str ="text-embedding-3-small")-> np.ndarray:
+    
+    """
+    Retrieves the embedding for a given text input without blocking the event loop.
+
+    Args:
+        text (str): The input text to embed.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        model (str): The model to use for embedding. Defaults to "text-embedding-3-small".
+
+    Returns:
+        np.ndarray: The embedding vector for the input text.
+    """
+    
+    text = text.replace("\n", " ")
+    response = await openai_client.embeddings.create(input = [text], model=model)
+    return response.data[0].embedding
+
+
+async def get_chatgpt_response_async(instruction: str, openai_client: AsyncOpenAI, temperature: float = CHATGPT_TEMPERATURE, json_output: bool = False)-> str:
+    
+    """
+    Sends an instruction to the ChatGPT model and retrieves the response without blocking the event loop.
+
+    Args:
+        instruction (str): The instruction or question to send to ChatGPT.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        temperature (float): Controls the randomness of the output. Defaults to 0.0.
+        json_output (bool): Whether to constrain the response to a JSON object. Defaults to False.
 
     Returns:
         str: The response generated by the ChatGPT model.
     """
     
-    response = openai_client.chat.completions.create(
-    model="gpt-4o-mini",
+    with tracer.span("gpt_completion"):
+        response = await openai_client.chat.completions.create(
+        model=CHATGPT_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": instruction},
+            ],
+        temperature = temperature,
+        **_response_format(json_output)
+        )
+    _count_usage(getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+
+def stream_chatgpt_response(instruction: str, openai_client: OpenAI, temperature: float = CHATGPT_TEMPERATURE, json_output: bool = False)-> Iterator[str]:
+    
+    """
+    Sends an instruction to the ChatGPT model and yields the response as it is generated.
+
+    Closing the generator early (e.g. with close()) closes the underlying stream, which stops the generation.
+
+    Args:
+        instruction (str): The instruction or question to send to ChatGPT.
+        openai_client (OpenAI): An instance of the OpenAI client.
+        temperature (float): Controls the randomness of the output. Defaults to 0.0.
+        json_output (bool): Whether to constrain the response to a JSON object. Defaults to False.
+
+    Yields:
+        str: The successive text deltas of the response.
+    """
+    
+    start = time.perf_counter()
+    stream = openai_client.chat.completions.create(
+    model=CHATGPT_MODEL,
     messages=[
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": instruction},
         ],
-    temperature = temperature
+    temperature = temperature,
+    stream = True,
+    **_response_format(json_output),
+    **_stream_options()
     )
-    return response.choices[0].message.content
+    first_token = True
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    tracer.observe("gpt_first_token", time.perf_counter() - start)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+            _count_usage(getattr(chunk, "usage", None))
+    finally:
+        stream.close()
+        tracer.observe("gpt_stream", time.perf_counter() - start)
+
+
+async def stream_chatgpt_response_async(instruction: str, openai_client: AsyncOpenAI, temperature: float = CHATGPT_TEMPERATURE, json_output: bool = False)-> AsyncIterator[str]:
+    
+    """
+    Sends an instruction to the ChatGPT model and yields the response as it is generated.
+
+    Closing the generator early (e.g. with aclose()) closes the underlying stream, which stops the generation.
+
+    Args:
+        instruction (str): The instruction or question to send to ChatGPT.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        temperature (float): Controls the randomness of the output. Defaults to 0.0.
+        json_output (bool): Whether to constrain the response to a JSON object. Defaults to False.
+
+    Yields:
+        str: The successive text deltas of the response.
+    """
+    
+    start = time.perf_counter()
+    stream = await openai_client.chat.completions.create(
+    model=CHATGPT_MODEL,
+    messages=[
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": instruction},
+        ],
+    temperature = temperature,
+    stream = True,
+    **_response_format(json_output),
+    **_stream_options()
+    )
+    first_token = True
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    tracer.observe("gpt_first_token", time.perf_counter() - start)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+            _count_usage(getattr(chunk, "usage", None))
+    finally:
+        await stream.close()
+        tracer.observe("gpt_stream", time.perf_counter() - start)
 
 
 
@@ -78,6 +247,9 @@ class PromptTemplate(Enum):
     Attributes:
         answer_from_first_text (str): Template for answering questions based on retrieved text.
         answer_from_alternative_text (str): Placeholder for an alternative text response (currently empty).
+        answer_from_multiple_texts (str): Template for answering and citing from several labelled retrieved texts in a single call.
+        answer_from_first_text_json (str): Same as answer_from_first_text, answered with a JSON verdict instead of the '' sentinel.
+        answer_from_multiple_texts_json (str): Same as answer_from_multiple_texts, answered with a JSON verdict.
         default_no_pinecone_text (str): Template for when the provided PDF is insufficient to answer the query.
         default_pinecone_text_irrelevant (str): Template for when no relevant answers are found in the retrieved text.
     """
@@ -99,6 +271,45 @@ class PromptTemplate(Enum):
 
     answer_from_alternative_text = """"""
 
+    answer_from_multiple_texts = """You are a helpful assistant. Below are passages retrieved from relevant sources, each labelled with its reference. Use these passages to answer the following question as accurately as possible.
+
+    Retrieved Passages:
+    {labelled_pinecone_texts}
+
+    Question: {query}
+
+    Answer the question using only the information from the passages. Explain your line of thought on why that answer is correct if and only if you find the answer, then end with the reference of every passage you used, exactly as labelled (e.g. Reference: Babok, page 12).
+
+    If the information is insufficient but contains some clues about completely answering the question, explain your reasoning but end with the following statement:
+    The result is inconclusive.
+
+    If the answer is not present at all, return an empty string. i.e. ''.
+    """
+
+    answer_from_first_text_json = """You are a helpful assistant. Below is information retrieved from relevant sources. Use this information to answer the following question as accurately as possible.
+
+    Retrieved Document:
+    {pinecone_text}
+
+    Question: {query}
+
+    Reply with a JSON object with exactly two keys, "verdict" first and then "answer":
+    - "verdict": "answered" if the document answers the question, "inconclusive" if it only contains some clues about the answer, "not_found" if the answer is not present at all.
+    - "answer": for "answered", the answer using only the information from the document and your line of thought on why it is correct; for "inconclusive", your reasoning; for "not_found", an empty string.
+    """
+
+    answer_from_multiple_texts_json = """You are a helpful assistant. Below are passages retrieved from relevant sources, each labelled with its reference. Use these passages to answer the following question as accurately as possible.
+
+    Retrieved Passages:
+    {labelled_pinecone_texts}
+
+    Question: {query}
+
+    Reply with a JSON object with exactly two keys, "verdict" first and then "answer":
+    - "verdict": "answered" if the passages answer the question, "inconclusive" if they only contain some clues about the answer, "not_found" if the answer is not present at all.
+    - "answer": for "answered", the answer using only the information from the passages and your line of thought on why it is correct, ending with the reference of every passage you used, exactly as labelled (e.g. Reference: Babok, page 12); for "inconclusive", your reasoning; for "not_found", an empty string.
+    """
+
     default_no_pinecone_text = """PDF provided is insufficient to answer your question: {query}.\nPinecone Text: {pinecone_text}""" #Equivalent to: Pinecone did not return any text or your text on pinecone contains empty strings
  
     default_pinecone_text_irrelevant = """I could not find any relevant answers to your query from the PDF provided.\nYour query:\n{query}"""
@@ -10,7 +10,12 @@ Usage:
 Main Functions:
 - get_pinecone_index_client: Retrieves the index client for a specified index name, handling cases where the index may not exist.
 - get_pinecone_query_result: Queries the Pinecone index with dense and sparse vectors to retrieve relevant results based on the embeddings.
+- get_pinecone_query_result_async: Runs get_pinecone_query_result in a worker thread so the caller's event loop is not blocked.
+- rescore_pinecone_candidates: Re-ranks a wide candidate set (fetched once with include_values) for several alpha values locally with NumPy.
+- format_page_reference: Formats the page reference of a passage, including passages without a detected page.
 - parse_texts_from_pinecone: Extracts chapter texts and associated page numbers from the query results returned by Pinecone.
+- parse_match_ids_from_pinecone: Extracts the vector ids of the matches, in the same order as parse_texts_from_pinecone.
+- parse_scores_from_pinecone: Extracts the scores of the matches, in the same order as parse_texts_from_pinecone.
 
 Constants:
 - pinecone_connection: Establishes a connection to the Pinecone service using an API key.
@@ -19,12 +24,16 @@ Constants:
 
 
 
+import asyncio
+
 from pinecone import Pinecone, ServerlessSpec
 
-from auxiliaries import List, Dict, Union, Tuple, os
+from auxiliaries import List, Dict, Any, Union, Tuple, os, np
 from auxiliaries import load_dotenv
+from tracing import tracer
 from pinecone import Pinecone
 from pinecone.exceptions import NotFoundException
+from scipy.sparse import csr_matrix
 
 
 
@@ -67,7 +76,8 @@ def get_pinecone_index_client(pinecone_client: Pinecone,
 def get_pinecone_query_result(pinecone_index_client: pinecone_connection.Index, 
                               hdense: List[float], 
                               hsparse: Dict[str, List], 
-                              num_results: int = 3
+                              num_results: int = 3,
+                              include_values: bool = False
                               )-> Dict:
     
     """
@@ -78,29 +88,152 @@ def get_pinecone_query_result(pinecone_index_client: pinecone_connection.Index,
         hdense (List[float]): The dense vector representation of the query.
         hsparse (Dict[str, List]): The sparse vector representation of the query.
         num_results (int, optional): The number of top results to return. Defaults to 3.
+        include_values (bool, optional): Whether to return the stored dense and sparse values of each match. Defaults to False.
 
     Returns:
         Dict: The query results as a dictionary, including metadata and matches.
     """
     
-    if hsparse["values"]:
-        query_result = pinecone_index_client.query(
-        namespace= "sisikepo",
-        vector= hdense,
-        sparse_vector= hsparse,
-        top_k= num_results,
-        include_metadata = True
-        )
-        
-    else:
-        query_result = pinecone_index_client.query(
-        namespace= "sisikepo",
-        vector= hdense,
-        top_k= num_results,
-        include_metadata = True
-        )
+    with tracer.span("pinecone_query"):
+        if hsparse["values"]:
+            query_result = pinecone_index_client.query(
+            namespace= "sisikepo",
+            vector= hdense,
+            sparse_vector= hsparse,
+            top_k= num_results,
+            include_metadata = True,
+            include_values = include_values
+            )
+            
+        else:
+            query_result = pinecone_index_client.query(
+            namespace= "sisikepo",
+            vector= hdense,
+            top_k= num_results,
+            include_metadata = True,
+            include_values = include_values
+            )
         
-    return query_result.to_dict()
+        return query_result.to_dict()
+
+
+async def get_pinecone_query_result_async(pinecone_index_client: pinecone_connection.Index, 
+                                          hdense: List[float], 
+                                          hsparse: Dict[str, List], 
+                                          num_results: int = 3,
+                                          include_values: bool = False
+                                          )-> Dict:
+    
+    """
+    Queries the Pinecone index without blocking the event loop.
+
+    The Pinecone client only exposes a blocking HTTP call, so the query is run in the default thread pool.
+
+    Args:
+        pinecone_index_client (pinecone_connection.Index): The Pinecone index client to query.
+        hdense (List[float]): The dense vector representation of the query.
+        hsparse (Dict[str, List]): The sparse vector representation of the query.
+        num_results (int, optional): The number of top results to return. Defaults to 3.
+        include_values (bool, optional): Whether to return the stored dense and sparse values of each match. Defaults to False.
+
+    Returns:
+        Dict: The query results as a dictionary, including metadata and matches.
+    """
+    
+    return await asyncio.to_thread(get_pinecone_query_result, pinecone_index_client, hdense, hsparse, num_results, include_values)
+
+
+
+def _sparse_dot_products(matches: List[Dict], sparse_matrix: csr_matrix)-> np.ndarray:
+
+    """Computes the dot product of the query's sparse vector with the stored sparse values of each match."""
+
+    sparse_scores = np.zeros(len(matches), dtype = np.float32)
+    if sparse_matrix.nnz == 0:
+        return sparse_scores
+
+    order = np.argsort(sparse_matrix.indices)
+    query_indices = sparse_matrix.indices[order]
+    query_values = sparse_matrix.data[order].astype(np.float32)
+
+    for match_index, match in enumerate(matches):
+        sparse_values = match.get("sparse_values")
+        if not sparse_values or not sparse_values["indices"]:
+            continue
+        indices = np.asarray(sparse_values["indices"])
+        values = np.asarray(sparse_values["values"], dtype = np.float32)
+
+        positions = np.clip(np.searchsorted(query_indices, indices), 0, len(query_indices) - 1)
+        shared = query_indices[positions] == indices
+        sparse_scores[match_index] = values[shared] @ query_values[positions[shared]]
+
+    return sparse_scores
+
+
+def rescore_pinecone_candidates(query_result: Dict,
+                                dense: List[float],
+                                sparse_matrix: csr_matrix,
+                                alpha_values: List[float],
+                                num_results: int = 3
+                                )-> Dict[float, Dict]:
+    
+    """
+    Re-ranks a candidate set for several alpha values without further Pinecone round-trips.
+
+    On a dotproduct index the hybrid score of a match is alpha * (dense . query_dense) + (1 - alpha) * (sparse . query_sparse),
+    which is linear in alpha. So the dense and sparse dot products are computed once for every candidate and
+    combined for each alpha with a single matrix operation.
+
+    Args:
+        query_result (Dict): A Pinecone query result fetched with include_values=True.
+        dense (List[float]): The unscaled dense query vector.
+        sparse_matrix (csr_matrix): The unscaled sparse query vector.
+        alpha_values (List[float]): The alpha values to rank the candidates for.
+        num_results (int, optional): The number of top results to keep per alpha value. Defaults to 3.
+
+    Returns:
+        Dict[float, Dict]: For each alpha value, a query result with the same shape as a Pinecone query result.
+    """
+    
+    matches: List[Dict] = query_result["matches"]
+    if not matches:
+        return {alpha_value: {"matches": []} for alpha_value in alpha_values}
+
+    dense_matrix = np.asarray([match["values"] for match in matches], dtype = np.float32)
+    dense_scores: np.ndarray = dense_matrix @ np.asarray(dense, dtype = np.float32)
+    sparse_scores: np.ndarray = _sparse_dot_products(matches, sparse_matrix)
+
+    alphas = np.asarray(alpha_values, dtype = np.float32)[:, np.newaxis]
+    hybrid_scores: np.ndarray = alphas * dense_scores + (1 - alphas) * sparse_scores
+
+    rescored_results = {}
+    for row, alpha_value in enumerate(alpha_values):
+        top_indices = np.argsort(-hybrid_scores[row], kind = "stable")[:num_results]
+        rescored_results[alpha_value] = {
+            "matches": [{**matches[idx], "score": float(hybrid_scores[row, idx])} for idx in top_indices]
+            }
+
+    return rescored_results
+
+
+
+def format_page_reference(page_number: Any)-> str:
+
+    """
+    Formats the page reference of a passage.
+
+    Args:
+        page_number (Any): The page_number metadata of the passage. The upload (and the local index) stores
+            "No pages detected" when the book had no pages file.
+
+    Returns:
+        str: The page reference appended to an answer.
+    """
+
+    try:
+        return f"Reference: Babok, page {int(page_number)}"
+    except (TypeError, ValueError):
+        return "Reference: Babok, page not detected"
 
 
 
@@ -119,10 +252,42 @@ def parse_texts_from_pinecone(query_result: Dict)-> Tuple[List]:
     pinecone_texts = []
     text_pages = []
     if query_result["matches"]:
-        for result_index in range(len(query_result)):
+        for result_index in range(len(query_result["matches"])):
             text = query_result["matches"][result_index]["metadata"]["chapter_texts"]
             page_number = query_result["matches"][result_index]["metadata"]["page_number"]
-            text_pages.append(f"Reference: Babok, page {int(page_number)}")
+            text_pages.append(format_page_reference(page_number))
             pinecone_texts.append(text)
       
     return pinecone_texts, text_pages
+
+
+
+def parse_match_ids_from_pinecone(query_result: Dict)-> List[str]:
+    
+    """
+    Extracts the vector ids of the matches in the query results, in the order of parse_texts_from_pinecone.
+
+    Args:
+        query_result (Dict): The results returned from a Pinecone query.
+
+    Returns:
+        List[str]: The ids of the matches.
+    """
+    
+    return [match["id"] for match in query_result["matches"]]
+
+
+
+def parse_scores_from_pinecone(query_result: Dict)-> List[float]:
+    
+    """
+    Extracts the scores of the matches in the query results, in the order of parse_texts_from_pinecone.
+
+    Args:
+        query_result (Dict): The results returned from a Pinecone query.
+
+    Returns:
+        List[float]: The hybrid dotproduct scores of the matches.
+    """
+    
+    return [float(match["score"]) for match in query_result["matches"]]
@@ -0,0 +1,143 @@
+
+"""
+query_analyzer.py
+
+This module chooses the order in which the alpha values are tried for a query, before anything is sent to Pinecone or GPT. The default sweep always starts with dense-only retrieval, so a question full of BABOK terms only reaches sparse-heavy retrieval after one or two failed GPT rounds. The analyzer reads the query with the fitted TF-IDF vectorizer and measures how much of it is made of rare, in-vocabulary terms (jargon): the more jargon, the earlier the sparse side is tried. What counts as rare is read from the vectorizer itself: a term is jargon when its IDF is above a percentile of the IDF of the textbook's term occurrences.
+
+Usage:
+    query_analyzer = QueryAnalyzer(vectorizer)
+    alpha_values = query_analyzer.order_alpha_values(query, [1.0, 0.5, 0.0])
+
+    Give it to process_query (QueryOptions(query_analyzer = ...)) or build the ChatbotRuntime with adaptive_alpha = True.
+
+Main Classes:
+- QueryAnalyzer: Computes IDF-weighted term coverage and jargon share of a query, and orders the alpha values accordingly.
+"""
+
+
+from auxiliaries import List, Dict, Union, np
+from embedding_matrix_loader import TfidfVectorizer
+
+
+
+# Percentile of the IDF over the textbook's term occurrences from which a term counts as jargon: with 50, a term is
+# jargon when it is rarer than the median word of the textbook
+JARGON_PERCENTILE = 50.0
+
+# Jargon shares (parts of the IDF weight of a query) from which sparse-only and balanced retrieval are tried first
+SPARSE_FIRST_THRESHOLD = 0.6
+BALANCED_THRESHOLD = 0.4
+
+
+
+class QueryAnalyzer:
+
+    """
+    Scores queries against the IDF statistics of a fitted TF-IDF vectorizer.
+
+    Each distinct query term is weighted by its IDF; terms missing from the vocabulary are weighted with the
+    largest IDF, since they are informative words the sparse vector cannot match. The jargon share is the part
+    of the total weight carried by in-vocabulary terms that are rare in the textbook.
+
+    The jargon cut-off is a percentile of the IDF of the term occurrences, not of the vocabulary: most of the
+    vocabulary appears in a handful of chunks, so a vocabulary percentile would only keep the rarest words. The
+    number of chunks containing a term is proportional to exp(-idf) (minus one, with smoothed IDF), which weights
+    each term by its occurrences.
+    """
+
+    def __init__(self,
+                 vectorizer: TfidfVectorizer,
+                 jargon_percentile: float = JARGON_PERCENTILE,
+                 sparse_first_threshold: float = SPARSE_FIRST_THRESHOLD,
+                 balanced_threshold: float = BALANCED_THRESHOLD
+                 ):
+
+        """
+        Initializes the QueryAnalyzer instance.
+
+        Args:
+            vectorizer (TfidfVectorizer): The fitted vectorizer used for the sparse query vectors.
+            jargon_percentile (float): Percentile (0 to 100) of the IDF over the textbook's term occurrences from
+                which a term counts as jargon. Defaults to JARGON_PERCENTILE.
+            sparse_first_threshold (float): Jargon share from which sparse-only retrieval is tried first.
+                Defaults to SPARSE_FIRST_THRESHOLD.
+            balanced_threshold (float): Jargon share from which balanced retrieval is tried first.
+                Defaults to BALANCED_THRESHOLD.
+        """
+
+        self.analyzer = vectorizer.build_analyzer()
+        self.vocabulary: Dict[str, int] = vectorizer.vocabulary_
+        self.idf: np.ndarray = np.asarray(vectorizer.idf_, dtype = np.float64)
+        self.max_idf = float(self.idf.max())
+        self.jargon_idf = self._occurrence_idf_percentile(jargon_percentile)
+        self.sparse_first_threshold = sparse_first_threshold
+        self.balanced_threshold = balanced_threshold
+
+
+    def _occurrence_idf_percentile(self, percentile: float)-> float:
+
+        """Returns the IDF below which the given percentage of the textbook's term occurrences lie."""
+
+        order = np.argsort(self.idf)
+        sorted_idf = self.idf[order]
+        occurrences = np.exp(-sorted_idf)
+        cumulative_share = np.cumsum(occurrences) / occurrences.sum()
+        return float(sorted_idf[min(np.searchsorted(cumulative_share, percentile / 100), len(sorted_idf) - 1)])
+
+
+    def analyze(self, query: str)-> Dict[str, float]:
+
+        """
+        Measures how well the sparse vector of a query can match the textbook.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            Dict[str, float]: "terms" (distinct query terms), "coverage" (IDF-weighted share of the terms found in
+            the vocabulary), "jargon_share" (IDF-weighted share of rare in-vocabulary terms) and "preferred_alpha".
+        """
+
+        terms = set(self.analyzer(query))
+        term_indices = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+        unknown_terms = len(terms) - len(term_indices)
+
+        known_idf = self.idf[term_indices]
+        total_weight = known_idf.sum() + unknown_terms * self.max_idf
+        if total_weight == 0:
+            return {"terms": 0, "coverage": 0.0, "jargon_share": 0.0, "preferred_alpha": 1.0}
+
+        jargon_weight = known_idf[known_idf > self.jargon_idf].sum()
+        jargon_share = float(jargon_weight / total_weight)
+
+        if jargon_share >= self.sparse_first_threshold:
+            preferred_alpha = 0.0
+        elif jargon_share >= self.balanced_threshold:
+            preferred_alpha = 0.5
+        else:
+            preferred_alpha = 1.0
+
+        return {"terms": len(terms),
+                "coverage": float(known_idf.sum() / total_weight),
+                "jargon_share": jargon_share,
+                "preferred_alpha": preferred_alpha
+                }
+
+
+    def order_alpha_values(self, query: str, alpha_values: List[float], analysis: Union[Dict[str, float], None] = None)-> List[float]:
+
+        """
+        Orders the alpha values from the most to the least likely to retrieve the answer.
+
+        Args:
+            query (str): The user query.
+            alpha_values (List[float]): The alpha values to try, in their default order.
+            analysis (Union[Dict[str, float], None]): The result of analyze(query), if already computed.
+
+        Returns:
+            List[float]: The same alpha values, closest to the preferred alpha first. Ties keep the denser one first,
+            so a query without jargon keeps the default dense-first sweep.
+        """
+
+        preferred_alpha = (analysis or self.analyze(query))["preferred_alpha"]
+        return sorted(alpha_values, key = lambda alpha_value: (abs(alpha_value - preferred_alpha), -alpha_value))
@@ -9,38 +9,730 @@ Usage:
 
 Main Functions:
 - get_gpt_response_from_pinecone_text: Generates a response from GPT-4 based on a single piece of text retrieved from Pinecone and the user's query.
+  With a CompletionCache, the response is looked up by (query, match id, model, temperature, template) before calling GPT.
 - get_gpt_response_from_pinecone_texts: Processes multiple texts from Pinecone, generating responses and appending page information when relevant.
+- get_gpt_response_from_labelled_pinecone_texts: Answers from all retrieved texts, labelled with their page references, in a single GPT call.
 - process_query: Takes a user query, retrieves relevant texts from Pinecone, and generates an appropriate response using OpenAI's API.
+  Its settings (answering strategy, retrieval mode, caches, answer format, score thresholds, ...) are given as one QueryOptions.
+- process_query_async: Non-blocking counterpart of process_query (with *_async versions of the helpers above), for use inside the bot's event loop.
+  With concurrent_candidates=True, the Pinecone texts of an alpha value are sent to GPT at the same time instead of one after the other.
+- stream_query_async: Streaming counterpart of process_query_async, yielding the answer as GPT generates it.
+- answer_was_found: Tells a real answer apart from the default 'no relevant answer' message.
+- parse_verdict: Reads the verdict and answer out of a JSON verdict response.
+
+Main Classes:
+- QueryOptions: The settings of the query pipeline, shared by process_query, process_query_async and stream_query_async.
+  With a QueryAnalyzer, the alpha values are tried in the order suggested by the query's terms instead of dense first.
+  With abort_unanswerable=True, the answering functions stream each completion and stop it as soon as it is the '' sentinel.
+  With answer_format=AnswerFormat.JSON_VERDICT, GPT replies with a JSON verdict (answered / inconclusive / not_found) instead.
+- EvaluatedPassages: Remembers the Pinecone matches already sent to GPT for a query, so later alpha values skip them,
+  and counts the completions saved that way.
+- ScoreThresholds: Pinecone match score thresholds that skip weak candidates, stop the alpha sweep after a strong
+  unanswered match, and answer 'not found' without GPT when every alpha value only retrieves weak matches.
+
+Enums:
+- AlphaValues: The dense/sparse weightings tried for each query, in order.
+- AnsweringStrategy: Selects between one GPT call per Pinecone text (PER_PASSAGE) and one GPT call for all texts (SINGLE_CALL).
+- AnswerFormat: Selects how GPT signals that a passage does not answer the query: the '' sentinel or a JSON verdict.
+- Verdict: The answerability verdicts of AnswerFormat.JSON_VERDICT.
+- RetrievalMode: Selects between one Pinecone query per alpha value (PER_ALPHA) and one wider query re-ranked locally for every alpha value (SINGLE_ROUND_TRIP).
 
 """
 
 
+import asyncio
+import json
+import re
 from enum import Enum
-from auxiliaries import List, Dict
-from openai_kit import (OpenAI, 
-                        PromptTemplate, 
-                        get_chatgpt_response
+from auxiliaries import List, Dict, Tuple, Union, AsyncIterator
+from openai_kit import (OpenAI,
+                        AsyncOpenAI,
+                        PromptTemplate,
+                        CHATGPT_MODEL,
+                        CHATGPT_TEMPERATURE,
+                        get_chatgpt_response,
+                        get_chatgpt_response_async,
+                        stream_chatgpt_response,
+                        stream_chatgpt_response_async
                         )
 
-from pinecone_kit import (get_pinecone_query_result, 
-                          parse_texts_from_pinecone
+from pinecone_kit import (get_pinecone_query_result,
+                          get_pinecone_query_result_async,
+                          rescore_pinecone_candidates,
+                          parse_texts_from_pinecone,
+                          parse_match_ids_from_pinecone,
+                          parse_scores_from_pinecone
                           )
 
+from embedding_cache import EmbeddingCache
+from completion_cache import CompletionCache, prompt_template_hash
+from query_analyzer import QueryAnalyzer
+from tracing import tracer
 from embedding_matrix_loader import (TfidfVectorizer,
                                      convert_string_query_to_vectors,
+                                     convert_string_query_to_vectors_async,
                                      hybrid_scale
                                      )
 
 
 
+EMPTY_GPT_RESPONSES = ['',"'", '"', "", "''", '""']
+
+# Sentinels that are complete as soon as they are streamed: a response starting with one of them is not an answer
+CLOSED_GPT_SENTINELS = ["''", '""']
+
+# Number of candidates fetched by the single Pinecone query of RetrievalMode.SINGLE_ROUND_TRIP
+CANDIDATE_POOL_SIZE = 25
+
+
 class AlphaValues(Enum):
    HIGH = 1.0
    MEDIUM = 0.5
    LOW = 0.0
 
 
-def get_gpt_response_from_pinecone_text(pinecone_text: str, query: str, openai_client: OpenAI)-> str:
-    
+class AnsweringStrategy(Enum):
+
+    """
+    Enum for selecting how retrieved Pinecone texts are turned into an answer.
+
+    Attributes:
+        PER_PASSAGE (str): Send each text to GPT on its own, moving to the next text and alpha value until one answers (up to nine calls).
+        SINGLE_CALL (str): Retrieve the texts of every alpha value, deduplicate them and answer from all of them in one call.
+    """
+
+    PER_PASSAGE = "per_passage"
+    SINGLE_CALL = "single_call"
+
+
+class RetrievalMode(Enum):
+
+    """
+    Enum for selecting how Pinecone is queried for the alpha values of a query.
+
+    Attributes:
+        PER_ALPHA (str): Scale the query vectors and query Pinecone once for each alpha value.
+        SINGLE_ROUND_TRIP (str): Query Pinecone once for CANDIDATE_POOL_SIZE candidates with their stored values,
+            then re-rank the candidates locally for each alpha value. This approximates PER_ALPHA: the candidates
+            are fetched with the query scaled to alpha 0.5, so the true top results for alpha 1.0 or 0.0 can lie
+            outside the pool (the alpha benchmark measures the recall against PER_ALPHA). include_values also
+            returns the stored vectors, about CANDIDATE_POOL_SIZE x 1536 floats per query.
+    """
+
+    PER_ALPHA = "per_alpha"
+    SINGLE_ROUND_TRIP = "single_round_trip"
+
+
+class AnswerFormat(Enum):
+
+    """
+    Enum for selecting how GPT tells that a retrieved text does not answer the query.
+
+    Attributes:
+        SENTINEL (str): GPT answers in free text, or with the empty string '' when the answer is not present.
+        JSON_VERDICT (str): GPT answers with a JSON object holding a Verdict and the answer.
+    """
+
+    SENTINEL = "sentinel"
+    JSON_VERDICT = "json_verdict"
+
+
+class Verdict(Enum):
+
+    """
+    Enum for the answerability verdicts returned with AnswerFormat.JSON_VERDICT.
+
+    Attributes:
+        ANSWERED (str): The text answers the query.
+        INCONCLUSIVE (str): The text only contains clues about the answer.
+        NOT_FOUND (str): The answer is not present in the text.
+    """
+
+    ANSWERED = "answered"
+    INCONCLUSIVE = "inconclusive"
+    NOT_FOUND = "not_found"
+
+
+# Matches the verdict at the start of a (possibly partial) JSON verdict response
+VERDICT_PATTERN = re.compile(r'"verdict"\s*:\s*"(\w+)"')
+
+# The verdict is the first key, so a streamed response shows it within this many characters
+VERDICT_PREFIX_LENGTH = 200
+
+# Matches the opening quote of the answer string of a (possibly partial) JSON verdict response
+ANSWER_START_PATTERN = re.compile(r'"answer"\s*:\s*"')
+
+JSON_STRING_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+INCONCLUSIVE_STATEMENT = "The result is inconclusive."
+
+
+def parse_verdict(gpt_response: str)-> Tuple[Verdict, str]:
+
+    """
+    Reads the verdict and the answer out of a JSON verdict response.
+
+    A response that is not a valid verdict (plain text, truncated or malformed JSON, an unknown verdict) is
+    NOT_FOUND: the prompt asks for JSON output, so any other reply means the generation went wrong, and its text
+    must not be sent to the user as an answer. An answered or inconclusive verdict without an answer is NOT_FOUND.
+
+    Args:
+        gpt_response (str): The response to an answer_from_*_json prompt.
+
+    Returns:
+        Tuple[Verdict, str]: The verdict and the answer (empty for NOT_FOUND).
+    """
+
+    try:
+        payload: Dict = json.loads(gpt_response)
+        verdict = Verdict(payload["verdict"])
+        answer = str(payload.get("answer") or "").strip()
+    except (json.JSONDecodeError, TypeError, KeyError, ValueError, AttributeError):
+        return Verdict.NOT_FOUND, ""
+
+    if verdict == Verdict.NOT_FOUND or not answer:
+        return Verdict.NOT_FOUND, ""
+    return verdict, answer
+
+
+def _verdict_to_response(gpt_response: str)-> str:
+
+    """
+    Converts a JSON verdict response to the AnswerFormat.SENTINEL convention used by the rest of the module:
+    '' when the answer was not found, the answer (ending with the inconclusive statement if needed) otherwise.
+    """
+
+    verdict, answer = parse_verdict(gpt_response)
+    if verdict == Verdict.NOT_FOUND:
+        return ''
+    if verdict == Verdict.INCONCLUSIVE and not answer.endswith(INCONCLUSIVE_STATEMENT):
+        return f"{answer}\n{INCONCLUSIVE_STATEMENT}"
+    return answer
+
+
+def _reads_as_unanswered(partial_response: str, answer_format: AnswerFormat)-> bool:
+
+    """Checks whether the start of a streamed response already shows that the text does not answer the query."""
+
+    if answer_format == AnswerFormat.JSON_VERDICT:
+        verdict_match = VERDICT_PATTERN.search(partial_response[:VERDICT_PREFIX_LENGTH])
+        return verdict_match is not None and verdict_match.group(1) == Verdict.NOT_FOUND.value
+
+    return partial_response.strip() in CLOSED_GPT_SENTINELS
+
+
+def _get_completion_cache_key(query: str,
+                              match_id: Union[str, None],
+                              template: PromptTemplate,
+                              completion_cache: Union[CompletionCache, None]
+                              )-> Union[Tuple, None]:
+
+    """Returns the CompletionCache key arguments of a per-passage completion, or None if it cannot be cached."""
+
+    if completion_cache is None or match_id is None:
+        return None
+    return (query, match_id, CHATGPT_MODEL, CHATGPT_TEMPERATURE, prompt_template_hash(template.value))
+
+
+def _get_answer_template(answer_format: AnswerFormat, multiple_texts: bool = False)-> PromptTemplate:
+
+    if answer_format == AnswerFormat.JSON_VERDICT:
+        return PromptTemplate.answer_from_multiple_texts_json if multiple_texts else PromptTemplate.answer_from_first_text_json
+    return PromptTemplate.answer_from_multiple_texts if multiple_texts else PromptTemplate.answer_from_first_text
+
+
+def _is_unanswered(gpt_response: str, query: str, pinecone_text: str)-> bool:
+
+    """Checks whether GPT's response to a single Pinecone text means that the text did not answer the query."""
+
+    return (gpt_response in EMPTY_GPT_RESPONSES
+            or gpt_response == PromptTemplate.default_no_pinecone_text.value.format(query = query, pinecone_text = pinecone_text)
+            )
+
+
+def _finalize_unanswered(gpt_response: str, query: str)-> str:
+
+    """Returns the default answer once every Pinecone text for an alpha value has failed to answer the query."""
+
+    if gpt_response in EMPTY_GPT_RESPONSES:
+        return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+    raise ValueError(f"Unexpected behavior detected in function: {get_gpt_response_from_pinecone_texts.__name__}()")
+
+
+def _is_irrelevant_answer(answer: str, query: str)-> bool:
+
+    """Checks whether the answer for an alpha value means the next alpha value should be tried."""
+
+    return answer in ['', "", "''", '""'] or answer == PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+
+def _could_be_sentinel(partial_response: str)-> bool:
+
+    """Checks whether a partially streamed response may still turn out to be one of EMPTY_GPT_RESPONSES."""
+
+    stripped_response = partial_response.strip()
+    return any(sentinel.startswith(stripped_response) for sentinel in EMPTY_GPT_RESPONSES)
+
+
+def _get_chatgpt_response_or_sentinel(instruction: str,
+                                      openai_client: OpenAI,
+                                      abort_unanswerable: bool,
+                                      answer_format: AnswerFormat = AnswerFormat.SENTINEL
+                                      )-> str:
+
+    """
+    Returns GPT's response to an instruction, in the AnswerFormat.SENTINEL convention whatever the answer_format.
+    With abort_unanswerable, the response is streamed and the generation is stopped as soon as it reads as
+    unanswered (a complete sentinel, or a not_found verdict), in which case '' is returned.
+    """
+
+    json_output = answer_format == AnswerFormat.JSON_VERDICT
+    if not abort_unanswerable:
+        gpt_response = get_chatgpt_response(instruction, openai_client, json_output = json_output)
+    else:
+        gpt_response = ""
+        deltas = stream_chatgpt_response(instruction, openai_client, json_output = json_output)
+        try:
+            for delta in deltas:
+                gpt_response += delta
+                if _reads_as_unanswered(gpt_response, answer_format):
+                    return ''
+        finally:
+            deltas.close()
+
+    return _verdict_to_response(gpt_response) if json_output else gpt_response
+
+
+async def _get_chatgpt_response_or_sentinel_async(instruction: str,
+                                                  openai_client: AsyncOpenAI,
+                                                  abort_unanswerable: bool,
+                                                  answer_format: AnswerFormat = AnswerFormat.SENTINEL
+                                                  )-> str:
+
+    """Asynchronous version of _get_chatgpt_response_or_sentinel."""
+
+    json_output = answer_format == AnswerFormat.JSON_VERDICT
+    if not abort_unanswerable:
+        gpt_response = await get_chatgpt_response_async(instruction, openai_client, json_output = json_output)
+    else:
+        gpt_response = ""
+        deltas = stream_chatgpt_response_async(instruction, openai_client, json_output = json_output)
+        try:
+            async for delta in deltas:
+                gpt_response += delta
+                if _reads_as_unanswered(gpt_response, answer_format):
+                    return ''
+        finally:
+            await deltas.aclose()
+
+    return _verdict_to_response(gpt_response) if json_output else gpt_response
+
+
+def answer_was_found(answer: str, query: str)-> bool:
+
+    """
+    Checks whether a final answer from process_query came from the retrieved texts, rather than being the
+    default 'no relevant answer' message.
+
+    Args:
+        answer (str): The answer returned by process_query.
+        query (str): The query it answers.
+
+    Returns:
+        bool: True if the answer was found in the retrieved texts.
+    """
+
+    return not _is_irrelevant_answer(answer, query)
+
+
+class EvaluatedPassages:
+
+    """
+    The Pinecone matches already sent to GPT while answering one query.
+
+    The alpha values often retrieve overlapping matches. A match evaluated for an earlier alpha value did not
+    answer the query (otherwise the query would be answered), so later alpha values skip it instead of paying
+    for the same completion again.
+    """
+
+    def __init__(self):
+
+        self.match_ids = set()
+        self.passages_evaluated = 0
+        self.completions_saved = 0
+        self.candidates_below_floor = 0
+
+
+    def should_evaluate(self, match_id: Union[str, None])-> bool:
+
+        """
+        Checks whether a match still has to be sent to GPT, and records it as evaluated.
+
+        Args:
+            match_id (Union[str, None]): The vector id of the match. None is always evaluated.
+
+        Returns:
+            bool: False if the match was already evaluated for this query.
+        """
+
+        if match_id is not None and match_id in self.match_ids:
+            self.completions_saved += 1
+            return False
+
+        if match_id is not None:
+            self.match_ids.add(match_id)
+        self.passages_evaluated += 1
+        return True
+
+
+    def report(self, passage_counters: Union[Dict[str, int], None] = None)-> None:
+
+        """
+        Adds the passages evaluated and the completions saved for this query to passage_counters, if given.
+        The runtime's totals are served with the other component counters on the metrics endpoint.
+
+        Args:
+            passage_counters (Union[Dict[str, int], None]): Totals across queries, with the keys "queries",
+                "passages_evaluated", "completions_saved" and "candidates_below_floor".
+        """
+
+        if passage_counters is not None:
+            passage_counters["queries"] = passage_counters.get("queries", 0) + 1
+            passage_counters["passages_evaluated"] = passage_counters.get("passages_evaluated", 0) + self.passages_evaluated
+            passage_counters["completions_saved"] = passage_counters.get("completions_saved", 0) + self.completions_saved
+            passage_counters["candidates_below_floor"] = passage_counters.get("candidates_below_floor", 0) + self.candidates_below_floor
+
+
+
+class ScoreThresholds:
+
+    """
+    Thresholds on the Pinecone match scores, so that completions are only spent on passages that can answer.
+
+    The scores are the hybrid dotproduct scores of the matches for the alpha value they were retrieved with
+    (dense cosine similarity at alpha = 1.0, TF-IDF cosine similarity at alpha = 0.0). A threshold left to
+    None is not applied, so ScoreThresholds() keeps the full sweep.
+    """
+
+    def __init__(self,
+                 candidate_floor: Union[float, None] = None,
+                 strong_hit: Union[float, None] = None,
+                 not_found_below: Union[float, None] = None
+                 ):
+
+        """
+        Initializes the ScoreThresholds instance.
+
+        Args:
+            candidate_floor (Union[float, None]): Matches scoring below this value are not sent to GPT. Defaults to None.
+            strong_hit (Union[float, None]): When an alpha value retrieves a match scoring at least this value and
+                still does not answer, the remaining alpha values are not tried. Defaults to None.
+            not_found_below (Union[float, None]): When no match of any alpha value reaches this value, the query is
+                answered as not found without calling GPT. Defaults to None.
+        """
+
+        self.candidate_floor = candidate_floor
+        self.strong_hit = strong_hit
+        self.not_found_below = not_found_below
+
+
+    @property
+    def needs_all_tiers(self)-> bool:
+
+        """Whether every alpha value must be retrieved before answering, to check not_found_below."""
+
+        return self.not_found_below is not None
+
+
+    def apply_floor(self, retrieved: Tuple[List, List, List, List])-> Tuple[Tuple[List, List, List, List], int]:
+
+        """
+        Drops the matches scoring below candidate_floor.
+
+        Args:
+            retrieved (Tuple[List, List, List, List]): The texts, page references, match ids and scores of an alpha value.
+
+        Returns:
+            Tuple[Tuple[List, List, List, List], int]: The kept matches, in the same layout, and the number dropped.
+        """
+
+        match_scores = retrieved[3]
+        if self.candidate_floor is None:
+            return retrieved, 0
+
+        kept = [idx for idx, score in enumerate(match_scores) if score >= self.candidate_floor]
+        return tuple([values[idx] for idx in kept] for values in retrieved), len(match_scores) - len(kept)
+
+
+    def has_strong_hit(self, match_scores: List[float])-> bool:
+
+        return self.strong_hit is not None and any(score >= self.strong_hit for score in match_scores)
+
+
+    def all_tiers_weak(self, tier_results: List[Tuple[List, List, List, List]])-> bool:
+
+        """Checks whether no match of any alpha value reaches not_found_below."""
+
+        return (self.not_found_below is not None
+                and all(score < self.not_found_below for *_, match_scores in tier_results for score in match_scores)
+                )
+
+
+
+class QueryOptions:
+
+    """
+    The settings of the query pipeline, shared by process_query, process_query_async and stream_query_async.
+
+    QueryOptions() is the original pipeline: one GPT call per Pinecone text, one Pinecone query per alpha value,
+    dense retrieval first, the '' sentinel, and no caches or score thresholds.
+    """
+
+    def __init__(self,
+                 answering_strategy: AnsweringStrategy = AnsweringStrategy.PER_PASSAGE,
+                 retrieval_mode: RetrievalMode = RetrievalMode.PER_ALPHA,
+                 concurrent_candidates: bool = False,
+                 embedding_cache: Union[EmbeddingCache, None] = None,
+                 abort_unanswerable: bool = False,
+                 answer_format: AnswerFormat = AnswerFormat.SENTINEL,
+                 completion_cache: Union[CompletionCache, None] = None,
+                 query_analyzer: Union[QueryAnalyzer, None] = None,
+                 score_thresholds: Union[ScoreThresholds, None] = None,
+                 passage_counters: Union[Dict[str, int], None] = None
+                 ):
+
+        """
+        Initializes the QueryOptions instance.
+
+        Args:
+            answering_strategy (AnsweringStrategy): One GPT call per Pinecone text (PER_PASSAGE) or one call for all
+                retrieved texts (SINGLE_CALL). Defaults to AnsweringStrategy.PER_PASSAGE.
+            retrieval_mode (RetrievalMode): One Pinecone query per alpha value (PER_ALPHA) or one query re-ranked
+                locally for every alpha value (SINGLE_ROUND_TRIP). Defaults to RetrievalMode.PER_ALPHA.
+            concurrent_candidates (bool): Whether process_query_async sends the Pinecone texts of each alpha value to
+                GPT concurrently. Defaults to False.
+            embedding_cache (Union[EmbeddingCache, None]): Optional cache of query embeddings. Defaults to None.
+            abort_unanswerable (bool): Whether to stream each completion and stop it as soon as it is the '' sentinel,
+                moving straight on to the next text or alpha value. Defaults to False.
+            answer_format (AnswerFormat): Whether GPT signals unanswerable texts with the '' sentinel or a JSON verdict.
+                Defaults to AnswerFormat.SENTINEL.
+            completion_cache (Union[CompletionCache, None]): Cache of per-passage responses across queries (PER_PASSAGE only).
+                Defaults to None (no caching).
+            query_analyzer (Union[QueryAnalyzer, None]): Orders the alpha values by the query's jargon content, so that
+                sparse-heavy retrieval is tried first when it is more likely to answer. Defaults to None (dense first).
+            score_thresholds (Union[ScoreThresholds, None]): Pinecone score thresholds for skipping weak candidates,
+                stopping after a strong unanswered match and answering 'not found' without GPT. Defaults to None.
+            passage_counters (Union[Dict[str, int], None]): Optional totals updated with the passages evaluated and the
+                completions saved by skipping matches already evaluated for an earlier alpha value (PER_PASSAGE only).
+        """
+
+        self.answering_strategy = answering_strategy
+        self.retrieval_mode = retrieval_mode
+        self.concurrent_candidates = concurrent_candidates
+        self.embedding_cache = embedding_cache
+        self.abort_unanswerable = abort_unanswerable
+        self.answer_format = answer_format
+        self.completion_cache = completion_cache
+        self.query_analyzer = query_analyzer
+        self.score_thresholds = score_thresholds
+        self.passage_counters = passage_counters
+
+
+
+def _get_alpha_values(query: str = "", query_analyzer: Union[QueryAnalyzer, None] = None)-> List[float]:
+
+    alpha_values = [AlphaValues.HIGH.value,
+                    AlphaValues.MEDIUM.value,
+                    AlphaValues.LOW.value
+                    ]
+    if query_analyzer is None:
+        return alpha_values
+    return query_analyzer.order_alpha_values(query, alpha_values)
+
+
+def _label_pinecone_texts(pinecone_texts: List, text_pages: List)-> str:
+
+    """Deduplicates the retrieved texts, keeping their first (best-ranked) occurrence, and labels each with its page reference."""
+
+    labelled_texts = []
+    seen_texts = set()
+    for pinecone_text, text_page in zip(pinecone_texts, text_pages):
+        if not pinecone_text or pinecone_text in seen_texts:
+            continue
+        seen_texts.add(pinecone_text)
+        labelled_texts.append(f"[Passage {len(labelled_texts) + 1} | {text_page}]\n{pinecone_text}")
+
+    return "\n\n".join(labelled_texts)
+
+
+def _finalize_labelled_response(gpt_response: str, query: str)-> str:
+
+    """Maps an empty single-call response to the default 'no relevant answer' message."""
+
+    if gpt_response in EMPTY_GPT_RESPONSES:
+        return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+    return gpt_response
+
+
+def _get_candidate_query_vectors(search_query_dense_sparse: Dict)-> Tuple[List[float], Dict[str, List]]:
+
+    """Scales the query vectors evenly between dense and sparse, so the candidate set covers every alpha value."""
+
+    return hybrid_scale(search_query_dense_sparse.get("dense"),
+                        search_query_dense_sparse.get("sparse"),
+                        alpha = AlphaValues.MEDIUM.value
+                        )
+
+
+def _get_rescored_query_results(search_query_dense_sparse: Dict,
+                                alpha_values: List[float],
+                                pinecone_index_client
+                                )-> Dict[float, Dict]:
+
+    """Fetches CANDIDATE_POOL_SIZE candidates in one Pinecone query and re-ranks them for every alpha value."""
+
+    hdense, hsparse = _get_candidate_query_vectors(search_query_dense_sparse)
+    candidates: Dict = get_pinecone_query_result(pinecone_index_client, hdense, hsparse,
+                                                 num_results = CANDIDATE_POOL_SIZE,
+                                                 include_values = True
+                                                 )
+    return rescore_pinecone_candidates(candidates,
+                                       search_query_dense_sparse.get("dense"),
+                                       search_query_dense_sparse.get("sparse"),
+                                       alpha_values
+                                       )
+
+
+async def _get_rescored_query_results_async(search_query_dense_sparse: Dict,
+                                            alpha_values: List[float],
+                                            pinecone_index_client
+                                            )-> Dict[float, Dict]:
+
+    """Asynchronous version of _get_rescored_query_results."""
+
+    hdense, hsparse = _get_candidate_query_vectors(search_query_dense_sparse)
+    candidates: Dict = await get_pinecone_query_result_async(pinecone_index_client, hdense, hsparse,
+                                                             num_results = CANDIDATE_POOL_SIZE,
+                                                             include_values = True
+                                                             )
+    return rescore_pinecone_candidates(candidates,
+                                       search_query_dense_sparse.get("dense"),
+                                       search_query_dense_sparse.get("sparse"),
+                                       alpha_values
+                                       )
+
+
+def _parse_query_result(query_result: Dict)-> Tuple[List, List, List, List]:
+
+    pinecone_texts, text_pages = parse_texts_from_pinecone(query_result)
+    return pinecone_texts, text_pages, parse_match_ids_from_pinecone(query_result), parse_scores_from_pinecone(query_result)
+
+
+def _retrieve_pinecone_texts(search_query_dense_sparse: Dict,
+                             alpha_value: float,
+                             pinecone_index_client,
+                             rescored_query_results: Union[Dict[float, Dict], None] = None
+                             )-> Tuple[List, List, List, List]:
+
+    """
+    Returns the texts, page references, match ids and match scores retrieved for alpha_value, either from the locally re-ranked
+    results of RetrievalMode.SINGLE_ROUND_TRIP or by querying Pinecone with the query vectors scaled by alpha_value.
+    """
+
+    if rescored_query_results is not None:
+        return _parse_query_result(rescored_query_results[alpha_value])
+
+    hdense, hsparse = hybrid_scale(search_query_dense_sparse.get("dense"),
+                                 search_query_dense_sparse.get("sparse"),
+                                 alpha = alpha_value
+                                 )
+    query_result: Dict = get_pinecone_query_result(pinecone_index_client, hdense, hsparse)
+    return _parse_query_result(query_result)
+
+
+async def _retrieve_pinecone_texts_async(search_query_dense_sparse: Dict,
+                                         alpha_value: float,
+                                         pinecone_index_client,
+                                         rescored_query_results: Union[Dict[float, Dict], None] = None
+                                         )-> Tuple[List, List, List, List]:
+
+    """Asynchronous version of _retrieve_pinecone_texts."""
+
+    if rescored_query_results is not None:
+        return _parse_query_result(rescored_query_results[alpha_value])
+
+    hdense, hsparse = hybrid_scale(search_query_dense_sparse.get("dense"),
+                                 search_query_dense_sparse.get("sparse"),
+                                 alpha = alpha_value
+                                 )
+    query_result: Dict = await get_pinecone_query_result_async(pinecone_index_client, hdense, hsparse)
+    return _parse_query_result(query_result)
+
+
+def _retrieve_all_tiers(search_query_dense_sparse: Dict,
+                        alpha_values: List[float],
+                        pinecone_index_client,
+                        rescored_query_results: Union[Dict[float, Dict], None] = None
+                        )-> Dict[float, Tuple[List, List, List, List]]:
+
+    """Retrieves the texts of every alpha value up front, keyed by alpha value."""
+
+    return {alpha_value: _retrieve_pinecone_texts(search_query_dense_sparse, alpha_value, pinecone_index_client, rescored_query_results)
+            for alpha_value in alpha_values
+            }
+
+
+async def _retrieve_all_tiers_async(search_query_dense_sparse: Dict,
+                                    alpha_values: List[float],
+                                    pinecone_index_client,
+                                    rescored_query_results: Union[Dict[float, Dict], None] = None
+                                    )-> Dict[float, Tuple[List, List, List, List]]:
+
+    """Asynchronous version of _retrieve_all_tiers: the alpha values are retrieved concurrently."""
+
+    tier_results = await asyncio.gather(*[_retrieve_pinecone_texts_async(search_query_dense_sparse, alpha_value, pinecone_index_client,
+                                                                         rescored_query_results
+                                                                         )
+                                          for alpha_value in alpha_values
+                                          ])
+    return dict(zip(alpha_values, tier_results))
+
+
+def _apply_candidate_floor(retrieved: Tuple[List, List, List, List],
+                           score_thresholds: Union[ScoreThresholds, None],
+                           evaluated_passages: Union[EvaluatedPassages, None] = None
+                           )-> Tuple[List, List, List, List]:
+
+    """Drops the matches below the candidate floor of score_thresholds, counting them in evaluated_passages."""
+
+    if score_thresholds is None:
+        return retrieved
+
+    retrieved, below_floor = score_thresholds.apply_floor(retrieved)
+    if evaluated_passages is not None:
+        evaluated_passages.candidates_below_floor += below_floor
+    return retrieved
+
+
+def _all_tiers_weak(tier_results: Union[Dict[float, Tuple], None], score_thresholds: Union[ScoreThresholds, None])-> bool:
+
+    if tier_results is None or score_thresholds is None or not score_thresholds.all_tiers_weak(list(tier_results.values())):
+        return False
+
+    tracer.count("answered_without_gpt")
+    return True
+
+
+def get_gpt_response_from_pinecone_text(pinecone_text: str,
+                                        query: str,
+                                        openai_client: OpenAI,
+                                        abort_unanswerable: bool = False,
+                                        answer_format: AnswerFormat = AnswerFormat.SENTINEL,
+                                        match_id: Union[str, None] = None,
+                                        completion_cache: Union[CompletionCache, None] = None
+                                        )-> str:
+
     """
     Generates a response from GPT-4 based on a single piece of text retrieved from Pinecone and the user's query.
 
@@ -48,16 +740,74 @@ def get_gpt_response_from_pinecone_text(pinecone_text: str, query: str, openai_c
         pinecone_text (str): The text retrieved from Pinecone.
         query (str): The user's query to be answered.
         openai_client (OpenAI): An instance of the OpenAI client to interact with the API.
+        abort_unanswerable (bool): Whether to stream the completion and stop it as soon as it is the '' sentinel.
+            Defaults to False.
+        answer_format (AnswerFormat): Whether GPT answers with the '' sentinel or a JSON verdict. Defaults to AnswerFormat.SENTINEL.
+        match_id (Union[str, None]): The Pinecone id of the text, used as part of the completion cache key. Defaults to None.
+        completion_cache (Union[CompletionCache, None]): Cache of previous responses for the same query and text.
+            Defaults to None (no caching).
+
+    Returns:
+        str: The generated response from GPT-4.
+    """
+
+    if pinecone_text:
+        template: PromptTemplate = _get_answer_template(answer_format)
+        cache_key = _get_completion_cache_key(query, match_id, template, completion_cache)
+        cached_response = completion_cache.get(*cache_key) if cache_key else None
+        if cached_response is not None:
+            return cached_response
+
+        instruction = template.value.format(pinecone_text = pinecone_text, query = query)
+        gpt_response = _get_chatgpt_response_or_sentinel(instruction, openai_client, abort_unanswerable, answer_format)
+        if cache_key:
+            completion_cache.put(*cache_key, '' if gpt_response in EMPTY_GPT_RESPONSES else gpt_response)
+    else:
+        gpt_response = PromptTemplate.default_no_pinecone_text.value.format(query = query, pinecone_text = pinecone_text)
+
+    return gpt_response
+
+
+async def get_gpt_response_from_pinecone_text_async(pinecone_text: str,
+                                                    query: str,
+                                                    openai_client: AsyncOpenAI,
+                                                    abort_unanswerable: bool = False,
+                                                    answer_format: AnswerFormat = AnswerFormat.SENTINEL,
+                                                    match_id: Union[str, None] = None,
+                                                    completion_cache: Union[CompletionCache, None] = None
+                                                    )-> str:
+
+    """
+    Asynchronous version of get_gpt_response_from_pinecone_text.
+
+    Args:
+        pinecone_text (str): The text retrieved from Pinecone.
+        query (str): The user's query to be answered.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        abort_unanswerable (bool): Whether to stream the completion and stop it as soon as it is the '' sentinel.
+            Defaults to False.
+        answer_format (AnswerFormat): Whether GPT answers with the '' sentinel or a JSON verdict. Defaults to AnswerFormat.SENTINEL.
+        match_id (Union[str, None]): The Pinecone id of the text, used as part of the completion cache key. Defaults to None.
+        completion_cache (Union[CompletionCache, None]): Cache of previous responses for the same query and text.
+            Defaults to None (no caching).
 
     Returns:
         str: The generated response from GPT-4.
     """
-    
+
     if pinecone_text:
-        instruction = PromptTemplate.answer_from_first_text.value.format(pinecone_text = pinecone_text, query = query)
-        gpt_response = get_chatgpt_response(instruction, openai_client)
+        template: PromptTemplate = _get_answer_template(answer_format)
+        cache_key = _get_completion_cache_key(query, match_id, template, completion_cache)
+        cached_response = await asyncio.to_thread(completion_cache.get, *cache_key) if cache_key else None
+        if cached_response is not None:
+            return cached_response
+
+        instruction = template.value.format(pinecone_text = pinecone_text, query = query)
+        gpt_response = await _get_chatgpt_response_or_sentinel_async(instruction, openai_client, abort_unanswerable, answer_format)
+        if cache_key:
+            await asyncio.to_thread(completion_cache.put, *cache_key, '' if gpt_response in EMPTY_GPT_RESPONSES else gpt_response)
     else:
-        gpt_response = PromptTemplate.default_no_pinecone_text.value.format(query = query)
+        gpt_response = PromptTemplate.default_no_pinecone_text.value.format(query = query, pinecone_text = pinecone_text)
 
     return gpt_response
 
@@ -65,9 +815,14 @@ def get_gpt_response_from_pinecone_text(pinecone_text: str, query: str, openai_c
 def get_gpt_response_from_pinecone_texts(pinecone_texts: List,
                                          text_pages: List,
                                          query: str,
-                                         openai_client: OpenAI
+                                         openai_client: OpenAI,
+                                         abort_unanswerable: bool = False,
+                                         answer_format: AnswerFormat = AnswerFormat.SENTINEL,
+                                         match_ids: Union[List, None] = None,
+                                         evaluated_passages: Union[EvaluatedPassages, None] = None,
+                                         completion_cache: Union[CompletionCache, None] = None
                                          )-> str:
-    
+
     """
     Processes multiple texts from Pinecone, generating responses and appending page information when relevant.
 
@@ -76,30 +831,193 @@ def get_gpt_response_from_pinecone_texts(pinecone_texts: List,
         text_pages (List): A list of page numbers corresponding to the texts.
         query (str): The user's query to be answered.
         openai_client (OpenAI): An instance of the OpenAI client to interact with the API.
+        abort_unanswerable (bool): Whether to stop each completion as soon as it is the '' sentinel. Defaults to False.
+        answer_format (AnswerFormat): Whether GPT answers with the '' sentinel or a JSON verdict. Defaults to AnswerFormat.SENTINEL.
+        match_ids (Union[List, None]): The Pinecone ids of the texts. Defaults to None.
+        evaluated_passages (Union[EvaluatedPassages, None]): The matches already evaluated for this query. Texts whose
+            match id it holds are skipped. Defaults to None (every text is evaluated).
+        completion_cache (Union[CompletionCache, None]): Cache of previous responses, keyed with match_ids. Defaults to None.
 
     Returns:
         str: The generated response, or an indication that no relevant answer was found.
     """
-    
+
     if not pinecone_texts:
         return ""
-    
-    for idx, (pinecone_text, text_page) in enumerate(zip(pinecone_texts, text_pages)):
-        
+
+    gpt_response = ""
+    for idx, (pinecone_text, text_page, match_id) in enumerate(zip(pinecone_texts, text_pages, match_ids or [None] * len(pinecone_texts))):
+
+        if evaluated_passages is not None and not evaluated_passages.should_evaluate(match_id):
+            continue
+
         #print(f"Going through pinecone text {idx + 1}")
-        gpt_response = get_gpt_response_from_pinecone_text(pinecone_text, query, openai_client)
-        
+        gpt_response = get_gpt_response_from_pinecone_text(pinecone_text, query, openai_client, abort_unanswerable, answer_format,
+                                                           match_id, completion_cache
+                                                           )
+
         #print(f"{gpt_response = }")
-        if gpt_response not in ['',"'", '"', "", "''", '""'] and gpt_response != PromptTemplate.default_no_pinecone_text.value.format(query = query, pinecone_text = pinecone_text):
+        if not _is_unanswered(gpt_response, query, pinecone_text):
             gpt_response += f"\n\n{text_page}"
             return gpt_response
-      
-    if gpt_response in ['',"'", '"', "", "''", '""']:
-        gpt_response = PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
-        return gpt_response
 
-    else:
-        raise ValueError(f"Unexpected behavior detected in function: {get_gpt_response_from_pinecone_texts.__name__}()")
+    return _finalize_unanswered(gpt_response, query)
+
+
+async def get_gpt_response_from_pinecone_texts_async(pinecone_texts: List,
+                                                     text_pages: List,
+                                                     query: str,
+                                                     openai_client: AsyncOpenAI,
+                                                     concurrent: bool = False,
+                                                     abort_unanswerable: bool = False,
+                                                     answer_format: AnswerFormat = AnswerFormat.SENTINEL,
+                                                     match_ids: Union[List, None] = None,
+                                                     evaluated_passages: Union[EvaluatedPassages, None] = None,
+                                                     completion_cache: Union[CompletionCache, None] = None
+                                                     )-> str:
+
+    """
+    Asynchronous version of get_gpt_response_from_pinecone_texts.
+
+    With concurrent=True, every text is sent to GPT at once. The responses are still checked in Pinecone
+    rank order, so the first answer by rank wins, and the lower-ranked requests still running are
+    cancelled as soon as it is found. Worst-case latency becomes that of the slowest completion instead
+    of the sum of all of them.
+
+    Args:
+        pinecone_texts (List): A list of texts retrieved from Pinecone.
+        text_pages (List): A list of page numbers corresponding to the texts.
+        query (str): The user's query to be answered.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        concurrent (bool): Whether to evaluate the texts concurrently. Defaults to False.
+        abort_unanswerable (bool): Whether to stop each completion as soon as it is the '' sentinel. Defaults to False.
+        answer_format (AnswerFormat): Whether GPT answers with the '' sentinel or a JSON verdict. Defaults to AnswerFormat.SENTINEL.
+        match_ids (Union[List, None]): The Pinecone ids of the texts. Defaults to None.
+        evaluated_passages (Union[EvaluatedPassages, None]): The matches already evaluated for this query. Texts whose
+            match id it holds are skipped. Defaults to None (every text is evaluated).
+        completion_cache (Union[CompletionCache, None]): Cache of previous responses, keyed with match_ids. Defaults to None.
+
+    Returns:
+        str: The generated response, or an indication that no relevant answer was found.
+    """
+
+    if not pinecone_texts:
+        return ""
+
+    gpt_response = ""
+    match_ids = match_ids or [None] * len(pinecone_texts)
+
+    if not concurrent:
+        for pinecone_text, text_page, match_id in zip(pinecone_texts, text_pages, match_ids):
+            if evaluated_passages is not None and not evaluated_passages.should_evaluate(match_id):
+                continue
+
+            gpt_response = await get_gpt_response_from_pinecone_text_async(pinecone_text, query, openai_client, abort_unanswerable, answer_format,
+                                                                           match_id, completion_cache
+                                                                           )
+
+            if not _is_unanswered(gpt_response, query, pinecone_text):
+                gpt_response += f"\n\n{text_page}"
+                return gpt_response
+
+        return _finalize_unanswered(gpt_response, query)
+
+    if evaluated_passages is not None:
+        new_passages = [(pinecone_text, text_page, match_id) for pinecone_text, text_page, match_id in zip(pinecone_texts, text_pages, match_ids)
+                        if evaluated_passages.should_evaluate(match_id)
+                        ]
+        pinecone_texts = [pinecone_text for pinecone_text, _, _ in new_passages]
+        text_pages = [text_page for _, text_page, _ in new_passages]
+        match_ids = [match_id for _, _, match_id in new_passages]
+
+    tasks: List[asyncio.Task] = [asyncio.create_task(get_gpt_response_from_pinecone_text_async(pinecone_text, query, openai_client,
+                                                                                               abort_unanswerable, answer_format,
+                                                                                               match_id, completion_cache
+                                                                                               ))
+                                 for pinecone_text, match_id in zip(pinecone_texts, match_ids)
+                                 ]
+    try:
+        for task, pinecone_text, text_page in zip(tasks, pinecone_texts, text_pages):
+            gpt_response = await task
+
+            if not _is_unanswered(gpt_response, query, pinecone_text):
+                gpt_response += f"\n\n{text_page}"
+                return gpt_response
+    finally:
+        # Lower-ranked completions are no longer needed once an answer (or an error) is found
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    return _finalize_unanswered(gpt_response, query)
+
+
+
+def get_gpt_response_from_labelled_pinecone_texts(pinecone_texts: List,
+                                                  text_pages: List,
+                                                  query: str,
+                                                  openai_client: OpenAI,
+                                                  abort_unanswerable: bool = False,
+                                                  answer_format: AnswerFormat = AnswerFormat.SENTINEL
+                                                  )-> str:
+
+    """
+    Answers the query from all retrieved texts in a single GPT call.
+
+    The texts are deduplicated and labelled with their page references, and the model is asked to cite
+    the references it used, so no page reference is appended afterwards.
+
+    Args:
+        pinecone_texts (List): The texts retrieved from Pinecone, best-ranked first.
+        text_pages (List): The page references corresponding to the texts.
+        query (str): The user's query to be answered.
+        openai_client (OpenAI): An instance of the OpenAI client to interact with the API.
+        abort_unanswerable (bool): Whether to stop the completion as soon as it is the '' sentinel. Defaults to False.
+        answer_format (AnswerFormat): Whether GPT answers with the '' sentinel or a JSON verdict. Defaults to AnswerFormat.SENTINEL.
+
+    Returns:
+        str: The generated, cited response, or an indication that no relevant answer was found.
+    """
+
+    labelled_pinecone_texts: str = _label_pinecone_texts(pinecone_texts, text_pages)
+    if not labelled_pinecone_texts:
+        return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+    instruction = _get_answer_template(answer_format, multiple_texts = True).value.format(labelled_pinecone_texts = labelled_pinecone_texts, query = query)
+    gpt_response: str = _get_chatgpt_response_or_sentinel(instruction, openai_client, abort_unanswerable, answer_format)
+    return _finalize_labelled_response(gpt_response, query)
+
+
+async def get_gpt_response_from_labelled_pinecone_texts_async(pinecone_texts: List,
+                                                              text_pages: List,
+                                                              query: str,
+                                                              openai_client: AsyncOpenAI,
+                                                              abort_unanswerable: bool = False,
+                                                              answer_format: AnswerFormat = AnswerFormat.SENTINEL
+                                                              )-> str:
+
+    """
+    Asynchronous version of get_gpt_response_from_labelled_pinecone_texts.
+
+    Args:
+        pinecone_texts (List): The texts retrieved from Pinecone, best-ranked first.
+        text_pages (List): The page references corresponding to the texts.
+        query (str): The user's query to be answered.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        abort_unanswerable (bool): Whether to stop the completion as soon as it is the '' sentinel. Defaults to False.
+        answer_format (AnswerFormat): Whether GPT answers with the '' sentinel or a JSON verdict. Defaults to AnswerFormat.SENTINEL.
+
+    Returns:
+        str: The generated, cited response, or an indication that no relevant answer was found.
+    """
+
+    labelled_pinecone_texts: str = _label_pinecone_texts(pinecone_texts, text_pages)
+    if not labelled_pinecone_texts:
+        return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+    instruction = _get_answer_template(answer_format, multiple_texts = True).value.format(labelled_pinecone_texts = labelled_pinecone_texts, query = query)
+    gpt_response: str = await _get_chatgpt_response_or_sentinel_async(instruction, openai_client, abort_unanswerable, answer_format)
+    return _finalize_labelled_response(gpt_response, query)
 
 
 
@@ -108,8 +1026,10 @@ def process_query(query: str,
                   pinecone_index_client,
                   openai_client: OpenAI,
                   vectorizer: TfidfVectorizer,
+                  options: Union[QueryOptions, None] = None,
+                  search_query_dense_sparse: Union[Dict, None] = None
                   )-> str:
-    
+
     """
     Takes a user query, retrieves relevant texts from Pinecone, and generates an appropriate response using OpenAI's API.
 
@@ -118,47 +1038,424 @@ def process_query(query: str,
         pinecone_index_client: The Pinecone index client to perform queries.
         openai_client (OpenAI): An instance of the OpenAI client to interact with the API.
         vectorizer (TfidfVectorizer): The vectorizer used to transform the query into vector representations.
+        options (Union[QueryOptions, None]): The pipeline settings. Defaults to None, in which case QueryOptions() is used.
+        search_query_dense_sparse (Union[Dict, None]): The query's dense and sparse vectors, if the caller has already
+            computed them. Defaults to None, in which case they are computed here.
 
     Returns:
         str: The generated response based on the user's query and relevant texts from Pinecone.
     """
-    
-    search_query_dense_sparse: Dict = convert_string_query_to_vectors(query, openai_client, vectorizer)
+
+    options = options or QueryOptions()
+
+    if search_query_dense_sparse is None:
+        search_query_dense_sparse = convert_string_query_to_vectors(query, openai_client, vectorizer,
+                                                                    embedding_cache = options.embedding_cache
+                                                                    )
     #print(f"{search_query_dense_sparse = }")
 
-    possible_alpha_values: List[float] = [AlphaValues.HIGH.value,
-                                         AlphaValues.MEDIUM.value,
-                                         AlphaValues.LOW.value
-                                         ]
-   
+    possible_alpha_values: List[float] = _get_alpha_values(query, options.query_analyzer)
+
+    rescored_query_results: Union[Dict[float, Dict], None] = None
+    if options.retrieval_mode == RetrievalMode.SINGLE_ROUND_TRIP:
+        rescored_query_results = _get_rescored_query_results(search_query_dense_sparse, possible_alpha_values, pinecone_index_client)
+
+    tier_results: Union[Dict[float, Tuple], None] = None
+    if options.answering_strategy == AnsweringStrategy.SINGLE_CALL or (options.score_thresholds is not None and options.score_thresholds.needs_all_tiers):
+        tier_results = _retrieve_all_tiers(search_query_dense_sparse, possible_alpha_values, pinecone_index_client, rescored_query_results)
+        if _all_tiers_weak(tier_results, options.score_thresholds):
+            return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+    if options.answering_strategy == AnsweringStrategy.SINGLE_CALL:
+        all_pinecone_texts, all_text_pages = [], []
+        for alpha_value in possible_alpha_values:
+            pinecone_texts, text_pages, _, _ = _apply_candidate_floor(tier_results[alpha_value], options.score_thresholds)
+            all_pinecone_texts.extend(pinecone_texts)
+            all_text_pages.extend(text_pages)
+
+        return get_gpt_response_from_labelled_pinecone_texts(all_pinecone_texts, all_text_pages, query, openai_client,
+                                                             options.abort_unanswerable, options.answer_format
+                                                             )
+
+    evaluated_passages = EvaluatedPassages()
     for alpha_value in possible_alpha_values:
-        
-        print(f"{alpha_value = }")
-        hdense, hsparse = hybrid_scale(search_query_dense_sparse.get("dense"),
-                                     search_query_dense_sparse.get("sparse"),
-                                     alpha = alpha_value
-                                     )
-        #print(f"{len(hdense) = }\n{len(hsparse) = }")
-      
-        query_result: Dict = get_pinecone_query_result(pinecone_index_client, hdense, hsparse)
-        #print(f"{query_result = }")
 
+        retrieved: Tuple[List, List, List, List] = (tier_results[alpha_value] if tier_results is not None
+                                                    else _retrieve_pinecone_texts(search_query_dense_sparse, alpha_value, pinecone_index_client,
+                                                                                  rescored_query_results
+                                                                                  ))
         pinecone_texts: List
         text_pages: List
-        pinecone_texts, text_pages = parse_texts_from_pinecone(query_result)
+        pinecone_texts, text_pages, match_ids, _ = _apply_candidate_floor(retrieved, options.score_thresholds, evaluated_passages)
         #print(f"{pinecone_texts = }")
 
-        answer: str = get_gpt_response_from_pinecone_texts(pinecone_texts, text_pages, query, openai_client)
+        answer: str = get_gpt_response_from_pinecone_texts(pinecone_texts, text_pages, query, openai_client, options.abort_unanswerable,
+                                                           options.answer_format, match_ids, evaluated_passages, options.completion_cache
+                                                           )
         #print(f"{answer = }")
 
-        if answer in ['', "", "''", '""'] or answer == PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query):
-            continue
+        if not _is_irrelevant_answer(answer, query):
+            evaluated_passages.report(options.passage_counters)
+            return answer
 
-        else:
+        if options.score_thresholds is not None and options.score_thresholds.has_strong_hit(retrieved[3]):
+            tracer.count("alpha_sweep_stopped_early")
+            break
+
+    evaluated_passages.report(options.passage_counters)
+    if _is_irrelevant_answer(answer, query):
+        return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+    else:
+        raise ValueError(f"Answer returned an unknown value.\n{answer = }")
+
+
+async def process_query_async(query: str,
+                              pinecone_index_client,
+                              openai_client: AsyncOpenAI,
+                              vectorizer: TfidfVectorizer,
+                              options: Union[QueryOptions, None] = None,
+                              search_query_dense_sparse: Union[Dict, None] = None
+                              )-> str:
+
+    """
+    Asynchronous version of process_query. The OpenAI calls use AsyncOpenAI and the Pinecone queries run
+    in worker threads, so other updates keep being served while this query waits on the network.
+
+    Args:
+        query (str): The user's query.
+        pinecone_index_client: The Pinecone index client to perform queries.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        vectorizer (TfidfVectorizer): The vectorizer used to transform the query into vector representations.
+        options (Union[QueryOptions, None]): The pipeline settings. Defaults to None, in which case QueryOptions() is used.
+        search_query_dense_sparse (Union[Dict, None]): The query's dense and sparse vectors, if the caller has already
+            computed them. Defaults to None, in which case they are computed here.
+
+    Returns:
+        str: The generated response based on the user's query and relevant texts from Pinecone.
+    """
+
+    options = options or QueryOptions()
+
+    if search_query_dense_sparse is None:
+        search_query_dense_sparse = await convert_string_query_to_vectors_async(query, openai_client, vectorizer,
+                                                                                embedding_cache = options.embedding_cache
+                                                                                )
+
+    possible_alpha_values: List[float] = _get_alpha_values(query, options.query_analyzer)
+
+    rescored_query_results: Union[Dict[float, Dict], None] = None
+    if options.retrieval_mode == RetrievalMode.SINGLE_ROUND_TRIP:
+        rescored_query_results = await _get_rescored_query_results_async(search_query_dense_sparse, possible_alpha_values, pinecone_index_client)
+
+    tier_results: Union[Dict[float, Tuple], None] = None
+    if options.answering_strategy == AnsweringStrategy.SINGLE_CALL or (options.score_thresholds is not None and options.score_thresholds.needs_all_tiers):
+        tier_results = await _retrieve_all_tiers_async(search_query_dense_sparse, possible_alpha_values, pinecone_index_client,
+                                                       rescored_query_results
+                                                       )
+        if _all_tiers_weak(tier_results, options.score_thresholds):
+            return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+
+    if options.answering_strategy == AnsweringStrategy.SINGLE_CALL:
+        floored_tiers = [_apply_candidate_floor(tier_results[alpha_value], options.score_thresholds) for alpha_value in possible_alpha_values]
+        all_pinecone_texts = [text for pinecone_texts, _, _, _ in floored_tiers for text in pinecone_texts]
+        all_text_pages = [page for _, text_pages, _, _ in floored_tiers for page in text_pages]
+
+        return await get_gpt_response_from_labelled_pinecone_texts_async(all_pinecone_texts, all_text_pages, query, openai_client,
+                                                                         options.abort_unanswerable, options.answer_format
+                                                                         )
+
+    evaluated_passages = EvaluatedPassages()
+    for alpha_value in possible_alpha_values:
+
+        retrieved: Tuple[List, List, List, List] = (tier_results[alpha_value] if tier_results is not None
+                                                    else await _retrieve_pinecone_texts_async(search_query_dense_sparse, alpha_value,
+                                                                                              pinecone_index_client, rescored_query_results
+                                                                                              ))
+        pinecone_texts: List
+        text_pages: List
+        pinecone_texts, text_pages, match_ids, _ = _apply_candidate_floor(retrieved, options.score_thresholds, evaluated_passages)
+
+        answer: str = await get_gpt_response_from_pinecone_texts_async(pinecone_texts, text_pages, query, openai_client,
+                                                                       concurrent = options.concurrent_candidates,
+                                                                       abort_unanswerable = options.abort_unanswerable,
+                                                                       answer_format = options.answer_format,
+                                                                       match_ids = match_ids,
+                                                                       evaluated_passages = evaluated_passages,
+                                                                       completion_cache = options.completion_cache
+                                                                       )
+
+        if not _is_irrelevant_answer(answer, query):
+            evaluated_passages.report(options.passage_counters)
             return answer
 
-    if answer in ['', "", "''", '""'] or answer == PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query):
+        if options.score_thresholds is not None and options.score_thresholds.has_strong_hit(retrieved[3]):
+            tracer.count("alpha_sweep_stopped_early")
+            break
+
+    evaluated_passages.report(options.passage_counters)
+    if _is_irrelevant_answer(answer, query):
         return PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
 
     else:
         raise ValueError(f"Answer returned an unknown value.\n{answer = }")
+
+
+
+async def _stream_unless_sentinel(instruction: str, openai_client: AsyncOpenAI, abort_unanswerable: bool = False)-> AsyncIterator[str]:
+
+    """
+    Streams GPT's response to an instruction, holding back the first deltas until the response can no longer be
+    the empty-string sentinel. Yields nothing at all if the complete response is a sentinel. With abort_unanswerable,
+    the generation is stopped as soon as the response reads as a complete sentinel.
+    """
+
+    buffered_response = ""
+    deltas = stream_chatgpt_response_async(instruction, openai_client)
+    try:
+        async for delta in deltas:
+            if buffered_response is None:
+                yield delta
+                continue
+
+            buffered_response += delta
+            if abort_unanswerable and buffered_response.strip() in CLOSED_GPT_SENTINELS:
+                return
+            if not _could_be_sentinel(buffered_response):
+                yield buffered_response
+                buffered_response = None
+    finally:
+        await deltas.aclose()
+
+    if buffered_response and buffered_response not in EMPTY_GPT_RESPONSES:
+        yield buffered_response
+
+
+def _decode_json_string_prefix(raw_response: str, position: int)-> Tuple[str, int, bool]:
+
+    """
+    Decodes the part of a JSON string received so far, starting after its opening quote.
+
+    Returns:
+        Tuple[str, int, bool]: The decoded characters, the position to resume from (an escape sequence cut by the
+        end of raw_response is left for the next call), and whether the closing quote was reached.
+    """
+
+    decoded = []
+    while position < len(raw_response):
+        character = raw_response[position]
+        if character == '"':
+            return "".join(decoded), position + 1, True
+        if character != "\\":
+            decoded.append(character)
+            position += 1
+            continue
+
+        if position + 1 >= len(raw_response):
+            break
+        escape = raw_response[position + 1]
+        if escape == "u":
+            if position + 6 > len(raw_response):
+                break
+            code_point = int(raw_response[position + 2:position + 6], 16)
+            if 0xD800 <= code_point < 0xDC00:
+                # A high surrogate is decoded together with the low surrogate escape that follows it
+                if position + 12 > len(raw_response):
+                    break
+                code_point = 0x10000 + ((code_point - 0xD800) << 10) + (int(raw_response[position + 8:position + 12], 16) - 0xDC00)
+                position += 6
+            decoded.append(chr(code_point))
+            position += 6
+        else:
+            decoded.append(JSON_STRING_ESCAPES.get(escape, escape))
+            position += 2
+
+    return "".join(decoded), position, False
+
+
+async def _stream_json_verdict(instruction: str, openai_client: AsyncOpenAI, abort_unanswerable: bool = False)-> AsyncIterator[str]:
+
+    """
+    Streams the answer of a JSON verdict response (AnswerFormat.JSON_VERDICT) as it is generated.
+
+    The response is buffered until its verdict has been parsed. A not_found verdict yields nothing (and, with
+    abort_unanswerable, stops the generation); otherwise the "answer" string is decoded and yielded as it arrives,
+    followed by the inconclusive statement for an inconclusive verdict. A response that never shows a verdict is
+    read at the end like parse_verdict reads it (so a malformed one yields nothing).
+    """
+
+    raw_response = ""
+    verdict: Union[Verdict, None] = None
+    answer_position: Union[int, None] = None
+    answer_closed = False
+    answer = ""
+
+    deltas = stream_chatgpt_response_async(instruction, openai_client, json_output = True)
+    try:
+        async for delta in deltas:
+            raw_response += delta
+
+            if verdict is None:
+                verdict_match = VERDICT_PATTERN.search(raw_response)
+                if verdict_match is None:
+                    continue
+                try:
+                    verdict = Verdict(verdict_match.group(1))
+                except ValueError:
+                    verdict = Verdict.NOT_FOUND
+                if verdict == Verdict.NOT_FOUND and abort_unanswerable:
+                    return
+
+            if verdict == Verdict.NOT_FOUND or answer_closed:
+                continue
+
+            if answer_position is None:
+                answer_match = ANSWER_START_PATTERN.search(raw_response)
+                if answer_match is None:
+                    continue
+                answer_position = answer_match.end()
+
+            answer_piece, answer_position, answer_closed = _decode_json_string_prefix(raw_response, answer_position)
+            if not answer and answer_piece:
+                answer_piece = answer_piece.lstrip()
+            if answer_piece:
+                answer += answer_piece
+                yield answer_piece
+    finally:
+        await deltas.aclose()
+
+    if verdict is None:
+        fallback_response: str = _verdict_to_response(raw_response)
+        if fallback_response:
+            yield fallback_response
+    elif verdict == Verdict.INCONCLUSIVE and answer and not answer.rstrip().endswith(INCONCLUSIVE_STATEMENT):
+        yield f"\n{INCONCLUSIVE_STATEMENT}"
+
+
+def _stream_answer(instruction: str, openai_client: AsyncOpenAI, abort_unanswerable: bool, answer_format: AnswerFormat)-> AsyncIterator[str]:
+
+    """Streams the answer to an instruction in the given answer_format, yielding nothing when the text does not answer."""
+
+    if answer_format == AnswerFormat.JSON_VERDICT:
+        return _stream_json_verdict(instruction, openai_client, abort_unanswerable)
+    return _stream_unless_sentinel(instruction, openai_client, abort_unanswerable)
+
+
+
+async def stream_query_async(query: str,
+                             pinecone_index_client,
+                             openai_client: AsyncOpenAI,
+                             vectorizer: TfidfVectorizer,
+                             options: Union[QueryOptions, None] = None,
+                             search_query_dense_sparse: Union[Dict, None] = None
+                             )-> AsyncIterator[str]:
+
+    """
+    Streaming version of process_query_async: yields the final answer in pieces while GPT generates it.
+
+    The Pinecone texts and alpha values are tried in the same order as process_query. A response is only
+    passed on once it can no longer be the empty-string sentinel, so a passage that does not answer the query
+    never reaches the user and the next passage is tried instead. The page reference of the answering passage
+    is yielded last. Passages are evaluated one after the other (options.concurrent_candidates does not apply).
+    With AnswerFormat.JSON_VERDICT, each response is held back until its verdict is known, and only the decoded
+    answer of an answered or inconclusive verdict is passed on.
+
+    Args:
+        query (str): The user's query.
+        pinecone_index_client: The Pinecone index client to perform queries.
+        openai_client (AsyncOpenAI): An instance of the asynchronous OpenAI client.
+        vectorizer (TfidfVectorizer): The vectorizer used to transform the query into vector representations.
+        options (Union[QueryOptions, None]): The pipeline settings. Defaults to None, in which case QueryOptions() is used.
+        search_query_dense_sparse (Union[Dict, None]): The query's dense and sparse vectors, if the caller has already
+            computed them. Defaults to None, in which case they are computed here.
+
+    Yields:
+        str: Successive pieces of the answer. Joined, they equal the answer process_query_async would return
+        (apart from the wording GPT chooses), or the default 'no relevant answer' message.
+    """
+
+    options = options or QueryOptions()
+
+    if search_query_dense_sparse is None:
+        search_query_dense_sparse = await convert_string_query_to_vectors_async(query, openai_client, vectorizer,
+                                                                                embedding_cache = options.embedding_cache
+                                                                                )
+
+    possible_alpha_values: List[float] = _get_alpha_values(query, options.query_analyzer)
+
+    rescored_query_results: Union[Dict[float, Dict], None] = None
+    if options.retrieval_mode == RetrievalMode.SINGLE_ROUND_TRIP:
+        rescored_query_results = await _get_rescored_query_results_async(search_query_dense_sparse, possible_alpha_values, pinecone_index_client)
+
+    tier_results: Union[Dict[float, Tuple], None] = None
+    if options.answering_strategy == AnsweringStrategy.SINGLE_CALL or (options.score_thresholds is not None and options.score_thresholds.needs_all_tiers):
+        tier_results = await _retrieve_all_tiers_async(search_query_dense_sparse, possible_alpha_values, pinecone_index_client,
+                                                       rescored_query_results
+                                                       )
+        if _all_tiers_weak(tier_results, options.score_thresholds):
+            yield PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+            return
+
+    if options.answering_strategy == AnsweringStrategy.SINGLE_CALL:
+        floored_tiers = [_apply_candidate_floor(tier_results[alpha_value], options.score_thresholds) for alpha_value in possible_alpha_values]
+        labelled_pinecone_texts: str = _label_pinecone_texts([text for pinecone_texts, _, _, _ in floored_tiers for text in pinecone_texts],
+                                                             [page for _, text_pages, _, _ in floored_tiers for page in text_pages]
+                                                             )
+        if labelled_pinecone_texts:
+            instruction = _get_answer_template(options.answer_format, multiple_texts = True).value.format(labelled_pinecone_texts = labelled_pinecone_texts,
+                                                                                                          query = query
+                                                                                                          )
+            answered = False
+            async for delta in _stream_answer(instruction, openai_client, options.abort_unanswerable, options.answer_format):
+                answered = True
+                yield delta
+            if answered:
+                return
+
+        yield PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
+        return
+
+    evaluated_passages = EvaluatedPassages()
+    for alpha_value in possible_alpha_values:
+
+        retrieved: Tuple[List, List, List, List] = (tier_results[alpha_value] if tier_results is not None
+                                                    else await _retrieve_pinecone_texts_async(search_query_dense_sparse, alpha_value,
+                                                                                              pinecone_index_client, rescored_query_results
+                                                                                              ))
+        pinecone_texts, text_pages, match_ids, _ = _apply_candidate_floor(retrieved, options.score_thresholds, evaluated_passages)
+
+        for pinecone_text, text_page, match_id in zip(pinecone_texts, text_pages, match_ids):
+            if not pinecone_text or not evaluated_passages.should_evaluate(match_id):
+                continue
+
+            template: PromptTemplate = _get_answer_template(options.answer_format)
+            cache_key = _get_completion_cache_key(query, match_id, template, options.completion_cache)
+            cached_response = await asyncio.to_thread(options.completion_cache.get, *cache_key) if cache_key else None
+            if cached_response is not None:
+                if _is_unanswered(cached_response, query, pinecone_text):
+                    continue
+                evaluated_passages.report(options.passage_counters)
+                yield f"{cached_response}\n\n{text_page}"
+                return
+
+            instruction = template.value.format(pinecone_text = pinecone_text, query = query)
+            answer_pieces = []
+            async for delta in _stream_answer(instruction, openai_client, options.abort_unanswerable, options.answer_format):
+                answer_pieces.append(delta)
+                yield delta
+
+            answered = bool(answer_pieces)
+            if cache_key:
+                await asyncio.to_thread(options.completion_cache.put, *cache_key, "".join(answer_pieces))
+
+            if answered:
+                evaluated_passages.report(options.passage_counters)
+                yield f"\n\n{text_page}"
+                return
+
+        if options.score_thresholds is not None and options.score_thresholds.has_strong_hit(retrieved[3]):
+            tracer.count("alpha_sweep_stopped_early")
+            break
+
+    evaluated_passages.report(options.passage_counters)
+    yield PromptTemplate.default_pinecone_text_irrelevant.value.format(query = query)
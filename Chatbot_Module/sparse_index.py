@@ -0,0 +1,148 @@
+
+"""
+sparse_index.py
+
+This module scores the sparse (TF-IDF) half of a hybrid query locally with an inverted index over the chapter_texts postings. Queries are scored term-at-a-time, highest-impact term first, with MaxScore-style pruning: once the remaining query terms can no longer lift an unseen document into the top-k, only the documents that can still make it are updated. The top-k stays exact while most postings of common terms are skipped.
+
+Usage:
+    sparse_index = SparseInvertedIndex(vectorizer.transform(chapter_texts))
+    doc_ids, scores = sparse_index.search(query_indices, query_values, top_k = 3)
+
+    LocalHybridIndex uses it for sparse-only (alpha = 0.0) queries, and benchmarks.py uses it for offline evaluation.
+
+Main Classes:
+- SparseInvertedIndex: Term-at-a-time inverted index with MaxScore top-k pruning and posting counters.
+"""
+
+
+from auxiliaries import List, Dict, Tuple, Union, np
+from scipy.sparse import csr_matrix
+
+
+
+class SparseInvertedIndex:
+
+    """
+    An inverted index over sparse document vectors, scored by dot product.
+
+    The postings of each term are the CSC column of the document matrix: the ids of the documents containing
+    the term and their weights. The largest weight of each term is kept as its score upper bound.
+    """
+
+    def __init__(self, sparse_matrix: csr_matrix):
+
+        """
+        Initializes the SparseInvertedIndex instance.
+
+        Args:
+            sparse_matrix (csr_matrix): The n x V document-term matrix (e.g. the TF-IDF vectors of chapter_texts).
+        """
+
+        postings = csr_matrix(sparse_matrix, dtype = np.float32).tocsc()
+        postings.sort_indices()
+
+        self.num_documents, self.vocabulary_size = postings.shape
+        self.posting_pointers: np.ndarray = postings.indptr
+        self.posting_documents: np.ndarray = postings.indices
+        self.posting_weights: np.ndarray = postings.data
+
+        posting_lengths = np.diff(self.posting_pointers)
+        self.term_max_weights = np.zeros(self.vocabulary_size, dtype = np.float32)
+        non_empty_terms = posting_lengths > 0
+        self.term_max_weights[non_empty_terms] = np.maximum.reduceat(self.posting_weights,
+                                                                     self.posting_pointers[:-1][non_empty_terms]
+                                                                     )
+
+        self.counters: Dict[str, int] = {"queries": 0, "postings_total": 0, "postings_scored": 0}
+
+
+    def _postings(self, term: int)-> Tuple[np.ndarray, np.ndarray]:
+
+        start, end = self.posting_pointers[term], self.posting_pointers[term + 1]
+        return self.posting_documents[start:end], self.posting_weights[start:end]
+
+
+    def search(self,
+               query_indices: Union[List[int], np.ndarray],
+               query_values: Union[List[float], np.ndarray],
+               top_k: int = 3,
+               prune: bool = True
+               )-> Tuple[np.ndarray, np.ndarray]:
+
+        """
+        Finds the top_k documents by sparse dot product with the query.
+
+        Args:
+            query_indices (Union[List[int], np.ndarray]): The vocabulary indices of the query terms.
+            query_values (Union[List[float], np.ndarray]): The (alpha-scaled) weights of the query terms.
+            top_k (int): Number of documents to return. Defaults to 3.
+            prune (bool): Whether to apply MaxScore pruning. With prune=False every posting is scored. Defaults to True.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The document ids and scores, best first. Only documents sharing at least
+            one term with the query are returned.
+        """
+
+        query_indices = np.asarray(query_indices, dtype = np.int64)
+        query_values = np.asarray(query_values, dtype = np.float32)
+        keep = (query_values > 0) & (query_indices < self.vocabulary_size)
+        query_indices, query_values = query_indices[keep], query_values[keep]
+
+        upper_bounds = query_values * self.term_max_weights[query_indices]
+        order = np.argsort(-upper_bounds, kind = "stable")
+        query_indices, query_values, upper_bounds = query_indices[order], query_values[order], upper_bounds[order]
+        remaining_bounds = np.concatenate([np.cumsum(upper_bounds[::-1])[::-1][1:], [0.0]])
+
+        scores = np.zeros(self.num_documents, dtype = np.float32)
+        seen = np.zeros(self.num_documents, dtype = bool)
+        candidates: Union[np.ndarray, None] = None
+
+        self.counters["queries"] += 1
+        for term, weight, remaining_bound in zip(query_indices, query_values, remaining_bounds):
+            documents, document_weights = self._postings(term)
+            self.counters["postings_total"] += documents.size
+
+            if candidates is not None:
+                # Continue mode: only documents that can still reach the top-k are updated
+                keep = candidates[documents]
+                documents, document_weights = documents[keep], document_weights[keep]
+
+            scores[documents] += weight * document_weights
+            seen[documents] = True
+            self.counters["postings_scored"] += documents.size
+
+            if prune and candidates is None and np.count_nonzero(seen) >= top_k:
+                threshold = np.partition(scores[seen], -top_k)[-top_k]
+                if remaining_bound < threshold:
+                    # Documents not seen yet score at most remaining_bound, so they cannot enter the top-k
+                    candidates = seen & (scores + remaining_bound >= threshold)
+
+            if prune and candidates is not None:
+                threshold = np.partition(scores[seen], -top_k)[-top_k]
+                candidates &= scores + remaining_bound >= threshold
+
+        matched = np.flatnonzero(seen)
+        top = min(top_k, matched.size)
+        if top == 0:
+            return np.empty(0, dtype = np.int64), np.empty(0, dtype = np.float32)
+
+        best = matched[np.argpartition(-scores[matched], top - 1)[:top]]
+        best = best[np.argsort(-scores[best], kind = "stable")]
+        return best, scores[best]
+
+
+    def search_csr(self, sparse_query: csr_matrix, top_k: int = 3, prune: bool = True)-> Tuple[np.ndarray, np.ndarray]:
+
+        """
+        Same as search, for a query given as a 1 x V CSR matrix (e.g. the output of vectorizer.transform).
+
+        Args:
+            sparse_query (csr_matrix): The (alpha-scaled) sparse query vector.
+            top_k (int): Number of documents to return. Defaults to 3.
+            prune (bool): Whether to apply MaxScore pruning. Defaults to True.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The document ids and scores, best first.
+        """
+
+        return self.search(sparse_query.indices, sparse_query.data, top_k, prune)
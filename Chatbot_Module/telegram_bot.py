@@ -1,51 +1,260 @@
+"""
+telegram_bot.py
+
+This module serves the chatbot behind a FastAPI webhook. Telegram retries webhooks that answer slowly, so the /webhook route only puts the update on a bounded queue and returns 200 at once. A fixed pool of async workers takes updates off the queue, answers them with the warm ChatbotRuntime (retrieval and generation) and delivers the replies through one pooled httpx client. When the queue is full, new updates are shed with a short "busy" reply instead of piling up; at most WEBHOOK_BUSY_REPLIES of these replies are in flight, and updates shed beyond that get none.
+
+Usage:
+    uvicorn telegram_bot:app --host 0.0.0.0 --port 8443
+
+    Then point the Telegram webhook at https://<host>/webhook. GET /metrics returns the queue depth, the counters
+    and (with TRACING=true) the stage latencies in the Prometheus text format.
+
+Main Classes:
+- UpdateWorkerPool: Bounded update queue with async workers, queue-depth metrics and load shedding.
+"""
+
+
+import asyncio
+import contextlib
+
+import httpx
 from fastapi import FastAPI, Request
-import openai
-import requests
+from fastapi.responses import PlainTextResponse
 
+from auxiliaries import List, Dict, Any, Union, os, load_dotenv
+from answer_query import get_chatbot_response_async
+from chatbot_runtime import ChatbotRuntime
+from activate_telegram_bot import build_runtime, TRACING
+from tracing import tracer
 
 
-# Initialize FastAPI app
-app = FastAPI()
-
-# Set OpenAI API key (replace with your actual key)
-openai.api_key = "your-openai-api-key"
-
-# Set Telegram bot token
-TELEGRAM_TOKEN = "your-telegram-bot-token"
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
-
-# Function to generate LLM response
-def get_llm_response(prompt: str):
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=prompt,
-        max_tokens=150
-    )
-    return response.choices[0].text.strip()
-
-# Function to send a message to Telegram
-def send_message(chat_id: int, text: str):
-    url = f"{TELEGRAM_API_URL}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text
-    }
-    requests.post(url, json=payload)
-
-# Route to receive Telegram updates (webhook)
-@app.post("/webhook")
-async def telegram_webhook(request: Request):
-    data = await request.json()
 
-    # Extract chat ID and message text from the request
-    chat_id = data["message"]["chat"]["id"]
-    user_message = data["message"]["text"]
+# Load environment variables from .env file
+load_dotenv()
+
+# Set Telegram bot token, and the Bot API server (overridden to point the replies at a local stand-in)
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_API_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_TOKEN}"
+
+# Number of updates answered at the same time, and number of updates allowed to wait for a worker
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "256"))
+
+# Number of "busy" replies sent at the same time, so that shedding load does not create unbounded outbound requests
+WEBHOOK_BUSY_REPLIES = int(os.getenv("WEBHOOK_BUSY_REPLIES", "16"))
+
+# Reply sent to a user whose update was shed because the queue was full
+BUSY_MESSAGE = "I am answering many questions right now. Please send yours again in a minute."
+
+
+
+class UpdateWorkerPool:
+
+    """
+    A bounded queue of Telegram updates served by a fixed number of async workers.
+
+    submit never waits: an update either fits in the queue or is shed. Each worker answers one update at a
+    time, so at most `workers` queries use the runtime concurrently whatever the incoming rate.
+    """
+
+    def __init__(self,
+                 runtime: ChatbotRuntime,
+                 http_client: httpx.AsyncClient,
+                 workers: int = WEBHOOK_WORKERS,
+                 max_queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 max_busy_replies: int = WEBHOOK_BUSY_REPLIES
+                 ):
+
+        """
+        Initializes the UpdateWorkerPool instance.
+
+        Args:
+            runtime (ChatbotRuntime): The warm runtime used to answer the messages.
+            http_client (httpx.AsyncClient): The pooled client used for the Telegram Bot API, with TELEGRAM_API_URL as base_url.
+            workers (int): Number of worker tasks. Defaults to WEBHOOK_WORKERS.
+            max_queue_size (int): Number of updates allowed to wait. Defaults to WEBHOOK_QUEUE_SIZE.
+            max_busy_replies (int): Number of "busy" replies in flight, beyond which shed updates get no reply.
+                Defaults to WEBHOOK_BUSY_REPLIES.
+        """
+
+        self.runtime = runtime
+        self.http_client = http_client
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize = max_queue_size)
+        self.max_busy_replies = max_busy_replies
+        self._worker_tasks: List[asyncio.Task] = []
+        self._busy_replies: set = set()
+        self.counters: Dict[str, int] = {"received": 0, "enqueued": 0, "shed": 0, "busy_replies_dropped": 0, "busy_replies_failed": 0, "processed": 0, "failed": 0, "max_depth": 0}
+
+
+    def start(self)-> None:
+
+        """Starts the worker tasks. Must be called from the running event loop."""
+
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+
+    async def stop(self)-> None:
+
+        """Cancels the workers. Updates still waiting in the queue are dropped."""
+
+        for worker_task in self._worker_tasks:
+            worker_task.cancel()
+        await asyncio.gather(*self._worker_tasks, *self._busy_replies, return_exceptions = True)
+        self._worker_tasks = []
+
+
+    def submit(self, update: Dict[str, Any])-> bool:
+
+        """
+        Queues an update without waiting.
+
+        Args:
+            update (Dict[str, Any]): The Telegram update, as received by the webhook.
+
+        Returns:
+            bool: True if the update was queued, False if it was shed because the queue is full.
+        """
+
+        self.counters["received"] += 1
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.counters["shed"] += 1
+            chat_id = _get_chat_id(update)
+            if chat_id is None:
+                return False
+            if len(self._busy_replies) >= self.max_busy_replies:
+                self.counters["busy_replies_dropped"] += 1
+                return False
 
-    # Query the LLM with the user's message
-    bot_response = get_llm_response(user_message)
+            busy_reply = asyncio.create_task(self._send_busy_reply(chat_id))
+            self._busy_replies.add(busy_reply)
+            busy_reply.add_done_callback(self._busy_replies.discard)
+            return False
 
-    # Send the LLM-generated response back to the user
-    send_message(chat_id, bot_response)
+        self.counters["enqueued"] += 1
+        self.counters["max_depth"] = max(self.counters["max_depth"], self.queue.qsize())
+        return True
+
+
+    async def _send_busy_reply(self, chat_id: int)-> None:
+
+        try:
+            await self.send_message(chat_id, BUSY_MESSAGE)
+        except Exception as error:
+            self.counters["busy_replies_failed"] += 1
+            print(f"Failed to send the busy reply to chat {chat_id}: {error!r}")
+
+
+    async def _work(self)-> None:
+
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.process_update(update)
+                self.counters["processed"] += 1
+            except Exception as error:
+                self.counters["failed"] += 1
+                print(f"Failed to answer update {update.get('update_id')}: {error!r}")
+            finally:
+                self.queue.task_done()
+
+
+    async def process_update(self, update: Dict[str, Any])-> None:
+
+        """
+        Answers the text message of an update and sends the reply. Updates without text are ignored.
+
+        Args:
+            update (Dict[str, Any]): The Telegram update.
+        """
+
+        message: Dict[str, Any] = update.get("message") or {}
+        user_message: Union[str, None] = message.get("text")
+        if not user_message:
+            return
+
+        bot_response: str = await get_chatbot_response_async(user_message, self.runtime)
+        await self.send_message(message["chat"]["id"], bot_response)
+
+
+    async def send_message(self, chat_id: int, text: str)-> None:
+
+        """
+        Sends a message through the Telegram Bot API.
+
+        Args:
+            chat_id (int): The chat to send the message to.
+            text (str): The message text.
+        """
+
+        with tracer.span("telegram_delivery"):
+            response = await self.http_client.post("/sendMessage", json = {"chat_id": chat_id, "text": text})
+        response.raise_for_status()
+
+
+    def metrics(self)-> Dict[str, int]:
+
+        """
+        Returns the queue depth and the update counters.
+
+        Returns:
+            Dict[str, int]: The current queue depth, its capacity, the number of workers and the counters.
+        """
+
+        return {"queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "workers": self.workers,
+                **self.counters
+                }
+
+
+
+def _get_chat_id(update: Dict[str, Any])-> Union[int, None]:
+
+    return ((update.get("message") or {}).get("chat") or {}).get("id")
+
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+
+    # Load the runtime once and share one pooled HTTP client between the workers
+    http_client = httpx.AsyncClient(base_url = TELEGRAM_API_URL,
+                                    timeout = httpx.Timeout(30.0),
+                                    limits = httpx.Limits(max_connections = 2 * WEBHOOK_WORKERS,
+                                                          max_keepalive_connections = WEBHOOK_WORKERS
+                                                          )
+                                    )
+    tracer.enabled = TRACING
+    app.state.worker_pool = UpdateWorkerPool(build_runtime(), http_client)
+    app.state.worker_pool.start()
+    try:
+        yield
+    finally:
+        await app.state.worker_pool.stop()
+        await http_client.aclose()
+
+
+# Initialize FastAPI app
+app = FastAPI(lifespan = lifespan)
+
+
+# Route to receive Telegram updates (webhook): the update is only queued, so Telegram gets its 200 at once
+@app.post("/webhook")
+async def telegram_webhook(request: Request):
+    update = await request.json()
+    queued = request.app.state.worker_pool.submit(update)
+    return {"status": "ok" if queued else "shed"}
 
-    return {"status": "ok"}
 
+# Route exposing the queue depth, counters and stage latencies to Prometheus
+@app.get("/metrics", response_class = PlainTextResponse)
+async def metrics(request: Request):
+    worker_pool: UpdateWorkerPool = request.app.state.worker_pool
+    pool_metrics = worker_pool.metrics()
+    return tracer.render_prometheus(gauges = {f"webhook_{name}": pool_metrics[name] for name in ("queue_depth", "queue_capacity", "workers")},
+                                    component_counters = {**worker_pool.runtime.component_counters(), "webhook": worker_pool.counters}
+                                    )
@@ -8,3 +8,12 @@ class SampleQueries(Enum):
     query3 = """All of the following stakeholders participate in the prioritization of requirements except for which one? A. Implementation subject matter expert. B. Project team. C. Domain subject matter expert. D. Project manager"""
     query4 = """What plan will describe the stakeholder groups, communication needs, and the level of formality that is appropriate for the requirements? A. Requirements management plan. B. Project management plan. C. Scope management plan. D. Business analysis communication plan."""
     query5 = """You are the business analyst for your organization. Management has asked that you create a model of the requirements so the stakeholders can better understand the requirements and the project as a whole. Which of the following statements best describes a model? A. Models are slices of the project solution. B. Models simplify the requirements for common stakeholders. C. Models are statistics for the return on investment, time saved, and other mathematics. D. Models abstract and simplify reality."""
+
+
+class OutOfScopeQueries(Enum):
+
+    """Questions that the BABOK guide does not answer, used to measure the completions spent before giving up."""
+
+    query1 = "What is the boiling point of water at the top of Mount Everest?"
+    query2 = "Which team won the 2010 FIFA World Cup final?"
+    query3 = "What is the time complexity of heapsort in the worst case?"
@@ -0,0 +1,56 @@
+"""
+conftest.py
+
+Shared setup of the offline tests. The chatbot modules import each other by name and read the project folders
+relative to Chatbot_Module, so the tests run with Chatbot_Module on sys.path and as the working directory. The
+OpenAI and Pinecone clients are created when openai_kit and pinecone_kit are imported; the tests never call them,
+so placeholder keys are enough.
+
+Usage:
+    Run from the repository root or from Chatbot_Module:
+        python -m pytest Chatbot_Module/tests
+"""
+
+
+import json
+import os
+import sys
+
+import pytest
+
+CHATBOT_MODULE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHATBOT_MODULE_FOLDER)
+os.environ.setdefault("OPENAI_API_KEY", "offline-tests")
+os.environ.setdefault("PINECONE_KEY", "offline-tests")
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from local_index import REFERENCE_JSON_OBJECTS_FOLDER, CHAPTER_SECTIONS_JSON
+
+
+
+@pytest.fixture(scope = "session", autouse = True)
+def chatbot_module_folder():
+
+    """Runs the tests from Chatbot_Module, which the project paths ("../...") are relative to."""
+
+    previous_folder = os.getcwd()
+    os.chdir(CHATBOT_MODULE_FOLDER)
+    yield CHATBOT_MODULE_FOLDER
+    os.chdir(previous_folder)
+
+
+@pytest.fixture(scope = "session")
+def chapter_texts():
+
+    """The BABOK chunk texts shipped in chapter_reference_objects_step_2."""
+
+    with open(os.path.join("..", REFERENCE_JSON_OBJECTS_FOLDER, CHAPTER_SECTIONS_JSON), "r") as file:
+        return list(json.load(file).values())
+
+
+@pytest.fixture(scope = "session")
+def babok_vectorizer(chapter_texts):
+
+    """A TF-IDF vectorizer fitted on the chunk texts, as the upload to Pinecone fits it."""
+
+    return TfidfVectorizer().fit(chapter_texts)
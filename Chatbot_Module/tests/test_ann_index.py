@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex, load_or_build_ivf_index
+
+
+@pytest.fixture(scope = "module")
+def clustered_vectors():
+
+    rng = np.random.default_rng(2)
+    centers = rng.normal(size = (8, 24))
+    vectors = np.repeat(centers, 50, axis = 0) + rng.normal(scale = 0.2, size = (400, 24))
+    return vectors.astype(np.float32)
+
+
+def _exact_top_k(vectors, queries, k):
+
+    return np.argsort(-(queries @ vectors.T), axis = 1, kind = "stable")[:, :k]
+
+
+def test_probing_every_list_is_an_exact_search(clustered_vectors):
+
+    ivf_index = IVFIndex(n_lists = 8, n_probe = 8)
+    ivf_index.train(clustered_vectors)
+    ivf_index.add(clustered_vectors)
+    queries = clustered_vectors[::37] + 0.05
+
+    _, positions = ivf_index.search(queries, k = 5)
+
+    np.testing.assert_array_equal(positions, _exact_top_k(clustered_vectors, queries, 5))
+
+
+def test_few_probes_keep_a_high_recall_on_clustered_data(clustered_vectors):
+
+    ivf_index = IVFIndex(n_lists = 8, n_probe = 2)
+    ivf_index.train(clustered_vectors)
+    ivf_index.add(clustered_vectors)
+    queries = clustered_vectors[::11] + 0.05
+
+    _, positions = ivf_index.search(queries, k = 3)
+    exact_positions = _exact_top_k(clustered_vectors, queries, 3)
+
+    recall = np.mean([len(set(row) & set(exact_row)) / 3 for row, exact_row in zip(positions, exact_positions)])
+    assert recall >= 0.9
+    assert len(ivf_index.candidates(queries[0])) < len(clustered_vectors)
+
+
+def test_untrained_index_refuses_vectors(clustered_vectors):
+
+    with pytest.raises(ValueError):
+        IVFIndex().add(clustered_vectors)
+
+
+def test_search_pads_missing_neighbours():
+
+    ivf_index = IVFIndex(n_lists = 2, n_probe = 1)
+    vectors = np.eye(4, dtype = np.float32)
+    ivf_index.train(vectors)
+    ivf_index.add(vectors)
+
+    scores, positions = ivf_index.search(vectors[0], k = 6)
+
+    assert positions[0, 0] == 0
+    assert (positions[0] == -1).sum() == 6 - len(ivf_index.candidates(vectors[0]))
+    assert np.isneginf(scores[0, positions[0] == -1]).all()
+
+
+def test_saved_index_is_reused_until_the_vectors_change(clustered_vectors, tmp_path, monkeypatch):
+
+    # The index folder is relative to the project root, one level above the working directory
+    index_folder = "ann_cache"
+    (tmp_path / "work").mkdir()
+    monkeypatch.chdir(tmp_path / "work")
+
+    built_index = load_or_build_ivf_index(clustered_vectors, index_folder, n_lists = 8, n_probe = 3)
+    reloaded_index = load_or_build_ivf_index(clustered_vectors, index_folder)
+
+    np.testing.assert_array_equal(reloaded_index.centroids, built_index.centroids)
+    assert reloaded_index.n_probe == 3
+
+    changed_vectors = clustered_vectors.copy()
+    changed_vectors[0] += 1.0
+    rebuilt_index = load_or_build_ivf_index(changed_vectors, index_folder)
+
+    np.testing.assert_array_equal(rebuilt_index.vectors, changed_vectors)
+    assert (tmp_path / index_folder / "dense_ivf_index.npz").is_file()
@@ -0,0 +1,74 @@
+import numpy as np
+
+from answer_cache import SemanticAnswerCache
+
+
+def _unit(*components):
+
+    vector = np.zeros(4, dtype = np.float32)
+    vector[:len(components)] = components
+    return vector
+
+
+def test_similar_queries_share_an_answer():
+
+    answer_cache = SemanticAnswerCache(similarity_threshold = 0.95, embedding_dimension = 4)
+    answer_cache.lookup(_unit(1.0), "v1")
+    answer_cache.store(_unit(1.0), "A model abstracts reality.", "v1")
+
+    assert answer_cache.lookup(_unit(1.0, 0.1), "v1") == "A model abstracts reality."
+    assert answer_cache.lookup(_unit(1.0, 1.0), "v1") is None
+    assert answer_cache.stats()["hits"] == 1
+
+
+def test_full_cache_replaces_the_least_recently_used():
+
+    answer_cache = SemanticAnswerCache(max_entries = 2, embedding_dimension = 4)
+    answer_cache.lookup(_unit(1.0), "v1")
+    answer_cache.store(_unit(1.0), "first", "v1")
+    answer_cache.store(_unit(0.0, 1.0), "second", "v1")
+    answer_cache.lookup(_unit(1.0), "v1")
+    answer_cache.store(_unit(0.0, 0.0, 1.0), "third", "v1")
+
+    assert answer_cache.lookup(_unit(0.0, 1.0), "v1") is None
+    assert answer_cache.lookup(_unit(1.0), "v1") == "first"
+    assert answer_cache.lookup(_unit(0.0, 0.0, 1.0), "v1") == "third"
+    assert answer_cache.stats()["evictions"] == 1
+
+
+def test_old_answers_expire():
+
+    answer_cache = SemanticAnswerCache(max_age_seconds = 60, embedding_dimension = 4)
+    answer_cache.lookup(_unit(1.0), "v1")
+    answer_cache.store(_unit(1.0), "stale", "v1")
+    answer_cache._created_at[:] -= 120
+
+    assert answer_cache.lookup(_unit(1.0), "v1") is None
+    assert answer_cache.stats()["entries"] == 0
+
+
+def test_new_index_version_drops_every_answer():
+
+    answer_cache = SemanticAnswerCache(embedding_dimension = 4)
+    answer_cache.lookup(_unit(1.0), "v1")
+    answer_cache.store(_unit(1.0), "built from v1", "v1")
+
+    assert answer_cache.lookup(_unit(1.0), "v2") is None
+    assert answer_cache.stats()["invalidations"] == 1
+    assert answer_cache.stats()["index_version"] == "v2"
+
+
+def test_answer_built_during_a_version_change_is_not_stored():
+
+    answer_cache = SemanticAnswerCache(embedding_dimension = 4)
+    answer_cache.lookup(_unit(1.0), "v1")
+    answer_cache.lookup(_unit(0.0, 1.0), "v2")
+    answer_cache.store(_unit(0.0, 1.0), "built from v2", "v2")
+
+    # A query that started under v1 finishes after the cache moved to v2
+    answer_cache.store(_unit(1.0), "built from v1", "v1")
+
+    assert answer_cache.stats()["index_version"] == "v2"
+    assert answer_cache.stats()["stale_stores"] == 1
+    assert answer_cache.lookup(_unit(1.0), "v2") is None
+    assert answer_cache.lookup(_unit(0.0, 1.0), "v2") == "built from v2"
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+import query_processor
+from query_processor import (Verdict,
+                             AnswerFormat,
+                             INCONCLUSIVE_STATEMENT,
+                             EMPTY_GPT_RESPONSES,
+                             parse_verdict,
+                             get_gpt_response_from_pinecone_text,
+                             get_gpt_response_from_pinecone_text_async,
+                             _decode_json_string_prefix,
+                             _stream_json_verdict,
+                             )
+from openai_kit import OpenAI, AsyncOpenAI
+from local_openai_server import OpenAIStandIn, StandInSettings, start_stand_in_server
+from test_queries import OutOfScopeQueries
+
+
+
+@pytest.mark.parametrize("gpt_response, expected", [
+    ('{"verdict": "answered", "answer": " Use a RACI matrix. "}', (Verdict.ANSWERED, "Use a RACI matrix.")),
+    ('{"verdict": "inconclusive", "answer": "Possibly B."}', (Verdict.INCONCLUSIVE, "Possibly B.")),
+    ('{"verdict": "not_found", "answer": "ignored"}', (Verdict.NOT_FOUND, "")),
+    ('{"verdict": "answered", "answer": ""}', (Verdict.NOT_FOUND, "")),
+    ('{"verdict": "answered"}', (Verdict.NOT_FOUND, "")),
+    ('{"verdict": "maybe", "answer": "B"}', (Verdict.NOT_FOUND, "")),
+    ('{"answer": "B"}', (Verdict.NOT_FOUND, "")),
+    ('{"verdict": "answered", "answer": "The answer is', (Verdict.NOT_FOUND, "")),
+    ('{"verdict": "answ', (Verdict.NOT_FOUND, "")),
+    ('["answered", "B"]', (Verdict.NOT_FOUND, "")),
+    ('"answered"', (Verdict.NOT_FOUND, "")),
+    ("The answer is B.", (Verdict.NOT_FOUND, "")),
+    ("''", (Verdict.NOT_FOUND, "")),
+    ("", (Verdict.NOT_FOUND, "")),
+])
+def test_parse_verdict(gpt_response, expected):
+
+    assert parse_verdict(gpt_response) == expected
+
+
+def test_decode_json_string_prefix_in_any_chunking():
+
+    answer = 'Say "hi"\n\ttab \\ slash / café \U0001F600 end'
+    raw_response = json.dumps({"verdict": "answered", "answer": answer})
+    start = raw_response.index('"answer": "') + len('"answer": "')
+
+    for chunk_size in range(1, 8):
+        decoded, position, closed = "", start, False
+        for end in range(start, len(raw_response) + chunk_size, chunk_size):
+            piece, position, closed = _decode_json_string_prefix(raw_response[:end], position)
+            decoded += piece
+            if closed:
+                break
+        assert closed and decoded == answer
+
+
+def test_decode_json_string_prefix_keeps_a_cut_escape_for_later():
+
+    assert _decode_json_string_prefix('ab\\', 0) == ("ab", 2, False)
+    assert _decode_json_string_prefix('ab\\u00e', 0) == ("ab", 2, False)
+    assert _decode_json_string_prefix('\\ud83d\\ude0', 0) == ("", 0, False)
+
+
+def _stream_chunks(monkeypatch, raw_response: str, chunk_size: int = 3):
+
+    async def fake_stream(instruction, openai_client, json_output = False):
+        for start in range(0, len(raw_response), chunk_size):
+            yield raw_response[start:start + chunk_size]
+
+    monkeypatch.setattr(query_processor, "stream_chatgpt_response_async", fake_stream)
+
+    async def collect():
+        return "".join([piece async for piece in _stream_json_verdict("instruction", None)])
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("raw_response, expected", [
+    ('{"verdict": "answered", "answer": "Models abstract reality."}', "Models abstract reality."),
+    ('{"verdict": "inconclusive", "answer": "Probably D."}', f"Probably D.\n{INCONCLUSIVE_STATEMENT}"),
+    ('{"verdict": "not_found", "answer": ""}', ""),
+    ('{"verdict": "unknown", "answer": "B"}', ""),
+    ('{"answer": "B", "note": "no verdict"}', ""),
+    ("Plain text instead of JSON", ""),
+    ('{"verdict": "answ', ""),
+])
+def test_stream_json_verdict_matches_parse_verdict(monkeypatch, raw_response, expected):
+
+    assert _stream_chunks(monkeypatch, raw_response) == expected
+
+
+
+@pytest.fixture(scope = "module")
+def unanswering_openai_base_url():
+
+    """An OpenAI stand-in that answers no prompt (not_found verdicts, or the '' sentinel)."""
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    settings = StandInSettings(embedding_latency_ms = 0, chat_latency_ms = 0, token_latency_ms = 0, answer_rate = 0.0)
+    server = start_stand_in_server(OpenAIStandIn(settings).create_app(), port)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+
+
+@pytest.mark.parametrize("answer_format", list(AnswerFormat))
+def test_out_of_scope_queries_are_not_answered(unanswering_openai_base_url, answer_format):
+
+    openai_client = OpenAI(base_url = unanswering_openai_base_url)
+    for out_of_scope_query in OutOfScopeQueries:
+        gpt_response = get_gpt_response_from_pinecone_text("Elicitation is the drawing forth of information from stakeholders.",
+                                                           out_of_scope_query.value, openai_client, answer_format = answer_format
+                                                           )
+        assert gpt_response in EMPTY_GPT_RESPONSES
+
+
+@pytest.mark.parametrize("abort_unanswerable", [False, True])
+def test_out_of_scope_queries_are_not_answered_async(unanswering_openai_base_url, abort_unanswerable):
+
+    async def answer_all():
+        openai_client = AsyncOpenAI(base_url = unanswering_openai_base_url)
+        return [await get_gpt_response_from_pinecone_text_async("Elicitation is the drawing forth of information from stakeholders.",
+                                                                out_of_scope_query.value, openai_client, abort_unanswerable,
+                                                                AnswerFormat.JSON_VERDICT
+                                                                )
+                for out_of_scope_query in OutOfScopeQueries]
+
+    assert asyncio.run(answer_all()) == [""] * len(OutOfScopeQueries)
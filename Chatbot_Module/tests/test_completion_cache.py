@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+from completion_cache import CompletionCache, prompt_template_hash
+from query_processor import AnswerFormat, get_gpt_response_from_pinecone_text_async, _get_answer_template, _get_completion_cache_key
+
+
+KEY = ("What is a RACI matrix?", "match-1", "gpt-4o-mini", 0.0, prompt_template_hash("template"))
+
+
+def test_cached_response_is_found_for_the_same_key_only():
+
+    completion_cache = CompletionCache()
+    completion_cache.put(*KEY, "A responsibility matrix.")
+
+    assert completion_cache.get("  what is a RACI   matrix?", *KEY[1:]) == "A responsibility matrix."
+    assert completion_cache.get(KEY[0], "match-2", *KEY[2:]) is None
+    assert completion_cache.get(*KEY[:4], prompt_template_hash("edited template")) is None
+    assert completion_cache.stats()["hits"] == 1 and completion_cache.stats()["misses"] == 2
+
+
+def test_not_found_responses_expire_sooner_than_answers():
+
+    completion_cache = CompletionCache(ttl_seconds = 1000, not_found_ttl_seconds = 10)
+    completion_cache.put(*KEY, "")
+    completion_cache.put(KEY[0], "match-2", *KEY[2:], "An answer.")
+    completion_cache._connection.execute("UPDATE completions SET created_at = created_at - 100")
+
+    assert completion_cache.get(*KEY) is None
+    assert completion_cache.get(KEY[0], "match-2", *KEY[2:]) == "An answer."
+
+    # The expired sentinel is purged by the next put
+    completion_cache.put(KEY[0], "match-3", *KEY[2:], "Another answer.")
+    assert completion_cache.stats()["expired"] == 1
+    assert completion_cache.stats()["entries"] == 2
+
+
+def test_gets_do_not_write_and_recency_is_flushed_before_eviction():
+
+    completion_cache = CompletionCache(max_entries = 2)
+    completion_cache.put(KEY[0], "a", *KEY[2:], "A")
+    time.sleep(0.001)
+    completion_cache.put(KEY[0], "b", *KEY[2:], "B")
+    total_changes = completion_cache._connection.total_changes
+
+    assert completion_cache.get(KEY[0], "a", *KEY[2:]) == "A"
+    assert completion_cache._connection.total_changes == total_changes
+
+    completion_cache.put(KEY[0], "c", *KEY[2:], "C")
+
+    assert completion_cache.get(KEY[0], "b", *KEY[2:]) is None
+    assert completion_cache.get(KEY[0], "a", *KEY[2:]) == "A"
+    assert completion_cache.stats()["evictions"] == 1
+
+
+def test_cache_survives_a_restart(tmp_path):
+
+    db_path = str(tmp_path / "completions.sqlite")
+    completion_cache = CompletionCache(db_path)
+    completion_cache.put(*KEY, "A responsibility matrix.")
+    completion_cache.close()
+
+    reopened_cache = CompletionCache(db_path)
+    assert reopened_cache.get(*KEY) == "A responsibility matrix."
+    reopened_cache.close()
+
+
+def test_async_pipeline_answers_a_cached_pair_without_the_model():
+
+    completion_cache = CompletionCache()
+    cache_key = _get_completion_cache_key(KEY[0], "match-1", _get_answer_template(AnswerFormat.SENTINEL), completion_cache)
+    completion_cache.put(*cache_key, "A responsibility matrix.")
+
+    gpt_response = asyncio.run(get_gpt_response_from_pinecone_text_async("passage", KEY[0], None, match_id = "match-1",
+                                                                         completion_cache = completion_cache
+                                                                         ))
+
+    assert gpt_response == "A responsibility matrix."
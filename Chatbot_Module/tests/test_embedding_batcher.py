@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+
+
+class FakeEmbeddings:
+
+    """Records the inputs of each embeddings.create call and embeds a text as [len(text)]."""
+
+    def __init__(self, rejected_text = None, delay = 0.0):
+
+        self.calls = []
+        self.rejected_text = rejected_text
+        self.delay = delay
+
+
+    async def create(self, input, model):
+
+        self.calls.append(list(input))
+        await asyncio.sleep(self.delay)
+        if self.rejected_text in input:
+            raise ValueError("This model's maximum context length is 8192 tokens")
+        return SimpleNamespace(data = [SimpleNamespace(index = index, embedding = [float(len(text))]) for index, text in enumerate(input)],
+                               usage = None
+                               )
+
+
+def _batcher(embeddings, **options):
+
+    return EmbeddingBatcher(SimpleNamespace(embeddings = embeddings), **options)
+
+
+def test_concurrent_requests_share_one_call_and_duplicates_are_sent_once():
+
+    embeddings = FakeEmbeddings()
+    embedding_batcher = _batcher(embeddings, window_seconds = 0.01)
+
+    async def embed_all():
+        return await asyncio.gather(*(embedding_batcher.embed(text) for text in ["a", "bb", "a", "ccc"]))
+
+    assert asyncio.run(embed_all()) == [[1.0], [2.0], [1.0], [3.0]]
+    assert embeddings.calls == [["a", "bb", "ccc"]]
+    assert embedding_batcher.stats()["requests_per_call"] == 4
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+
+    embeddings = FakeEmbeddings()
+    embedding_batcher = _batcher(embeddings, window_seconds = 10, max_batch_size = 2)
+
+    async def embed_all():
+        return await asyncio.wait_for(asyncio.gather(*(embedding_batcher.embed(text) for text in ["a", "bb", "ccc", "dddd"])), 1)
+
+    assert asyncio.run(embed_all()) == [[1.0], [2.0], [3.0], [4.0]]
+    assert embeddings.calls == [["a", "bb"], ["ccc", "dddd"]]
+
+
+def test_a_rejected_input_only_fails_its_own_requests():
+
+    embeddings = FakeEmbeddings(rejected_text = "too long")
+    embedding_batcher = _batcher(embeddings)
+
+    async def embed_all():
+        return await asyncio.gather(*(embedding_batcher.embed(text) for text in ["a", "too long", "bb", "too long"]), return_exceptions = True)
+
+    results = asyncio.run(embed_all())
+
+    assert results[0] == [1.0] and results[2] == [2.0]
+    assert isinstance(results[1], ValueError) and isinstance(results[3], ValueError)
+    assert embeddings.calls[0] == ["a", "too long", "bb"]
+    assert sorted(embeddings.calls[1:]) == [["a"], ["bb"], ["too long"]]
+    assert embedding_batcher.stats()["failed_batches"] == 1
+
+
+def test_a_failed_single_text_batch_is_not_retried():
+
+    embeddings = FakeEmbeddings(rejected_text = "too long")
+    embedding_batcher = _batcher(embeddings)
+
+    with pytest.raises(ValueError):
+        asyncio.run(embedding_batcher.embed("too long"))
+    assert embeddings.calls == [["too long"]]
+
+
+@pytest.mark.parametrize("call_started", [False, True])
+def test_cancelled_batch_cancels_its_waiting_requests(call_started):
+
+    embeddings = FakeEmbeddings(delay = 10)
+    embedding_batcher = _batcher(embeddings, window_seconds = 0)
+
+    async def cancel_batch():
+        request = asyncio.ensure_future(embedding_batcher.embed("a"))
+        while not embedding_batcher._batch_tasks or (call_started and not embeddings.calls):
+            await asyncio.sleep(0)
+        for batch_task in list(embedding_batcher._batch_tasks):
+            batch_task.cancel()
+        return await asyncio.wait_for(asyncio.gather(request, return_exceptions = True), 1)
+
+    results = asyncio.run(cancel_batch())
+
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert not embedding_batcher._batch_tasks
@@ -0,0 +1,74 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache, normalize_query
+
+
+MODEL = "text-embedding-3-small"
+
+
+def test_normalize_query():
+
+    assert normalize_query("  What is   ELICITATION?\n") == "what is elicitation?"
+
+
+def test_paraphrased_spelling_hits_the_memory_tier():
+
+    embedding_cache = EmbeddingCache()
+    embedding_cache.put("What is elicitation?", MODEL, [0.1, 0.2])
+
+    vector = embedding_cache.get("  what is ELICITATION? ", MODEL)
+
+    assert vector.dtype == np.float32
+    np.testing.assert_allclose(vector, [0.1, 0.2], rtol = 1e-6)
+    assert embedding_cache.get("What is elicitation?", "another-model") is None
+    assert embedding_cache.stats()["memory_hits"] == 1 and embedding_cache.stats()["misses"] == 1
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+
+    embedding_cache = EmbeddingCache(max_memory_entries = 2)
+    embedding_cache.put("a", MODEL, [1.0])
+    embedding_cache.put("b", MODEL, [2.0])
+    embedding_cache.get("a", MODEL)
+    embedding_cache.put("c", MODEL, [3.0])
+
+    assert embedding_cache.get("b", MODEL) is None
+    assert embedding_cache.get("a", MODEL) is not None
+    assert embedding_cache.stats()["memory_entries"] == 2
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+
+    db_path = str(tmp_path / "query_embeddings.sqlite")
+    embedding_cache = EmbeddingCache(db_path)
+    embedding_cache.put("What is a RACI matrix?", MODEL, [0.5, 0.25, 0.125])
+    embedding_cache.close()
+
+    reopened_cache = EmbeddingCache(db_path)
+    vector = reopened_cache.get("what is a raci matrix?", MODEL)
+
+    np.testing.assert_allclose(vector, [0.5, 0.25, 0.125])
+    assert reopened_cache.stats()["disk_hits"] == 1
+    assert reopened_cache._connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    reopened_cache.close()
+
+
+def test_disk_hits_do_not_write_until_the_next_put(tmp_path):
+
+    db_path = str(tmp_path / "query_embeddings.sqlite")
+    embedding_cache = EmbeddingCache(db_path, max_memory_entries = 1, max_disk_entries = 2)
+    embedding_cache.put("a", MODEL, [1.0])
+    embedding_cache.put("b", MODEL, [2.0])
+    total_changes = embedding_cache._connection.total_changes
+
+    assert embedding_cache.get("a", MODEL) is not None
+    assert embedding_cache._connection.total_changes == total_changes
+
+    # The hit on "a" is flushed before the eviction, so "b" is the least recently used entry on disk
+    embedding_cache.put("c", MODEL, [3.0])
+    embedding_cache._memory.clear()
+
+    assert embedding_cache.get("b", MODEL) is None
+    assert embedding_cache.get("a", MODEL) is not None
+    assert embedding_cache.stats()["disk_entries"] == 2
+    embedding_cache.close()
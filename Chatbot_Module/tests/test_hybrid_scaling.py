@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from embedding_matrix_loader import hybrid_scale, hybrid_scale_batch, hybrid_batch_to_pinecone, sparse_matrix_to_dict
+
+
+ALPHAS = [1.0, 0.5, 0.0]
+
+
+@pytest.fixture(scope = "module")
+def query_batch(babok_vectorizer):
+
+    sparse_matrix = babok_vectorizer.transform(["requirements traceability", "stakeholder engagement approach", "?"])
+    dense = np.random.default_rng(3).normal(size = (3, 8))
+    return dense, sparse_matrix
+
+
+def test_batch_scaling_matches_hybrid_scale(query_batch):
+
+    dense, sparse_matrix = query_batch
+
+    pinecone_vectors = hybrid_batch_to_pinecone(*hybrid_scale_batch(dense, sparse_matrix, ALPHAS), sparse_matrix)
+
+    for alpha_index, alpha in enumerate(ALPHAS):
+        for row in range(dense.shape[0]):
+            hdense, hsparse = hybrid_scale(dense[row], sparse_matrix[row], alpha)
+            batch_dense, batch_sparse = pinecone_vectors[alpha_index][row]
+            assert batch_dense == pytest.approx(hdense)
+            assert batch_sparse["indices"] == hsparse["indices"]
+            assert batch_sparse["values"] == pytest.approx(hsparse["values"])
+
+
+def test_hybrid_scale_is_a_convex_combination(query_batch):
+
+    dense, sparse_matrix = query_batch
+
+    hdense, hsparse = hybrid_scale(dense[0], sparse_matrix[0], 0.25)
+
+    assert hdense == pytest.approx((dense[0] * 0.25).tolist())
+    assert hsparse["indices"] == sparse_matrix_to_dict(sparse_matrix[0])["indices"]
+    assert hsparse["values"] == pytest.approx((sparse_matrix[0].data * 0.75).tolist())
+
+
+@pytest.mark.parametrize("alpha", [-0.1, 1.5])
+def test_alpha_outside_zero_one_is_rejected(query_batch, alpha):
+
+    dense, sparse_matrix = query_batch
+
+    with pytest.raises(ValueError):
+        hybrid_scale(dense[0], sparse_matrix[0], alpha)
+    with pytest.raises(ValueError):
+        hybrid_scale_batch(dense, sparse_matrix, [0.5, alpha])
+
+
+def test_batch_rows_must_match(query_batch):
+
+    dense, sparse_matrix = query_batch
+
+    with pytest.raises(ValueError):
+        hybrid_scale_batch(dense[:2], sparse_matrix, ALPHAS)
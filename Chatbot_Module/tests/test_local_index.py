@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from embedding_matrix_loader import hybrid_scale, sparse_matrix_to_dict
+from local_index import LocalHybridIndex, sparse_dict_to_csr
+from local_pinecone_server import _Namespace
+
+
+@pytest.fixture(scope = "module")
+def records(chapter_texts, babok_vectorizer):
+
+    texts = chapter_texts[:300]
+    rng = np.random.default_rng(1)
+    dense_matrix = rng.normal(size = (len(texts), 16)).astype(np.float32)
+    sparse_matrix = babok_vectorizer.transform(texts)
+    metadata = [{"chapter_names": f"chunk_{row}", "chapter_texts": text, "page_number": row} for row, text in enumerate(texts)]
+    return [f"id-{row}" for row in range(len(texts))], dense_matrix, sparse_matrix, metadata
+
+
+@pytest.fixture(scope = "module")
+def local_index(records):
+
+    return LocalHybridIndex(*records)
+
+
+@pytest.fixture(scope = "module")
+def stand_in_namespace(records):
+
+    ids, dense_matrix, sparse_matrix, metadata = records
+    namespace = _Namespace()
+    namespace.upsert([{"id": record_id, "values": dense_matrix[row].tolist(), "sparseValues": sparse_matrix_to_dict(sparse_matrix[row])}
+                      for row, record_id in enumerate(ids)])
+    return namespace
+
+
+QUERIES = ["requirements traceability matrix", "stakeholder engagement approach", "solution evaluation performance measures"]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("alpha", [1.0, 0.5, 0.0])
+def test_local_index_ranks_like_the_pinecone_stand_in(local_index, stand_in_namespace, babok_vectorizer, query, alpha):
+
+    dense = np.random.default_rng(len(query)).normal(size = 16).tolist()
+    hdense, hsparse = hybrid_scale(dense, babok_vectorizer.transform([query]), alpha)
+
+    local_matches = local_index.query(hdense, hsparse, top_k = 5).to_dict()["matches"]
+    stand_in_matches = stand_in_namespace.query(hdense, hsparse, top_k = 5)
+
+    assert [match["id"] for match in local_matches] == [record_id for record_id, _ in stand_in_matches]
+    assert [match["score"] for match in local_matches] == pytest.approx([score for _, score in stand_in_matches], rel = 1e-4, abs = 1e-6)
+
+
+def test_query_includes_metadata_and_values(local_index, babok_vectorizer):
+
+    hdense, hsparse = hybrid_scale([0.0] * 16, babok_vectorizer.transform(["elicitation"]), 0.0)
+    match = local_index.query(hdense, hsparse, top_k = 1, include_metadata = True, include_values = True).to_dict()["matches"][0]
+    row = local_index.ids.index(match["id"])
+
+    assert "elicitation" in match["metadata"]["chapter_texts"].lower()
+    assert match["values"] == pytest.approx(local_index.dense_matrix[row].tolist())
+    assert sparse_dict_to_csr(match["sparse_values"], local_index.vocabulary_size).toarray() == pytest.approx(local_index.sparse_matrix[row].toarray())
+
+
+def test_mismatched_records_are_rejected(records):
+
+    ids, dense_matrix, sparse_matrix, metadata = records
+
+    with pytest.raises(ValueError):
+        LocalHybridIndex(ids[:-1], dense_matrix, sparse_matrix, metadata)
+
+
+def test_missing_batch_output_fails_clearly(babok_vectorizer):
+
+    with pytest.raises(FileNotFoundError, match = "get_embeddings.py"):
+        LocalHybridIndex.from_batch_output(babok_vectorizer, embeddings_folder = "no_such_output_embeddings")
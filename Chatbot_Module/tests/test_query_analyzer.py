@@ -0,0 +1,45 @@
+import pytest
+
+from query_analyzer import QueryAnalyzer, JARGON_PERCENTILE
+
+
+ALPHA_VALUES = [1.0, 0.5, 0.0]
+
+JARGON_QUERY = "Which technique uses a SWOT analysis, a RACI matrix and a MoSCoW prioritization?"
+PLAIN_QUERY = "What is the best recipe for chocolate cake?"
+
+
+def test_jargon_cut_off_follows_the_idf_distribution(babok_vectorizer):
+
+    idf = babok_vectorizer.idf_
+    cut_offs = [QueryAnalyzer(babok_vectorizer, jargon_percentile = percentile).jargon_idf for percentile in (25, JARGON_PERCENTILE, 90)]
+
+    assert idf.min() <= cut_offs[0] <= cut_offs[1] <= cut_offs[2] <= idf.max()
+    assert cut_offs[0] < cut_offs[2]
+
+
+def test_jargon_and_plain_queries_get_different_alpha_orders(babok_vectorizer):
+
+    query_analyzer = QueryAnalyzer(babok_vectorizer)
+    jargon_analysis = query_analyzer.analyze(JARGON_QUERY)
+    plain_analysis = query_analyzer.analyze(PLAIN_QUERY)
+
+    assert jargon_analysis["jargon_share"] > plain_analysis["jargon_share"]
+    assert query_analyzer.order_alpha_values(JARGON_QUERY, ALPHA_VALUES, jargon_analysis) == [0.0, 0.5, 1.0]
+    assert query_analyzer.order_alpha_values(PLAIN_QUERY, ALPHA_VALUES, plain_analysis) == ALPHA_VALUES
+
+
+def test_unknown_terms_lower_the_coverage(babok_vectorizer):
+
+    query_analyzer = QueryAnalyzer(babok_vectorizer)
+
+    assert query_analyzer.analyze("requirements traceability matrix")["coverage"] == pytest.approx(1.0)
+    assert query_analyzer.analyze("chocolate cake recipe")["coverage"] == 0.0
+
+
+def test_query_without_terms_keeps_the_default_order(babok_vectorizer):
+
+    query_analyzer = QueryAnalyzer(babok_vectorizer)
+
+    assert query_analyzer.analyze("?!")["terms"] == 0
+    assert query_analyzer.order_alpha_values("?!", ALPHA_VALUES) == ALPHA_VALUES
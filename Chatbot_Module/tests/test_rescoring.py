@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from embedding_matrix_loader import hybrid_scale
+from local_index import LocalHybridIndex
+from pinecone_kit import rescore_pinecone_candidates
+
+
+ALPHA_VALUES = [1.0, 0.5, 0.0]
+
+
+@pytest.fixture(scope = "module")
+def small_index(chapter_texts, babok_vectorizer):
+
+    texts = chapter_texts[:200]
+    rng = np.random.default_rng(0)
+    dense_matrix = rng.normal(size = (len(texts), 32)).astype(np.float32)
+    metadata = [{"chapter_names": f"chunk_{row}", "chapter_texts": text, "page_number": row} for row, text in enumerate(texts)]
+    return LocalHybridIndex([f"id-{row}" for row in range(len(texts))], dense_matrix, babok_vectorizer.transform(texts), metadata)
+
+
+def _query_vectors(small_index, babok_vectorizer, row):
+
+    rng = np.random.default_rng(row)
+    dense = (small_index.dense_matrix[row] + rng.normal(scale = 0.5, size = small_index.dense_matrix.shape[1])).tolist()
+    sparse = babok_vectorizer.transform([small_index.metadata[row]["chapter_texts"][:200]])
+    return dense, sparse
+
+
+@pytest.mark.parametrize("row", [0, 17, 123])
+def test_rescoring_the_whole_index_matches_one_query_per_alpha(small_index, babok_vectorizer, row):
+
+    dense, sparse = _query_vectors(small_index, babok_vectorizer, row)
+    candidates = small_index.query(*hybrid_scale(dense, sparse, 0.5), top_k = len(small_index), include_values = True).to_dict()
+
+    rescored_results = rescore_pinecone_candidates(candidates, dense, sparse, ALPHA_VALUES, num_results = 3)
+
+    for alpha_value in ALPHA_VALUES:
+        exact_matches = small_index.query(*hybrid_scale(dense, sparse, alpha_value), top_k = 3).to_dict()["matches"]
+        rescored_matches = rescored_results[alpha_value]["matches"]
+        assert [match["id"] for match in rescored_matches] == [match["id"] for match in exact_matches]
+        assert [match["score"] for match in rescored_matches] == pytest.approx([match["score"] for match in exact_matches], rel = 1e-4)
+
+
+def test_rescoring_keeps_the_metadata_and_the_requested_number_of_matches(small_index, babok_vectorizer):
+
+    dense, sparse = _query_vectors(small_index, babok_vectorizer, 5)
+    candidates = small_index.query(*hybrid_scale(dense, sparse, 0.5), top_k = 25, include_metadata = True, include_values = True).to_dict()
+
+    rescored_results = rescore_pinecone_candidates(candidates, dense, sparse, ALPHA_VALUES, num_results = 4)
+
+    candidate_ids = {match["id"] for match in candidates["matches"]}
+    for alpha_value in ALPHA_VALUES:
+        matches = rescored_results[alpha_value]["matches"]
+        assert len(matches) == 4
+        assert {match["id"] for match in matches} <= candidate_ids
+        assert all("chapter_texts" in match["metadata"] for match in matches)
+        assert [match["score"] for match in matches] == sorted((match["score"] for match in matches), reverse = True)
+
+
+def test_rescoring_no_candidates(babok_vectorizer):
+
+    rescored_results = rescore_pinecone_candidates({"matches": []}, [0.0] * 32, babok_vectorizer.transform(["elicitation"]), ALPHA_VALUES)
+
+    assert rescored_results == {alpha_value: {"matches": []} for alpha_value in ALPHA_VALUES}
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from sparse_index import SparseInvertedIndex
+
+
+QUERIES = ["requirements traceability matrix",
+           "What plan will describe the stakeholder groups, communication needs, and the level of formality?",
+           "business analysis information management approach and the governance of requirements changes",
+           "elicitation",
+           ]
+
+
+@pytest.fixture(scope = "module")
+def document_matrix(chapter_texts, babok_vectorizer):
+
+    return babok_vectorizer.transform(chapter_texts)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("top_k", [1, 3, 10])
+def test_maxscore_pruning_returns_the_exhaustive_top_k(document_matrix, babok_vectorizer, query, top_k):
+
+    sparse_index = SparseInvertedIndex(document_matrix)
+    sparse_query = babok_vectorizer.transform([query])
+    exhaustive_scores = (document_matrix @ sparse_query.T).toarray().ravel()
+
+    documents, scores = sparse_index.search_csr(sparse_query, top_k)
+
+    expected_scores = np.sort(exhaustive_scores)[::-1][:top_k]
+    assert scores == pytest.approx(expected_scores, rel = 1e-5)
+    assert exhaustive_scores[documents] == pytest.approx(scores, rel = 1e-5)
+
+
+def test_pruning_skips_postings(document_matrix, babok_vectorizer):
+
+    sparse_query = babok_vectorizer.transform([QUERIES[1]])
+    pruned_index, exhaustive_index = SparseInvertedIndex(document_matrix), SparseInvertedIndex(document_matrix)
+
+    pruned_index.search_csr(sparse_query, 3)
+    exhaustive_index.search_csr(sparse_query, 3, prune = False)
+
+    assert pruned_index.counters["postings_total"] == exhaustive_index.counters["postings_total"]
+    assert exhaustive_index.counters["postings_scored"] == exhaustive_index.counters["postings_total"]
+    assert pruned_index.counters["postings_scored"] < exhaustive_index.counters["postings_scored"]
+
+
+def test_only_documents_sharing_a_term_are_returned():
+
+    sparse_index = SparseInvertedIndex(np.array([[1.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 0.0, 3.0]]))
+
+    documents, scores = sparse_index.search([1, 7], [0.5, 1.0], top_k = 3)
+
+    assert documents.tolist() == [1]
+    assert scores.tolist() == [1.0]
+    assert sparse_index.search([], [], top_k = 3)[0].size == 0
@@ -0,0 +1,280 @@
+
+"""
+tracing.py
+
+This module records where the time of a reply goes. The query path opens a span around each stage (query embedding, TF-IDF transform, Pinecone query, GPT completion, Telegram delivery); the span durations are aggregated into one latency histogram per stage, and events such as token counts are summed into counters. Everything is exported in the Prometheus text format.
+
+Tracing is off by default. A disabled tracer hands out one shared no-op span and returns from count() at once, so the instrumented code pays a single attribute check per stage.
+
+Usage:
+    tracer.enabled = True
+    with tracer.span("pinecone_query"):
+        ...
+    tracer.count("gpt_prompt_tokens", usage.prompt_tokens)
+    metrics_text = tracer.render_prometheus()
+
+    start_metrics_server(port, render) serves the text on http://<host>:<port>/metrics from a background thread.
+
+Main Classes:
+- LatencyHistogram: Cumulative-bucket latency histogram, as exported by Prometheus.
+- Tracer: Spans, counters and Prometheus text rendering.
+
+Main Functions:
+- start_metrics_server: Serves a Prometheus text endpoint from a daemon thread, next to an event loop that is not an HTTP server.
+
+Constants:
+- tracer: The process-wide Tracer used by the instrumented modules.
+"""
+
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from auxiliaries import List, Dict, Tuple, Union, Callable
+
+
+
+# Upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = "chatbot"
+
+
+
+class LatencyHistogram:
+
+    """A latency histogram with fixed bucket bounds, plus the count and sum of the observations."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+
+        self.buckets = buckets
+        self.bucket_counts: List[int] = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, seconds: float)-> None:
+
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        if bucket < len(self.buckets):
+            self.bucket_counts[bucket] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+    def cumulative_counts(self)-> List[int]:
+
+        """Returns the number of observations at or below each bucket bound, as Prometheus expects."""
+
+        cumulative, total = [], 0
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+            cumulative.append(total)
+        return cumulative
+
+
+
+class _Span:
+
+    __slots__ = ("tracer", "stage", "start")
+
+    def __init__(self, tracer: "Tracer", stage: str):
+
+        self.tracer = tracer
+        self.stage = stage
+
+
+    def __enter__(self)-> "_Span":
+
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info)-> bool:
+
+        self.tracer.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+
+class _NoSpan:
+
+    """The span handed out by a disabled tracer: it does nothing."""
+
+    def __enter__(self)-> "_NoSpan":
+
+        return self
+
+
+    def __exit__(self, *exc_info)-> bool:
+
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+
+class Tracer:
+
+    """
+    Aggregates span durations into per-stage histograms and events into counters.
+
+    Spans may be opened from the event loop and from worker threads (the Pinecone queries run in the
+    default thread pool), so the aggregates are updated under a lock.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+
+        """
+        Initializes the Tracer instance.
+
+        Args:
+            enabled (bool): Whether spans and counts are recorded. Defaults to False.
+            buckets (Tuple[float, ...]): Upper bounds of the latency buckets, in seconds. Defaults to DEFAULT_BUCKETS.
+        """
+
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, float] = {}
+
+
+    def span(self, stage: str)-> Union[_Span, _NoSpan]:
+
+        """
+        Returns a context manager timing one execution of a stage.
+
+        Args:
+            stage (str): The stage name, used as the "stage" label of the histogram.
+
+        Returns:
+            Union[_Span, _NoSpan]: The span, or a shared no-op span when tracing is disabled.
+        """
+
+        return _Span(self, stage) if self.enabled else _NO_SPAN
+
+
+    def observe(self, stage: str, seconds: float)-> None:
+
+        """Records a duration measured outside a span (e.g. the time to the first streamed token)."""
+
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram(self.buckets)
+            histogram.observe(seconds)
+
+
+    def count(self, event: str, value: float = 1)-> None:
+
+        """Adds value to the counter of an event (e.g. "gpt_prompt_tokens")."""
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + value
+
+
+    def reset(self)-> None:
+
+        """Discards the recorded histograms and counters."""
+
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+    def render_prometheus(self,
+                          gauges: Union[Dict[str, float], None] = None,
+                          component_counters: Union[Dict[str, Dict[str, float]], None] = None
+                          )-> str:
+
+        """
+        Renders the histograms and counters in the Prometheus text exposition format.
+
+        Args:
+            gauges (Union[Dict[str, float], None]): Current values to export as gauges (e.g. the queue depth).
+            component_counters (Union[Dict[str, Dict[str, float]], None]): Counters kept by other components
+                (e.g. the cache hit/miss counters), keyed by component name.
+
+        Returns:
+            str: The metrics text.
+        """
+
+        lines: List[str] = []
+        with self._lock:
+            histograms = {stage: (histogram.cumulative_counts(), histogram.count, histogram.sum)
+                          for stage, histogram in self.histograms.items()
+                          }
+            counters = dict(self.counters)
+
+        histogram_name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines += [f"# HELP {histogram_name} Duration of the query pipeline stages.", f"# TYPE {histogram_name} histogram"]
+        for stage, (cumulative_counts, count, total) in sorted(histograms.items()):
+            for bound, bucket_count in zip(self.buckets, cumulative_counts):
+                lines.append(f'{histogram_name}_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+            lines.append(f'{histogram_name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{histogram_name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{histogram_name}_count{{stage="{stage}"}} {count}')
+
+        counter_name = f"{METRIC_PREFIX}_events_total"
+        lines += [f"# HELP {counter_name} Events counted on the query path (tokens, cache hits, ...).", f"# TYPE {counter_name} counter"]
+        for event, value in sorted(counters.items()):
+            lines.append(f'{counter_name}{{event="{event}"}} {value}')
+
+        component_name = f"{METRIC_PREFIX}_component_events_total"
+        lines += [f"# HELP {component_name} Counters kept by the chatbot components.", f"# TYPE {component_name} counter"]
+        for component, component_values in sorted((component_counters or {}).items()):
+            for event, value in sorted(component_values.items()):
+                lines.append(f'{component_name}{{component="{component}",event="{event}"}} {value}')
+
+        for gauge, value in sorted((gauges or {}).items()):
+            lines += [f"# TYPE {METRIC_PREFIX}_{gauge} gauge", f"{METRIC_PREFIX}_{gauge} {value}"]
+
+        return "\n".join(lines) + "\n"
+
+
+
+def start_metrics_server(port: int, render: Callable[[], str], host: str = "0.0.0.0")-> ThreadingHTTPServer:
+
+    """
+    Serves GET /metrics with the text returned by render, from a daemon thread.
+
+    Args:
+        port (int): The port to listen on.
+        render (Callable[[], str]): Returns the metrics text (e.g. tracer.render_prometheus).
+        host (str): The interface to listen on. Defaults to all interfaces.
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it).
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+
+tracer = Tracer()
@@ -50,7 +50,7 @@ class PineconeOperations:
         
         self.pinecone_client = pinecone_client
         self.index_name = index_name
-        pinecone_index_client: pc.Index = self.pinecone_client.Index(self.index_name)
+        self.pinecone_index_client: pc.Index = self.pinecone_client.Index(self.index_name)
     
     
     
@@ -163,7 +163,7 @@ class PineconeOperations:
             None
         """
         
-        if not self.index_name in pc.list_indexes().names():
+        if not self.index_name in self.pinecone_client.list_indexes().names():
             self.pinecone_client.create_index(
                 name= self.index_name,
                 dimension=embedding_dimension, # Replace with your model dimensions